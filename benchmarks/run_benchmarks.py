@@ -0,0 +1,190 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import resource
+import tempfile
+import time
+
+import numpy
+
+from join_vcfs.vcf_parser import parse_vcf
+from join_vcfs.vcf_joining import (
+    create_vcf_infos,
+    group_overlapping_vars,
+    close_vcf_infos,
+    join_vcfs,
+)
+from benchmarks.synthetic_vcfs import (
+    generate_synthetic_vcfs,
+    DEFAULT_SYNTHETIC_VCF_CONFIG,
+)
+
+BENCHMARK_FORMAT_VERSION = 1
+# the settings of every scenario override the default synthetic VCF config
+SCENARIOS = {
+    "default": {},
+    "many_samples": {"num_samples": 200, "num_vars": 2000},
+    "dense_vars": {"var_density": 200.0},
+    "long_indels": {"indel_rate": 0.5, "max_indel_len": 50},
+    "no_overlap": {"overlap_rate": 0.0},
+    "full_overlap": {"overlap_rate": 1.0},
+    "haploid": {"ploidy": 1},
+    "tetraploid": {"ploidy": 4},
+    "high_missingness": {"missing_rate": 0.5},
+    "gzip": {"compression": "gzip"},
+    "bgzf": {"compression": "bgzf"},
+}
+
+
+def _get_peak_rss_kib():
+    # ru_maxrss is given in KiB in Linux and in bytes in macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss // 1024 if platform.system() == "Darwin" else peak_rss
+
+
+def _measure_parse(vcf_paths, _):
+    num_lines = 0
+    start = time.perf_counter()
+    for path in vcf_paths:
+        result = parse_vcf(path, as_batches=True)
+        num_lines += sum(batch.poss.size for batch in result["var_batches"])
+        result["fhand"].close()
+    return {"items": num_lines, "seconds": time.perf_counter() - start}
+
+
+def _measure_grouping(vcf_paths, chromosomes):
+    start = time.perf_counter()
+    vcf_infos = create_vcf_infos(vcf_paths)
+    try:
+        num_groups = sum(1 for _ in group_overlapping_vars(vcf_infos, chromosomes))
+    finally:
+        close_vcf_infos(vcf_infos)
+    return {"items": num_groups, "seconds": time.perf_counter() - start}
+
+
+def _measure_join(vcf_paths, chromosomes):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = Path(tmp_dir) / "joined.vcf"
+        start = time.perf_counter()
+        join_vcfs(vcf_paths, chromosomes, out_path)
+        seconds = time.perf_counter() - start
+        with out_path.open("rb") as fhand:
+            num_vars = sum(1 for line in fhand if not line.startswith(b"#"))
+    return {"items": num_vars, "seconds": seconds}
+
+
+def _measure_in_child(measure, vcf_paths, chromosomes):
+    result = measure(vcf_paths, chromosomes)
+    result["peak_rss_kib"] = _get_peak_rss_kib()
+    return result
+
+
+def _run_measure(measure, vcf_paths, chromosomes, repeats):
+    # every run is done in a new process, so its peak RSS is its own, the
+    # fastest run is kept
+    runs = []
+    for _ in range(repeats):
+        with ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            runs.append(
+                executor.submit(
+                    _measure_in_child, measure, vcf_paths, chromosomes
+                ).result()
+            )
+    best_run = min(runs, key=lambda run: run["seconds"])
+    best_run["peak_rss_kib"] = max(run["peak_rss_kib"] for run in runs)
+    best_run["items_per_second"] = best_run["items"] / max(best_run["seconds"], 1e-9)
+    return best_run
+
+
+def _get_package_version():
+    try:
+        return metadata.version("join-vcfs")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def run_scenario(name, config, work_dir, repeats=1) -> dict:
+    synthetic = generate_synthetic_vcfs(Path(work_dir) / name, config)
+    vcf_paths, chromosomes = synthetic["vcf_paths"], synthetic["chromosomes"]
+    join_result = _run_measure(_measure_join, vcf_paths, chromosomes, repeats)
+    # the end to end throughput is given in input vars per second
+    join_result["input_vars_per_second"] = sum(synthetic["num_vars"]) / max(
+        join_result["seconds"], 1e-9
+    )
+    return {
+        "name": name,
+        "config": config,
+        "num_input_vars": sum(synthetic["num_vars"]),
+        "input_bytes": sum(path.stat().st_size for path in vcf_paths),
+        "parse": _run_measure(_measure_parse, vcf_paths, chromosomes, repeats),
+        "grouping": _run_measure(_measure_grouping, vcf_paths, chromosomes, repeats),
+        "join": join_result,
+    }
+
+
+def run_benchmarks(
+    out_json_path: Path,
+    scenario_names: list[str] | None = None,
+    work_dir: Path | None = None,
+    scale: float = 1.0,
+    repeats: int = 1,
+) -> dict:
+    # parse items are var lines, grouping items var groups and join items
+    # output vars, scale multiplies the number of vars of every scenario
+    if scenario_names is None:
+        scenario_names = list(SCENARIOS)
+    unknown_scenarios = set(scenario_names).difference(SCENARIOS)
+    if unknown_scenarios:
+        raise ValueError(f"Unknown benchmark scenarios: {sorted(unknown_scenarios)}")
+
+    scenarios = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for name in scenario_names:
+            config = dict(SCENARIOS[name])
+            num_vars = config.get("num_vars", DEFAULT_SYNTHETIC_VCF_CONFIG["num_vars"])
+            config["num_vars"] = max(int(num_vars * scale), 1)
+            scenarios.append(run_scenario(name, config, tmp_dir, repeats))
+
+    results = {
+        "format_version": BENCHMARK_FORMAT_VERSION,
+        "join_vcfs_version": _get_package_version(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "scale": scale,
+        "scenarios": scenarios,
+    }
+    Path(out_json_path).write_text(json.dumps(results, indent=2) + "\n")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the parsing and joining of synthetic VCFs"
+    )
+    parser.add_argument("out_json", type=Path)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS))
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--work-dir", type=Path)
+    args = parser.parse_args()
+    run_benchmarks(
+        args.out_json,
+        scenario_names=args.scenarios,
+        work_dir=args.work_dir,
+        scale=args.scale,
+        repeats=args.repeats,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+from pathlib import Path
+
+import numpy
+
+from join_vcfs.vcf_parser import VCF_SAMPLE_LINE_ITEMS
+from join_vcfs.vcf_writer import Compression, open_output, GT_FORMAT_HEADER_LINE
+
+# var_density is given in vars per kb, overlap_rate is the fraction of the
+# vars of every input found at the same sites in all the other inputs
+DEFAULT_SYNTHETIC_VCF_CONFIG = {
+    "num_vcfs": 4,
+    "num_samples": 10,
+    "num_vars": 10000,
+    "num_chroms": 2,
+    "var_density": 10.0,
+    "indel_rate": 0.1,
+    "max_indel_len": 10,
+    "overlap_rate": 0.5,
+    "ploidy": 2,
+    "missing_rate": 0.05,
+    "alt_allele_freq": 0.2,
+    "compression": "plain",
+    "seed": 42,
+}
+_BASES = numpy.frombuffer(b"ACGT", dtype=numpy.uint8)
+_SUFFIXES = {"plain": ".vcf", "gzip": ".vcf.gz", "bgzf": ".vcf.gz"}
+
+
+def _create_sites(rng, ref_seq, num_sites, config):
+    # every site is a (pos, ref, alt) tuple, pos is 1-based
+    max_pos = ref_seq.size - config["max_indel_len"] - 1
+    poss = rng.integers(1, max_pos, size=num_sites)
+    is_indel = rng.random(num_sites) < config["indel_rate"]
+    is_deletion = rng.random(num_sites) < 0.5
+    indel_lens = rng.integers(1, config["max_indel_len"] + 1, size=num_sites)
+    sites = []
+    for pos, indel, deletion, indel_len in zip(
+        poss.tolist(), is_indel.tolist(), is_deletion.tolist(), indel_lens.tolist()
+    ):
+        ref = ref_seq[pos - 1 : pos].tobytes()
+        if not indel:
+            alt = bytes([rng.choice(_BASES[_BASES != ref[0]])])
+        elif deletion:
+            ref, alt = ref_seq[pos - 1 : pos + indel_len].tobytes(), ref
+        else:
+            alt = ref + rng.choice(_BASES, size=indel_len).tobytes()
+        sites.append((pos, ref, alt))
+    return sites
+
+
+def _remove_overlapping_sites(sites):
+    # the vars of a single input do not overlap, as in a per sample VCF
+    kept_sites = []
+    last_end = 0
+    for site in sorted(sites):
+        if site[0] <= last_end:
+            continue
+        kept_sites.append(site)
+        last_end = site[0] + len(site[1]) - 1
+    return kept_sites
+
+
+def _create_gt_chars(rng, num_vars, config):
+    # (num_vars, num_samples, 2 * ploidy) chars: "0/1\t...1/1\n"
+    num_samples, ploidy = config["num_samples"], config["ploidy"]
+    shape = (num_vars, num_samples, ploidy)
+    alleles = (rng.random(shape) < config["alt_allele_freq"]).astype(numpy.uint8)
+    gt_chars = numpy.empty((num_vars, num_samples, 2 * ploidy), dtype=numpy.uint8)
+    gt_chars[:, :, 0::2] = numpy.where(
+        rng.random(shape) < config["missing_rate"], ord("."), ord("0") + alleles
+    )
+    gt_chars[:, :, 1:-1:2] = ord("/")
+    gt_chars[:, :, -1] = ord("\t")
+    gt_chars[:, -1, -1] = ord("\n")
+    return gt_chars
+
+
+def _write_synthetic_vcf(path, chrom_sites, samples, rng, config):
+    header = [b"##fileformat=VCFv4.5", GT_FORMAT_HEADER_LINE.encode()]
+    header.extend(f"##contig=<ID={chrom}>".encode() for chrom in chrom_sites)
+    header.append("\t".join(VCF_SAMPLE_LINE_ITEMS + samples).encode())
+    num_vars = 0
+    with open_output(path, Compression(config["compression"])) as fhand:
+        fhand.write(b"\n".join(header) + b"\n")
+        for chrom, sites in chrom_sites.items():
+            gt_chars = _create_gt_chars(rng, len(sites), config)
+            for (pos, ref, alt), var_gt_chars in zip(sites, gt_chars):
+                fhand.write(b"%s\t%d\t.\t%s\t%s\t.\t.\t.\tGT\t" % (chrom.encode(), pos, ref, alt))
+                fhand.write(var_gt_chars.tobytes())
+            num_vars += len(sites)
+    return num_vars
+
+
+def generate_synthetic_vcfs(out_dir: Path, config: dict | None = None) -> dict:
+    # Writes num_vcfs per sample VCFs with about num_vars vars each, the vars
+    # that would overlap others of the same input are dropped. The REF
+    # alleles are taken from a random reference, so they are consistent
+    # between inputs.
+    config = DEFAULT_SYNTHETIC_VCF_CONFIG | (config or {})
+    if config["compression"] not in _SUFFIXES:
+        raise ValueError(f"Unknown compression: {config['compression']}")
+    rng = numpy.random.default_rng(config["seed"])
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    chroms = [f"chr{idx + 1}" for idx in range(config["num_chroms"])]
+    num_vars_per_chrom = max(config["num_vars"] // len(chroms), 1)
+    chrom_len = int(num_vars_per_chrom / config["var_density"] * 1000) + 2 * (
+        config["max_indel_len"] + 1
+    )
+    num_shared_sites = round(num_vars_per_chrom * config["overlap_rate"])
+    ref_seqs = {}
+    shared_sites = {}
+    for chrom in chroms:
+        ref_seqs[chrom] = rng.choice(_BASES, size=chrom_len)
+        shared_sites[chrom] = _create_sites(rng, ref_seqs[chrom], num_shared_sites, config)
+
+    vcf_paths = []
+    nums_vars = []
+    for vcf_idx in range(config["num_vcfs"]):
+        chrom_sites = {}
+        for chrom in chroms:
+            private_sites = _create_sites(
+                rng, ref_seqs[chrom], num_vars_per_chrom - num_shared_sites, config
+            )
+            chrom_sites[chrom] = _remove_overlapping_sites(
+                shared_sites[chrom] + private_sites
+            )
+        samples = [f"vcf{vcf_idx}_s{idx}" for idx in range(config["num_samples"])]
+        path = out_dir / f"synthetic_{vcf_idx:04d}{_SUFFIXES[config['compression']]}"
+        nums_vars.append(_write_synthetic_vcf(path, chrom_sites, samples, rng, config))
+        vcf_paths.append(path)
+    return {"vcf_paths": vcf_paths, "chromosomes": chroms, "num_vars": nums_vars}
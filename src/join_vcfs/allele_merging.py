@@ -0,0 +1,281 @@
+import numpy
+
+from join_vcfs.vcf_parser import MISSING_ALLELE, ABSENT_ALLELE, GT_NUMPY_DTYPE, SparseGTs
+
+MAX_ALLELE_COMBINATION_CODE = 2**62
+
+
+def _is_symbolic_allele(allele):
+    return allele.startswith("<") or allele == "*"
+
+
+def _build_group_ref(var_group):
+    chrom, start, end = var_group.span
+    ref = [None] * (end - start + 1)
+    for vars in var_group.vars.values():
+        for var in vars:
+            offset = var["pos"] - start
+            for idx, base in enumerate(var["alleles"][0], start=offset):
+                if ref[idx] is None:
+                    ref[idx] = base
+                elif ref[idx] != base:
+                    raise ValueError(
+                        f"Overlapping variants with inconsistent REF alleles at {chrom}:{start + idx}"
+                    )
+    if None in ref:
+        raise ValueError(
+            f"Implementation error, the variant group does not cover every position: {chrom}:{start}-{end}"
+        )
+    return "".join(ref)
+
+
+def _pad_allele(allele, var, group_ref, group_start):
+    # the allele is extended with the group REF bases that the var REF does not cover
+    left = var["pos"] - group_start
+    right = left + len(var["alleles"][0])
+    if left == 0 and right == len(group_ref):
+        return allele
+    if _is_symbolic_allele(allele):
+        raise NotImplementedError(
+            f"Symbolic alleles overlapping other variants can not be merged: {allele} at {group_start + left}"
+        )
+    return group_ref[:left] + allele + group_ref[right:]
+
+
+def _get_allele_idx(allele, allele_idxs, alleles):
+    try:
+        return allele_idxs[allele]
+    except KeyError:
+        idx = len(alleles)
+        allele_idxs[allele] = idx
+        alleles.append(allele)
+        return idx
+
+
+def _check_gts(var, chrom):
+    if var["gts"].size and var["gts"].max() >= len(var["alleles"]):
+        raise ValueError(
+            f"Genotype with an allele index not found in the alleles: {chrom}:{var['pos']}"
+        )
+
+
+def _remap_single_var_gts(
+    var, group_ref, group_start, allele_idxs, alleles, absent_allele=MISSING_ALLELE
+):
+    allele_lut = [
+        _get_allele_idx(
+            _pad_allele(allele, var, group_ref, group_start), allele_idxs, alleles
+        )
+        for allele in var["alleles"]
+    ]
+    allele_lut = numpy.array(allele_lut, dtype=GT_NUMPY_DTYPE)
+    # missing alleles are -1, they are masked after the take
+    remapped = allele_lut.take(var["gts"], mode="wrap")
+    remapped[var["missing_mask"]] = MISSING_ALLELE
+    remapped[var["gts"] == ABSENT_ALLELE] = absent_allele
+    return remapped
+
+
+def _build_haplotype(vars, var_alleles, group_ref, group_start):
+    haplotype = group_ref
+    last_edited_start = len(group_ref)
+    # vars are sorted by position, editing from the right keeps the offsets valid
+    for var, allele_idx in zip(reversed(vars), reversed(var_alleles)):
+        if allele_idx == 0:
+            continue
+        left = var["pos"] - group_start
+        right = left + len(var["alleles"][0])
+        if right > last_edited_start:
+            # two alternative alleles from the same input overlap
+            return None
+        allele = var["alleles"][allele_idx]
+        if _is_symbolic_allele(allele):
+            raise NotImplementedError(
+                f"Symbolic alleles overlapping other variants can not be merged: {allele} at {var['pos']}"
+            )
+        haplotype = haplotype[:left] + allele + haplotype[right:]
+        last_edited_start = left
+    return haplotype
+
+
+def _remap_several_vars_gts(
+    vars,
+    group_ref,
+    group_start,
+    allele_idxs,
+    alleles,
+    absent_allele=MISSING_ALLELE,
+):
+    # Every sample haplotype is given by the combination of the alleles that
+    # it has in each var, so the combinations are encoded as a mixed radix
+    # number and only the distinct ones are translated into merged alleles.
+    # An ABSENT_ALLELE means that the haplotype had no var there, so it is
+    # REF unless it is absent in every var, then it gets the absent_allele.
+    codes = numpy.zeros(vars[0]["gts"].shape, dtype=numpy.int64)
+    missing_mask = numpy.zeros(vars[0]["gts"].shape, dtype=bool)
+    absent_mask = numpy.ones(vars[0]["gts"].shape, dtype=bool)
+    num_alleles = []
+    radix = 1
+    for var in vars:
+        codes += numpy.where(var["missing_mask"], 0, var["gts"]) * radix
+        is_absent = var["gts"] == ABSENT_ALLELE
+        absent_mask &= is_absent
+        missing_mask |= var["missing_mask"] & ~is_absent
+        num_alleles.append(len(var["alleles"]))
+        radix *= len(var["alleles"])
+        if radix > MAX_ALLELE_COMBINATION_CODE:
+            raise NotImplementedError(
+                f"Too many overlapping variants from the same VCF to be merged at {vars[0]['pos']}"
+            )
+
+    unique_codes, inverse = numpy.unique(codes, return_inverse=True)
+    allele_lut = []
+    for code in unique_codes.tolist():
+        var_alleles = []
+        for var_num_alleles in num_alleles:
+            code, allele_idx = divmod(code, var_num_alleles)
+            var_alleles.append(allele_idx)
+        haplotype = _build_haplotype(vars, var_alleles, group_ref, group_start)
+        if haplotype is None:
+            allele_lut.append(MISSING_ALLELE)
+        else:
+            allele_lut.append(_get_allele_idx(haplotype, allele_idxs, alleles))
+    allele_lut = numpy.array(allele_lut, dtype=GT_NUMPY_DTYPE)
+
+    remapped = allele_lut.take(inverse).reshape(codes.shape)
+    remapped[missing_mask] = MISSING_ALLELE
+    remapped[absent_mask] = absent_allele
+    return remapped
+
+
+def merge_var_group(
+    var_group,
+    sample_slices,
+    num_samples,
+    ploidy,
+    absent_allele=MISSING_ALLELE,
+) -> dict:
+    # If the vars have SparseGTs the merged ones are SparseGTs filled with
+    # the absent_allele. The samples without vars in the group get the
+    # absent_allele, missing unless the group is written to an intermediate.
+    first_vars = next(iter(var_group.vars.values()))
+    if isinstance(first_vars[0]["gts"], SparseGTs):
+        return _merge_sparse_var_group(
+            var_group,
+            sample_slices,
+            num_samples,
+            ploidy,
+            absent_allele,
+        )
+    chrom, group_start, _ = var_group.span
+    group_ref = _build_group_ref(var_group)
+    alleles = [group_ref]
+    allele_idxs = {group_ref: 0}
+
+    gts = numpy.full((num_samples, ploidy), absent_allele, dtype=GT_NUMPY_DTYPE)
+    for vcf_id in sorted(var_group.vars):
+        vars = var_group.vars[vcf_id]
+        for var in vars:
+            _check_gts(var, chrom)
+        if len(vars) == 1:
+            remapped = _remap_single_var_gts(
+                vars[0], group_ref, group_start, allele_idxs, alleles, absent_allele
+            )
+        else:
+            remapped = _remap_several_vars_gts(
+                vars,
+                group_ref,
+                group_start,
+                allele_idxs,
+                alleles,
+                absent_allele,
+            )
+        gts[sample_slices[vcf_id]] = remapped
+    # the samples of the gVCFs with a reference block that covers the group
+    # get its GTs
+    for vcf_id, ref_gts in (var_group.ref_gts or {}).items():
+        gts[sample_slices[vcf_id]] = ref_gts
+
+    return {
+        "chrom": chrom,
+        "pos": group_start,
+        "alleles": alleles,
+        "gts": gts,
+        "missing_mask": gts < 0,
+    }
+
+
+def _gather_sparse_gts(vars):
+    # The GTs of the vars of a VCF are gathered at the positions in which any
+    # of them differs from ABSENT, or at all the positions for other fills,
+    # as 1D arrays that can be remapped as the dense ones. The positions in
+    # which all of them are ABSENT are also absent in the merged GTs.
+    shape = vars[0]["gts"].shape
+    if all(var["gts"].fill == ABSENT_ALLELE for var in vars):
+        idxs = numpy.unique(numpy.concatenate([var["gts"].idxs for var in vars]))
+    else:
+        idxs = numpy.arange(shape[0] * shape[1])
+    gathered_vars = []
+    for var in vars:
+        sparse_gts = var["gts"]
+        gts = numpy.full(idxs.shape, sparse_gts.fill, dtype=GT_NUMPY_DTYPE)
+        gts[numpy.searchsorted(idxs, sparse_gts.idxs)] = sparse_gts.values
+        gathered_vars.append(dict(var, gts=gts, missing_mask=gts < 0))
+    return idxs, gathered_vars
+
+
+def _merge_sparse_var_group(
+    var_group, sample_slices, num_samples, ploidy, absent_allele
+):
+    chrom, group_start, _ = var_group.span
+    group_ref = _build_group_ref(var_group)
+    alleles = [group_ref]
+    allele_idxs = {group_ref: 0}
+
+    # samples without vars in this group are left absent, so only the GTs
+    # of the samples with vars are stored
+    merged_idxs = []
+    merged_values = []
+    ref_gts = var_group.ref_gts or {}
+    for vcf_id in sorted(set(var_group.vars).union(ref_gts)):
+        if vcf_id in ref_gts:
+            remapped = ref_gts[vcf_id].ravel()
+            is_not_missing = remapped != MISSING_ALLELE
+            merged_idxs.append(
+                numpy.flatnonzero(is_not_missing) + sample_slices[vcf_id].start * ploidy
+            )
+            merged_values.append(remapped[is_not_missing])
+            continue
+        idxs, vars = _gather_sparse_gts(var_group.vars[vcf_id])
+        for var in vars:
+            _check_gts(var, chrom)
+        if len(vars) == 1:
+            remapped = _remap_single_var_gts(
+                vars[0], group_ref, group_start, allele_idxs, alleles, absent_allele
+            )
+        else:
+            remapped = _remap_several_vars_gts(
+                vars,
+                group_ref,
+                group_start,
+                allele_idxs,
+                alleles,
+                absent_allele,
+            )
+        is_not_absent = remapped != absent_allele
+        merged_idxs.append(idxs[is_not_absent] + sample_slices[vcf_id].start * ploidy)
+        merged_values.append(remapped[is_not_absent])
+
+    gts = SparseGTs(
+        (num_samples, ploidy),
+        absent_allele,
+        numpy.concatenate(merged_idxs),
+        numpy.concatenate(merged_values),
+    )
+    return {
+        "chrom": chrom,
+        "pos": group_start,
+        "alleles": alleles,
+        "gts": gts,
+        "missing_mask": None,
+    }
@@ -0,0 +1,212 @@
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+# BGZF is a series of gzip members, each one with an extra "BC" subfield that
+# stores the compressed size of the block, so blocks can be located without
+# inflating them.
+BGZF_MAX_BLOCK_DATA_SIZE = 0xFF00
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_HEADER_SIZE = BGZF_HEADER.size
+BGZF_FOOTER = struct.Struct("<II")
+BGZF_FOOTER_SIZE = BGZF_FOOTER.size
+BGZF_EOF_BLOCK = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+GZIP_FIXED_HEADER_SIZE = 12
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_NUM_DECOMPRESSION_THREADS = min(4, os.cpu_count() or 1)
+BLOCKS_IN_FLIGHT_PER_THREAD = 4
+
+
+def _compress_block(data, level=DEFAULT_COMPRESSION_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    block_size = BGZF_HEADER_SIZE + len(compressed) + BGZF_FOOTER_SIZE
+    header = BGZF_HEADER.pack(
+        0x1F, 0x8B, 8, 4, 0, 0, 0xFF, 6, ord("B"), ord("C"), 2, block_size - 1
+    )
+    footer = BGZF_FOOTER.pack(zlib.crc32(data), len(data))
+    return header + compressed + footer
+
+
+class BGZFWriter:
+    def __init__(
+        self, fhand, compression_level=DEFAULT_COMPRESSION_LEVEL, write_eof=True
+    ):
+        # Without the EOF block the output can be concatenated to other BGZF files
+        self._fhand = fhand
+        self._compression_level = compression_level
+        self._write_eof = write_eof
+        self._buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= BGZF_MAX_BLOCK_DATA_SIZE:
+            self._write_full_blocks()
+        return len(data)
+
+    def _write_full_blocks(self):
+        buffer = self._buffer
+        start = 0
+        while len(buffer) - start >= BGZF_MAX_BLOCK_DATA_SIZE:
+            end = start + BGZF_MAX_BLOCK_DATA_SIZE
+            self._fhand.write(_compress_block(buffer[start:end], self._compression_level))
+            start = end
+        del buffer[:start]
+
+    def flush(self):
+        self._write_full_blocks()
+        if self._buffer:
+            self._fhand.write(_compress_block(self._buffer, self._compression_level))
+            self._buffer.clear()
+        self._fhand.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self._write_eof:
+            self._fhand.write(BGZF_EOF_BLOCK)
+        self._fhand.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _get_bsize_from_extra_field(extra):
+    idx = 0
+    while idx + 4 <= len(extra):
+        slen = int.from_bytes(extra[idx + 2 : idx + 4], "little")
+        if extra[idx : idx + 2] == b"BC" and slen == 2:
+            return int.from_bytes(extra[idx + 4 : idx + 6], "little")
+        idx += 4 + slen
+    return None
+
+
+def is_bgzf(start: bytes) -> bool:
+    # start should hold at least the 12 bytes of the gzip header plus the extra field
+    if start[:4] != BGZF_MAGIC or len(start) < GZIP_FIXED_HEADER_SIZE:
+        return False
+    xlen = int.from_bytes(start[10:12], "little")
+    extra = start[GZIP_FIXED_HEADER_SIZE : GZIP_FIXED_HEADER_SIZE + xlen]
+    return _get_bsize_from_extra_field(extra) is not None
+
+
+def read_bgzf_block(fhand):
+    header = fhand.read(GZIP_FIXED_HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < GZIP_FIXED_HEADER_SIZE or header[:4] != BGZF_MAGIC:
+        raise ValueError("Invalid BGZF block header")
+    xlen = int.from_bytes(header[10:12], "little")
+    bsize = _get_bsize_from_extra_field(fhand.read(xlen))
+    if bsize is None:
+        raise ValueError("Invalid BGZF block, it has no BC extra subfield")
+    # the block holds the deflated data followed by the CRC32 and ISIZE
+    block_rest_size = bsize + 1 - GZIP_FIXED_HEADER_SIZE - xlen
+    block = fhand.read(block_rest_size)
+    if len(block) != block_rest_size:
+        raise ValueError("Truncated BGZF block")
+    return block
+
+
+def inflate_bgzf_block(block):
+    data = zlib.decompress(block[:-BGZF_FOOTER_SIZE], -15)
+    if len(data) != int.from_bytes(block[-4:], "little"):
+        raise ValueError("Corrupted BGZF block, the uncompressed size does not match")
+    return data
+
+
+class BGZFReader:
+    def __init__(
+        self,
+        fhand,
+        num_threads: int = DEFAULT_NUM_DECOMPRESSION_THREADS,
+        executor: ThreadPoolExecutor | None = None,
+    ):
+        self._fhand = fhand
+        self._own_executor = False
+        if executor is None and num_threads > 1:
+            executor = ThreadPoolExecutor(num_threads)
+            self._own_executor = True
+        self._executor = executor
+        self._max_blocks_in_flight = max(num_threads, 1) * BLOCKS_IN_FLIGHT_PER_THREAD
+        self._lines = self._iter_lines()
+        self.closed = False
+
+    def _iter_blocks(self):
+        fhand = self._fhand
+        if self._executor is None:
+            while (block := read_bgzf_block(fhand)) is not None:
+                yield inflate_bgzf_block(block)
+            return
+
+        # zlib releases the GIL, so the blocks are inflated in parallel while
+        # they are yielded in file order
+        in_flight = deque()
+        while True:
+            while len(in_flight) < self._max_blocks_in_flight:
+                block = read_bgzf_block(fhand)
+                if block is None:
+                    break
+                in_flight.append(self._executor.submit(inflate_bgzf_block, block))
+            if not in_flight:
+                break
+            yield in_flight.popleft().result()
+
+    def iter_chunks(self, skip_bytes: int = 0):
+        remainder = b""
+        for data in self._iter_blocks():
+            if skip_bytes:
+                data = data[skip_bytes:]
+                skip_bytes = 0
+            last_newline = data.rfind(b"\n")
+            if last_newline == -1:
+                remainder += data
+                continue
+            yield remainder + data[: last_newline + 1]
+            remainder = data[last_newline + 1 :]
+        if remainder:
+            yield remainder
+
+    def _iter_lines(self, skip_bytes=0):
+        for chunk in self.iter_chunks(skip_bytes):
+            yield from chunk.splitlines(keepends=True)
+
+    def seek_virtual_offset(self, virtual_offset: int):
+        # the virtual offset is the compressed offset of the block in the
+        # upper 48 bits and the offset inside the uncompressed block in the lower 16
+        self._lines.close()
+        self._fhand.seek(virtual_offset >> 16)
+        self._lines = self._iter_lines(skip_bytes=virtual_offset & 0xFFFF)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def close(self):
+        if self.closed:
+            return
+        self._lines.close()
+        if self._own_executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        self._fhand.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
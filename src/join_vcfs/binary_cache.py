@@ -0,0 +1,175 @@
+from pathlib import Path
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy
+
+# A binary cache file holds a source key, a JSON header and a series of
+# aligned arrays that are memory mapped when the file is read:
+# magic, key (source size, mtime and content hash), header size, header, arrays
+BINARY_CACHE_MAGIC = b"JVCFBIN\x02"
+BINARY_CACHE_SUFFIX = ".jvb"
+_SOURCE_KEY = struct.Struct("<Qq32s")
+_HEADER_SIZE = struct.Struct("<Q")
+_KEY_OFFSET = len(BINARY_CACHE_MAGIC)
+_ARRAYS_ALIGNMENT = 64
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: Path) -> bytes:
+    hasher = hashlib.blake2b(digest_size=32)
+    with Path(path).open("rb") as fhand:
+        while chunk := fhand.read(_HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.digest()
+
+
+def get_binary_cache_path(cache_dir: Path, source_path: Path) -> Path:
+    source_path = Path(source_path).absolute()
+    path_hash = hashlib.blake2b(str(source_path).encode(), digest_size=16).hexdigest()
+    return Path(cache_dir) / f"{source_path.name}.{path_hash}{BINARY_CACHE_SUFFIX}"
+
+
+def _align(offset):
+    return -(-offset // _ARRAYS_ALIGNMENT) * _ARRAYS_ALIGNMENT
+
+
+def write_binary_cache(
+    cache_path: Path, source_path: Path, header: dict, arrays: dict[str, numpy.ndarray]
+):
+    source_path = Path(source_path).absolute()
+    stat = source_path.stat()
+    source_key = _SOURCE_KEY.pack(stat.st_size, stat.st_mtime_ns, hash_file(source_path))
+
+    arrays = {name: numpy.ascontiguousarray(array) for name, array in arrays.items()}
+    header = dict(header, source_path=str(source_path), arrays={})
+    # the array offsets depend on the header size, so they are given relative
+    # to the end of the header and the data start is aligned
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + array.nbytes)
+    encoded_header = json.dumps(header).encode()
+    data_start = _align(
+        len(BINARY_CACHE_MAGIC) + _SOURCE_KEY.size + _HEADER_SIZE.size + len(encoded_header)
+    )
+
+    def write_content(fhand):
+        fhand.write(BINARY_CACHE_MAGIC)
+        fhand.write(source_key)
+        fhand.write(_HEADER_SIZE.pack(len(encoded_header)))
+        fhand.write(encoded_header)
+        for name, array in arrays.items():
+            fhand.seek(data_start + header["arrays"][name]["offset"])
+            fhand.write(memoryview(array).cast("B"))
+
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomically(cache_path, write_content)
+
+
+def _write_atomically(cache_path, write_content):
+    # the file is renamed when complete, so a concurrent reader never finds
+    # it half written and the ones that have it mapped keep the old one
+    with tempfile.NamedTemporaryFile(
+        dir=cache_path.parent, prefix=cache_path.name, delete=False
+    ) as fhand:
+        try:
+            write_content(fhand)
+        except Exception:
+            Path(fhand.name).unlink()
+            raise
+    os.replace(fhand.name, cache_path)
+
+
+def _check_source_key(cache_fhand, source_path):
+    # gives if the source is unchanged and, if it has only been touched or
+    # copied, the key with its new mtime
+    cache_fhand.seek(_KEY_OFFSET)
+    size, mtime_ns, content_hash = _SOURCE_KEY.unpack(cache_fhand.read(_SOURCE_KEY.size))
+    stat = source_path.stat()
+    if stat.st_size != size:
+        return False, None
+    if stat.st_mtime_ns == mtime_ns:
+        return True, None
+    # only its content tells if it changed
+    if hash_file(source_path) != content_hash:
+        return False, None
+    return True, _SOURCE_KEY.pack(size, stat.st_mtime_ns, content_hash)
+
+
+def _refresh_source_key(cache_path, buffer, source_key):
+    # The cache is rewritten with the new key, so the source is not hashed
+    # again by the next reads. A cache that can not be written, as a read
+    # only or a shared one, is used as it is.
+    def write_content(fhand):
+        fhand.write(buffer)
+        fhand.seek(_KEY_OFFSET)
+        fhand.write(source_key)
+
+    try:
+        _write_atomically(cache_path, write_content)
+    except OSError:
+        pass
+
+
+class BinaryCacheFile:
+    # The arrays are views of the mapped file, it is unmapped when the last
+    # of them is released
+    def __init__(self, header, arrays, buffer):
+        self.header = header
+        self.arrays = arrays
+        self.buffer = buffer
+        self.closed = False
+
+    def close(self):
+        self.arrays = None
+        self.buffer = None
+        self.closed = True
+
+
+def read_binary_cache(cache_path: Path, source_path: Path) -> BinaryCacheFile | None:
+    # None is returned if there is no cache or if it is not valid for the source
+    cache_path = Path(cache_path)
+    source_path = Path(source_path).absolute()
+    if not cache_path.exists():
+        return None
+
+    with cache_path.open("rb") as fhand:
+        if fhand.read(len(BINARY_CACHE_MAGIC)) != BINARY_CACHE_MAGIC:
+            return None
+        is_unchanged, new_source_key = _check_source_key(fhand, source_path)
+        if not is_unchanged:
+            return None
+        fhand.seek(_KEY_OFFSET + _SOURCE_KEY.size)
+        (header_size,) = _HEADER_SIZE.unpack(fhand.read(_HEADER_SIZE.size))
+        header = json.loads(fhand.read(header_size))
+        if header["source_path"] != str(source_path):
+            return None
+        data_start = _align(fhand.tell())
+        buffer = mmap.mmap(fhand.fileno(), 0, access=mmap.ACCESS_READ)
+    if new_source_key is not None:
+        _refresh_source_key(cache_path, buffer, new_source_key)
+
+    arrays = {}
+    for name, array_info in header["arrays"].items():
+        dtype = numpy.dtype(array_info["dtype"])
+        shape = tuple(array_info["shape"])
+        array_info["offset"] += data_start
+        count = int(numpy.prod(shape))
+        if not count:
+            # empty arrays at the end would have an offset past the buffer
+            arrays[name] = numpy.empty(shape, dtype=dtype)
+            continue
+        arrays[name] = numpy.frombuffer(
+            buffer, dtype=dtype, count=count, offset=array_info["offset"]
+        ).reshape(shape)
+    return BinaryCacheFile(header, arrays, buffer)
@@ -0,0 +1,69 @@
+from pathlib import Path
+from collections import defaultdict
+import heapq
+
+from join_vcfs.vcf_parser import read_vcf_contigs
+from join_vcfs.vcf_index import find_vcf_index, read_vcf_index
+
+
+def get_vcf_contig_table(vcf_path: Path) -> dict[str, int | None]:
+    # The contigs of the ##contig lines, in the header order, with their
+    # lengths. A VCF without them gives the contigs of its index, in the file
+    # order and without lengths.
+    contigs = read_vcf_contigs(vcf_path)
+    if contigs:
+        return contigs
+    index_path = find_vcf_index(vcf_path)
+    if index_path is None:
+        raise ValueError(
+            f"The VCF has no ##contig lines nor index to take the chromosome order from: {vcf_path}"
+        )
+    return dict.fromkeys(read_vcf_index(index_path)["contigs"])
+
+
+def reconcile_contig_tables(contig_tables) -> dict[str, int | None]:
+    # The merged table keeps the order of every table, when several contigs
+    # could come next the first one found in the tables is taken.
+    first_seen = {}
+    lengths = {}
+    next_contigs = defaultdict(set)
+    num_previous_contigs = defaultdict(int)
+    for contig_table in contig_tables:
+        previous_contig = None
+        for contig, length in contig_table.items():
+            first_seen.setdefault(contig, len(first_seen))
+            if length is not None:
+                if lengths.setdefault(contig, length) != length:
+                    raise ValueError(
+                        f"The contig has different lengths in the inputs: {contig}: {lengths[contig]}, {length}"
+                    )
+            if previous_contig is not None:
+                if contig not in next_contigs[previous_contig]:
+                    next_contigs[previous_contig].add(contig)
+                    num_previous_contigs[contig] += 1
+            previous_contig = contig
+
+    ready = [
+        (idx, contig)
+        for contig, idx in first_seen.items()
+        if not num_previous_contigs[contig]
+    ]
+    heapq.heapify(ready)
+    merged = {}
+    while ready:
+        _, contig = heapq.heappop(ready)
+        merged[contig] = lengths.get(contig)
+        for next_contig in next_contigs[contig]:
+            num_previous_contigs[next_contig] -= 1
+            if not num_previous_contigs[next_contig]:
+                heapq.heappush(ready, (first_seen[next_contig], next_contig))
+    if len(merged) != len(first_seen):
+        unordered = sorted(set(first_seen).difference(merged))
+        raise ValueError(
+            "The inputs have their contigs in incompatible orders: " + ",".join(unordered)
+        )
+    return merged
+
+
+def infer_contig_table(vcf_paths: list[Path]) -> dict[str, int | None]:
+    return reconcile_contig_tables(map(get_vcf_contig_table, vcf_paths))
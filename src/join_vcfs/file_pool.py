@@ -0,0 +1,178 @@
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from join_vcfs.bgzf import read_bgzf_block, inflate_bgzf_block
+from join_vcfs.vcf_parser import VCFKind, open_vcf_fhand
+
+DEFAULT_READ_AHEAD_SIZE = 64 * 1024
+
+
+class FileHandlePool:
+    # Keeps at most max_open_files files open, the least recently used one is
+    # closed when another one has to be opened. The files can be read from
+    # different threads, the reads are serialized by the pool lock.
+    def __init__(self, max_open_files: int, read_ahead_size=DEFAULT_READ_AHEAD_SIZE):
+        if max_open_files < 1:
+            raise ValueError("At least one file should be allowed to be open")
+        self._max_open_files = max_open_files
+        self._read_ahead_size = read_ahead_size
+        self._open_fhands = OrderedDict()
+        self._lock = threading.RLock()
+        self.stats = {"opens": 0, "reopens": 0, "evictions": 0, "max_open_files": 0}
+
+    def open(
+        self, path: Path, decompression_executor: ThreadPoolExecutor | None = None
+    ):
+        return PooledVCFFile(
+            Path(path),
+            self,
+            read_ahead_size=self._read_ahead_size,
+            decompression_executor=decompression_executor,
+        )
+
+    def _acquire(self, pooled_file):
+        fhand = self._open_fhands.get(pooled_file)
+        if fhand is not None:
+            self._open_fhands.move_to_end(pooled_file)
+            return fhand
+
+        if len(self._open_fhands) >= self._max_open_files:
+            _, evicted_fhand = self._open_fhands.popitem(last=False)
+            evicted_fhand.close()
+            self.stats["evictions"] += 1
+        fhand = pooled_file._open()
+        self._open_fhands[pooled_file] = fhand
+        self.stats["opens"] += 1
+        if pooled_file._num_opens > 1:
+            self.stats["reopens"] += 1
+        self.stats["max_open_files"] = max(
+            self.stats["max_open_files"], len(self._open_fhands)
+        )
+        return fhand
+
+    def _release(self, pooled_file):
+        with self._lock:
+            fhand = self._open_fhands.pop(pooled_file, None)
+            if fhand is not None:
+                fhand.close()
+
+    def close(self):
+        with self._lock:
+            for fhand in self._open_fhands.values():
+                fhand.close()
+            self._open_fhands.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PooledVCFFile:
+    # A line iterator over a VCF that only holds its offset and a read-ahead
+    # chunk, the file is reopened by the pool and sought back when needed.
+    # The offset is a byte offset in the uncompressed data for plain and
+    # gzipped files and a virtual offset for BGZF. Seeking back a gzipped
+    # file inflates it again from the start, so BGZF is preferred for pools
+    # smaller than the number of inputs.
+    def __init__(
+        self,
+        path: Path,
+        pool: FileHandlePool,
+        read_ahead_size=DEFAULT_READ_AHEAD_SIZE,
+        decompression_executor: ThreadPoolExecutor | None = None,
+    ):
+        self.path = path
+        self.kind = None
+        self._pool = pool
+        self._read_ahead_size = read_ahead_size
+        self._executor = decompression_executor
+        self._offset = 0
+        self._num_opens = 0
+        self._lines = self._iter_lines()
+        self.closed = False
+
+    def _open(self):
+        # the kind is only guessed by the first open, the BGZF blocks are
+        # read from the raw file
+        fhand, self.kind = open_vcf_fhand(self.path, self.kind)
+        self._num_opens += 1
+        return fhand
+
+    def _read_bgzf_chunk(self, fhand):
+        block_offset, skip_bytes = self._offset >> 16, self._offset & 0xFFFF
+        if fhand.tell() != block_offset:
+            fhand.seek(block_offset)
+        data = b""
+        while not data:
+            blocks = []
+            size = 0
+            while size < self._read_ahead_size:
+                block = read_bgzf_block(fhand)
+                if block is None:
+                    break
+                blocks.append(block)
+                size += len(block)
+            if not blocks:
+                break
+            if self._executor is None:
+                data = b"".join(map(inflate_bgzf_block, blocks))
+            else:
+                data = b"".join(self._executor.map(inflate_bgzf_block, blocks))
+            data = data[skip_bytes:]
+            skip_bytes = 0
+        # only whole blocks are read, so the next chunk starts at a block
+        self._offset = fhand.tell() << 16
+        return data
+
+    def _read_chunk(self):
+        with self._pool._lock:
+            fhand = self._pool._acquire(self)
+            if self.kind == VCFKind.BGZippedVCF:
+                return self._read_bgzf_chunk(fhand)
+            if fhand.tell() != self._offset:
+                fhand.seek(self._offset)
+            data = fhand.read(self._read_ahead_size)
+            self._offset += len(data)
+            return data
+
+    def _iter_lines(self):
+        remainder = b""
+        while data := self._read_chunk():
+            last_newline = data.rfind(b"\n")
+            if last_newline == -1:
+                remainder += data
+                continue
+            yield from (remainder + data[: last_newline + 1]).splitlines(keepends=True)
+            remainder = data[last_newline + 1 :]
+        if remainder:
+            yield remainder
+
+    def seek_virtual_offset(self, virtual_offset: int):
+        if self.kind != VCFKind.BGZippedVCF:
+            raise ValueError("Only BGZF files can be sought by virtual offset")
+        self._lines.close()
+        self._offset = virtual_offset
+        self._lines = self._iter_lines()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def close(self):
+        if self.closed:
+            return
+        self._lines.close()
+        self._pool._release(self)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,317 @@
+from pathlib import Path
+from collections import namedtuple
+import json
+import zlib
+
+import numpy
+
+from join_vcfs.vcf_parser import GT_NUMPY_DTYPE, MISSING_ALLELE, SparseGTs, densify_gts
+
+# A GT store is a directory with the header, the var arrays and the
+# (vars, samples, ploidy) GTs and missing mask, written in chunks of
+# chunk_size vars. Without compression the chunks follow each other, so the
+# whole GT array can be mapped, with it every chunk is compressed on its own.
+# The header is written last, a store without it is not complete.
+GT_STORE_FORMAT_VERSION = 1
+DEFAULT_GT_STORE_CHUNK_SIZE = 4096
+DEFAULT_COMPRESSION_LEVEL = 6
+GT_STORE_HEADER_FNAME = "header.json"
+_GT_ARRAYS = ("gts", "missing_mask")
+_VAR_ARRAY_DTYPES = {
+    "chrom_codes": numpy.int32,
+    "poss": numpy.int64,
+    "alleles": numpy.uint8,
+    "allele_offsets": numpy.int64,
+    "var_allele_offsets": numpy.int64,
+}
+
+GTStoreSettings = namedtuple(
+    "GTStoreSettings",
+    ["chunk_size", "compress_chunks"],
+    defaults=[DEFAULT_GT_STORE_CHUNK_SIZE, False],
+)
+
+
+def _get_array_path(store_dir, name):
+    return store_dir / f"{name}.bin"
+
+
+class GTStoreWriter:
+    # The vars are added one by one into the arrays of the current chunk,
+    # which are reused for every chunk
+    def __init__(
+        self,
+        store_dir: Path,
+        samples,
+        ploidy: int,
+        chromosomes: list[str],
+        chunk_size: int = DEFAULT_GT_STORE_CHUNK_SIZE,
+        compress_chunks: bool = False,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+    ):
+        if chunk_size < 1:
+            raise ValueError("The GT store chunk size should be at least 1")
+        self._store_dir = Path(store_dir)
+        self._store_dir.mkdir(parents=True, exist_ok=True)
+        # a previous store in the dir is not complete until the new header
+        (self._store_dir / GT_STORE_HEADER_FNAME).unlink(missing_ok=True)
+        self._header = {
+            "format_version": GT_STORE_FORMAT_VERSION,
+            "samples": [str(sample) for sample in samples],
+            "ploidy": ploidy,
+            "chroms": list(chromosomes),
+            "chunk_size": chunk_size,
+            "compression": "zlib" if compress_chunks else None,
+            "gt_dtype": numpy.dtype(GT_NUMPY_DTYPE).str,
+            "num_vars": 0,
+            "chunks": [],
+        }
+        self._chrom_codes = {chrom: code for code, chrom in enumerate(chromosomes)}
+        self._compression_level = compression_level
+        self._fhands = {
+            name: _get_array_path(self._store_dir, name).open("wb")
+            for name in list(_VAR_ARRAY_DTYPES) + list(_GT_ARRAYS)
+        }
+        self._offsets = dict.fromkeys(_GT_ARRAYS, 0)
+        self._chunk_gts = numpy.empty(
+            (chunk_size, len(samples), ploidy), dtype=GT_NUMPY_DTYPE
+        )
+        self._chunk_missing_mask = numpy.empty(
+            (chunk_size, len(samples), ploidy), dtype=bool
+        )
+        self._chunk_chrom_codes = numpy.empty(chunk_size, dtype=numpy.int32)
+        self._chunk_poss = numpy.empty(chunk_size, dtype=numpy.int64)
+        self._chunk_alleles = []
+        self._num_chunk_vars = 0
+        self._num_alleles = 0
+        self._alleles_size = 0
+        self._write_array("allele_offsets", numpy.zeros(1, dtype=numpy.int64))
+        self._write_array("var_allele_offsets", numpy.zeros(1, dtype=numpy.int64))
+        self.closed = False
+
+    def _write_array(self, name, array):
+        self._fhands[name].write(memoryview(numpy.ascontiguousarray(array)).cast("B"))
+
+    def add_var(self, var):
+        row = self._num_chunk_vars
+        try:
+            self._chunk_chrom_codes[row] = self._chrom_codes[var["chrom"]]
+        except KeyError:
+            raise ValueError(f"The chromosome is not in the GT store: {var['chrom']}")
+        self._chunk_poss[row] = var["pos"]
+        self._chunk_alleles.append([allele.encode() for allele in var["alleles"]])
+        gts = var["gts"]
+        if isinstance(gts, SparseGTs):
+            densify_gts(gts, out=self._chunk_gts[row])
+            numpy.equal(
+                self._chunk_gts[row], MISSING_ALLELE, out=self._chunk_missing_mask[row]
+            )
+        else:
+            self._chunk_gts[row] = gts
+            self._chunk_missing_mask[row] = var["missing_mask"]
+        self._num_chunk_vars += 1
+        if self._num_chunk_vars == len(self._chunk_poss):
+            self._flush_chunk()
+
+    def _write_gt_chunk(self, name, array):
+        data = memoryview(array).cast("B")
+        if self._header["compression"] is not None:
+            data = zlib.compress(data, self._compression_level)
+        self._fhands[name].write(data)
+        offset = self._offsets[name]
+        self._offsets[name] += len(data)
+        return [offset, len(data)]
+
+    def _flush_chunk(self):
+        num_vars = self._num_chunk_vars
+        if not num_vars:
+            return
+        self._write_array("chrom_codes", self._chunk_chrom_codes[:num_vars])
+        self._write_array("poss", self._chunk_poss[:num_vars])
+        allele_lens = [len(allele) for alleles in self._chunk_alleles for allele in alleles]
+        self._fhands["alleles"].write(
+            b"".join(allele for alleles in self._chunk_alleles for allele in alleles)
+        )
+        self._write_array(
+            "allele_offsets", numpy.cumsum(allele_lens, dtype=numpy.int64) + self._alleles_size
+        )
+        self._write_array(
+            "var_allele_offsets",
+            numpy.cumsum(list(map(len, self._chunk_alleles)), dtype=numpy.int64)
+            + self._num_alleles,
+        )
+        self._alleles_size += sum(allele_lens)
+        self._num_alleles += len(allele_lens)
+
+        chunk = {"num_vars": num_vars}
+        chunk["gts"] = self._write_gt_chunk("gts", self._chunk_gts[:num_vars])
+        chunk["missing_mask"] = self._write_gt_chunk(
+            "missing_mask", self._chunk_missing_mask[:num_vars]
+        )
+        self._header["chunks"].append(chunk)
+        self._header["num_vars"] += num_vars
+        self._chunk_alleles = []
+        self._num_chunk_vars = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self._flush_chunk()
+        for fhand in self._fhands.values():
+            fhand.close()
+        header_path = self._store_dir / GT_STORE_HEADER_FNAME
+        header_path.write_text(json.dumps(self._header) + "\n")
+        self.closed = True
+
+    def abort(self):
+        # the store is left without header
+        for fhand in self._fhands.values():
+            fhand.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_gt_store(
+    store_dir: Path,
+    merged_vars,
+    samples,
+    ploidy: int,
+    chromosomes: list[str],
+    chunk_size: int = DEFAULT_GT_STORE_CHUNK_SIZE,
+    compress_chunks: bool = False,
+):
+    with GTStoreWriter(
+        store_dir, samples, ploidy, chromosomes, chunk_size, compress_chunks
+    ) as writer:
+        for var in merged_vars:
+            writer.add_var(var)
+
+
+def _map_array(path, dtype, shape=None):
+    # empty files can not be mapped
+    if not path.stat().st_size:
+        return numpy.empty(shape or 0, dtype=dtype)
+    return numpy.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class GTStore:
+    # The var arrays are mapped, as the GTs and missing mask when the chunks
+    # are not compressed. get_chunk gives the GTs of a chunk, views of the
+    # mapped arrays or decompressed.
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+        header_path = self.store_dir / GT_STORE_HEADER_FNAME
+        if not header_path.exists():
+            raise ValueError(f"The GT store is not complete: {store_dir}")
+        self.header = json.loads(header_path.read_text())
+        if self.header["format_version"] != GT_STORE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported GT store format version: {self.header['format_version']}"
+            )
+        self.samples = self.header["samples"]
+        self.chroms = self.header["chroms"]
+        self.arrays = {
+            name: _map_array(_get_array_path(self.store_dir, name), dtype)
+            for name, dtype in _VAR_ARRAY_DTYPES.items()
+        }
+        self._gt_dtypes = {
+            "gts": numpy.dtype(self.header["gt_dtype"]),
+            "missing_mask": numpy.dtype(bool),
+        }
+        self._gt_files = {
+            name: _map_array(_get_array_path(self.store_dir, name), numpy.uint8)
+            for name in _GT_ARRAYS
+        }
+        self.gts = None
+        self.missing_mask = None
+        if self.header["compression"] is None:
+            shape = self._get_gts_shape(self.header["num_vars"])
+            self.gts = self._gt_files["gts"].view(self._gt_dtypes["gts"]).reshape(shape)
+            self.missing_mask = self._gt_files["missing_mask"].view(bool).reshape(shape)
+
+    def _get_gts_shape(self, num_vars):
+        return (num_vars, len(self.samples), self.header["ploidy"])
+
+    @property
+    def num_chunks(self):
+        return len(self.header["chunks"])
+
+    def _get_chunk_array(self, name, chunk):
+        offset, nbytes = chunk[name]
+        data = self._gt_files[name][offset : offset + nbytes]
+        if self.header["compression"] is not None:
+            data = numpy.frombuffer(zlib.decompress(data), dtype=numpy.uint8)
+        return data.view(self._gt_dtypes[name]).reshape(
+            self._get_gts_shape(chunk["num_vars"])
+        )
+
+    def get_chunk(self, chunk_idx):
+        chunk = self.header["chunks"][chunk_idx]
+        return (
+            self._get_chunk_array("gts", chunk),
+            self._get_chunk_array("missing_mask", chunk),
+        )
+
+    def get_var_alleles(self, var_idx) -> list[str]:
+        arrays = self.arrays
+        first, last = arrays["var_allele_offsets"][var_idx : var_idx + 2]
+        offsets = arrays["allele_offsets"][first : last + 1].tolist()
+        alleles = arrays["alleles"]
+        return [
+            alleles[start:end].tobytes().decode()
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def iter_vars(self):
+        # the vars are given as merged vars, to be written again
+        chrom_codes = self.arrays["chrom_codes"]
+        poss = self.arrays["poss"]
+        var_idx = 0
+        for chunk_idx in range(self.num_chunks):
+            gts, missing_mask = self.get_chunk(chunk_idx)
+            for row in range(gts.shape[0]):
+                yield {
+                    "chrom": self.chroms[chrom_codes[var_idx]],
+                    "pos": int(poss[var_idx]),
+                    "alleles": self.get_var_alleles(var_idx),
+                    "gts": gts[row],
+                    "missing_mask": missing_mask[row],
+                }
+                var_idx += 1
+
+
+def read_gt_store(store_dir: Path) -> GTStore:
+    return GTStore(store_dir)
+
+
+def concatenate_gt_store_parts(
+    store_dir: Path,
+    part_dirs,
+    chunk_size: int = DEFAULT_GT_STORE_CHUNK_SIZE,
+    compress_chunks: bool = False,
+):
+    # the vars of the parts are chunked again, the parts share their samples
+    # and chromosomes
+    parts = [read_gt_store(part_dir) for part_dir in part_dirs]
+    if not parts:
+        raise ValueError("At least one GT store part should be given")
+    header = parts[0].header
+    with GTStoreWriter(
+        store_dir,
+        header["samples"],
+        header["ploidy"],
+        header["chroms"],
+        chunk_size,
+        compress_chunks,
+    ) as writer:
+        for part in parts:
+            for var in part.iter_vars():
+                writer.add_var(var)
@@ -0,0 +1,188 @@
+from pathlib import Path
+from collections import defaultdict
+import contextlib
+import json
+import sys
+import threading
+import time
+
+STAGES = ("read", "parse", "prefetch_wait", "group", "merge", "write")
+# the progress time is only checked once every this number of groups
+_PROGRESS_CHECK_GROUPS = 1024
+
+
+def _get_histogram_bucket(value):
+    # power of two buckets, a value is counted in the lowest bucket >= value
+    return 1 << max(value - 1, 0).bit_length()
+
+
+def _write_progress_to_stderr(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+class JoinMetrics:
+    # Collects the stage times and counters of a join. The stages are nested,
+    # the grouping pulls parsed vars that pull read lines, so the time is
+    # charged to the innermost running stage only and the stage times add up
+    # to the time spent in the join. The read stage includes the
+    # decompression. Every thread has its own stages, so when the inputs are
+    # prefetched their read and parse times overlap with the others, and the
+    # CPU times are those of the threads that run the stages, not of the
+    # decompression pool.
+    # Nothing is timed when a join has no metrics, the iterators are only
+    # wrapped when they are created.
+    def __init__(self, progress_interval=None, progress_callback=None):
+        self.stage_times = {stage: {"wall": 0.0, "cpu": 0.0} for stage in STAGES}
+        self.lines_parsed = defaultdict(int)
+        self.num_groups = 0
+        self.num_grouped_vars = 0
+        self.group_span_histogram = defaultdict(int)
+        self.group_size_histogram = defaultdict(int)
+        self._thread_state = threading.local()
+        self._lock = threading.Lock()
+        self._start_wall = time.perf_counter()
+        self._progress_interval = progress_interval
+        self._progress_callback = progress_callback or _write_progress_to_stderr
+        self._next_progress = self._start_wall + (progress_interval or 0)
+
+    def _get_thread_state(self):
+        state = self._thread_state
+        if not hasattr(state, "stage_stack"):
+            state.stage_stack = []
+        return state
+
+    def _charge_elapsed_time(self, state):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if state.stage_stack:
+            with self._lock:
+                times = self.stage_times[state.stage_stack[-1]]
+                times["wall"] += wall - state.last_wall
+                times["cpu"] += cpu - state.last_cpu
+        state.last_wall, state.last_cpu = wall, cpu
+
+    def _enter_stage(self, stage):
+        state = self._get_thread_state()
+        self._charge_elapsed_time(state)
+        state.stage_stack.append(stage)
+
+    def _exit_stage(self):
+        state = self._thread_state
+        self._charge_elapsed_time(state)
+        state.stage_stack.pop()
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        self._enter_stage(stage)
+        try:
+            yield
+        finally:
+            self._exit_stage()
+
+    def time_iter(self, stage, items):
+        # the time spent getting every item is charged to the stage
+        items = iter(items)
+        while True:
+            self._enter_stage(stage)
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self._exit_stage()
+            yield item
+
+    def track_var_batches(self, input_name, line_batches, parse_var_batch):
+        for lines in self.time_iter("read", line_batches):
+            with self.stage("parse"):
+                var_batch = parse_var_batch(lines)
+            self.lines_parsed[input_name] += len(lines)
+            yield var_batch
+
+    def track_cached_var_batches(self, input_name, var_batches):
+        # the cached vars are already parsed, they are only mapped
+        for var_batch in self.time_iter("read", var_batches):
+            self.lines_parsed[input_name] += var_batch.poss.size
+            yield var_batch
+
+    def track_var_groups(self, var_groups):
+        for var_group in self.time_iter("group", var_groups):
+            chrom, start, end = var_group.span
+            # every pass of the elongation loop adds a var to the group
+            group_size = sum(map(len, var_group.vars.values()))
+            self.num_groups += 1
+            self.num_grouped_vars += group_size
+            self.group_size_histogram[_get_histogram_bucket(group_size)] += 1
+            self.group_span_histogram[_get_histogram_bucket(end - start + 1)] += 1
+            if (
+                self._progress_interval is not None
+                and self.num_groups % _PROGRESS_CHECK_GROUPS == 0
+            ):
+                self._report_progress(chrom, start)
+            yield var_group
+
+    def _report_progress(self, chrom, pos):
+        now = time.perf_counter()
+        if now < self._next_progress:
+            return
+        self._next_progress = now + self._progress_interval
+        vars_per_second = self.num_grouped_vars / max(now - self._start_wall, 1e-9)
+        self._progress_callback(
+            f"{chrom}:{pos}\t{self.num_grouped_vars} vars\t{vars_per_second:.0f} vars/s"
+        )
+
+    def get_report(self) -> dict:
+        return {
+            "stages": {stage: dict(times) for stage, times in self.stage_times.items()},
+            "lines_parsed": dict(self.lines_parsed),
+            "groups": {
+                "num_groups": self.num_groups,
+                "elongation_loop_iterations": self.num_grouped_vars,
+                "span_histogram": _sort_histogram(self.group_span_histogram),
+                "size_histogram": _sort_histogram(self.group_size_histogram),
+            },
+        }
+
+
+def _sort_histogram(histogram):
+    # JSON keys are strings, so the buckets are given as strings
+    return {str(bucket): histogram[bucket] for bucket in sorted(histogram)}
+
+
+def _sum_nested(dicts):
+    summed = {}
+    for dict_ in dicts:
+        for key, value in dict_.items():
+            if isinstance(value, dict):
+                summed[key] = _sum_nested([summed.get(key, {}), value])
+            else:
+                summed[key] = summed.get(key, 0) + value
+    return summed
+
+
+def sum_metrics_reports(reports) -> dict | None:
+    # the reports of the shards and tree levels are added, so their stage
+    # times are the times spent by all the processes
+    reports = [report for report in reports if report]
+    if not reports:
+        return None
+    summed = _sum_nested(reports)
+    for histogram in ("span_histogram", "size_histogram"):
+        summed["groups"][histogram] = {
+            bucket: count
+            for bucket, count in sorted(
+                summed["groups"][histogram].items(), key=lambda item: int(item[0])
+            )
+        }
+    return summed
+
+
+def get_parse_cache_hit_rates(parse_cache_stats) -> dict[str, float | None]:
+    hit_rates = {}
+    for name, stats in parse_cache_stats.items():
+        num_lookups = stats["hits"] + stats["misses"]
+        hit_rates[name] = stats["hits"] / num_lookups if num_lookups else None
+    return hit_rates
+
+
+def write_metrics_report(out_path: Path, report: dict):
+    Path(out_path).write_text(json.dumps(report, indent=2) + "\n")
@@ -0,0 +1,139 @@
+from typing import Iterator
+import mmap
+import os
+import stat
+
+import numpy
+
+# the newlines are searched in chunks of this size
+DEFAULT_SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+_ORD_NEWLINE = ord("\n")
+
+
+class LineBlock:
+    # Consecutive lines of a buffer, line idx goes from line_starts[idx] to
+    # line_starts[idx + 1] and every line ends with a newline
+    __slots__ = ("buffer", "line_starts")
+
+    def __init__(self, buffer, line_starts):
+        self.buffer = buffer
+        self.line_starts = line_starts
+
+    def __len__(self):
+        return len(self.line_starts) - 1
+
+    def get_line(self, idx) -> bytes:
+        return bytes(self.buffer[self.line_starts[idx] : self.line_starts[idx + 1]])
+
+
+def can_map_file(fhand) -> bool:
+    # pipes and other streams are read through their buffers, an empty file
+    # can not be mapped
+    try:
+        file_stat = os.fstat(fhand.fileno())
+    except (AttributeError, OSError):
+        return False
+    return stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0
+
+
+class MmapLineReader:
+    # Reads a plain file through a read only map. The lines are iterated as
+    # bytes or taken in LineBlocks that are memoryviews of the map, so the
+    # lines of a block are not copied. The map is advised to be read
+    # sequentially and it is unmapped on close, or when the last block is
+    # released if some of them are still alive.
+    def __init__(self, fhand, scan_chunk_size=DEFAULT_SCAN_CHUNK_SIZE):
+        self._fhand = fhand
+        self._mmap = mmap.mmap(fhand.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self._scan_chunk_size = scan_chunk_size
+        self._pos = 0
+        self._lines = self._iter_lines()
+        self.closed = False
+
+    def _find_chunk_end(self, start):
+        # the chunks end after a newline, or at the end of the file
+        mm = self._mmap
+        chunk_end = mm.rfind(b"\n", start, start + self._scan_chunk_size) + 1
+        if not chunk_end:
+            chunk_end = mm.find(b"\n", start + self._scan_chunk_size) + 1
+        return chunk_end or len(mm)
+
+    def _iter_lines(self):
+        mm = self._mmap
+        while self._pos < len(mm):
+            chunk_end = self._find_chunk_end(self._pos)
+            for line in mm[self._pos : chunk_end].splitlines(keepends=True):
+                self._pos += len(line)
+                yield line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        return next(self._lines)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int):
+        self._lines.close()
+        self._pos = pos
+        self._lines = self._iter_lines()
+
+    def iter_line_blocks(self, num_lines: int) -> Iterator[LineBlock]:
+        # the blocks of num_lines lines start at the current position, the
+        # newlines are found with numpy in large chunks
+        mm = self._mmap
+        size = len(mm)
+        line_ends = numpy.empty(0, dtype=numpy.int64)
+        scan_pos = self._pos
+        while True:
+            while line_ends.size < num_lines and scan_pos < size:
+                chunk_end = min(scan_pos + self._scan_chunk_size, size)
+                chunk = numpy.frombuffer(
+                    mm, dtype=numpy.uint8, count=chunk_end - scan_pos, offset=scan_pos
+                )
+                chunk_line_ends = numpy.flatnonzero(chunk == _ORD_NEWLINE) + scan_pos + 1
+                del chunk
+                if chunk_end == size and mm[size - 1] != _ORD_NEWLINE:
+                    # the last line has no newline
+                    chunk_line_ends = numpy.append(chunk_line_ends, size)
+                line_ends = numpy.concatenate((line_ends, chunk_line_ends))
+                scan_pos = chunk_end
+            if not line_ends.size:
+                return
+            start = self._pos
+            block_ends = line_ends[:num_lines]
+            line_ends = line_ends[num_lines:]
+            end = int(block_ends[-1])
+            line_starts = [0]
+            line_starts.extend((block_ends - start).tolist())
+            self.seek(end)
+            if mm[end - 1] == _ORD_NEWLINE:
+                buffer = memoryview(mm)[start:end]
+            else:
+                # the block with the last line is copied to add its newline
+                buffer = mm[start:end] + b"\n"
+                line_starts[-1] += 1
+            yield LineBlock(buffer, line_starts)
+
+    def close(self):
+        if self.closed:
+            return
+        self._lines.close()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # the blocks still alive keep the map
+            pass
+        self._mmap = None
+        self._fhand.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
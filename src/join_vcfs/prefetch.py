@@ -0,0 +1,143 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+import threading
+
+DEFAULT_PREFETCH_QUEUE_SIZE = 4
+DEFAULT_PREFETCH_MEMORY_BUDGET = 256 * 1024 * 1024
+DEFAULT_PREFETCH_THREADS = 4
+_END = object()
+_ERROR = object()
+
+
+class Prefetcher:
+    # Reads ahead the items of the inputs in a pool of num_threads threads and
+    # keeps up to queue_size of them per input for the consumer, so the file
+    # reads, the decompression and the parts of the parsing that release the
+    # GIL overlap with the consumer. get_nbytes gives the memory held by an
+    # item.
+    # Every task reads one item of an input, and the input is scheduled again
+    # while its queue has room and the bytes queued by all the inputs are
+    # below the memory budget. An input with nothing queued is always
+    # scheduled, otherwise the sweep could wait for an input that waits for
+    # the budget held by the others, so the budget can be exceeded by at most
+    # one item per input.
+    def __init__(
+        self,
+        queue_size: int = DEFAULT_PREFETCH_QUEUE_SIZE,
+        memory_budget: int = DEFAULT_PREFETCH_MEMORY_BUDGET,
+        num_threads: int = DEFAULT_PREFETCH_THREADS,
+    ):
+        if queue_size < 1:
+            raise ValueError("The prefetch queue size should be at least 1")
+        if num_threads < 1:
+            raise ValueError("The number of prefetch threads should be at least 1")
+        self._queue_size = queue_size
+        self._max_bytes = memory_budget
+        self._used_bytes = 0
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(num_threads, thread_name_prefix="prefetch")
+        # the inputs with room in their queues waiting for the budget
+        self._budget_waiting = deque()
+        self._closed = False
+        self.stats = {
+            "num_items": 0,
+            "consumer_waits": 0,
+            "budget_waits": 0,
+            "max_used_bytes": 0,
+        }
+
+    def prefetch(self, items, get_nbytes, name="") -> Iterator:
+        input_state = {
+            "name": name,
+            "items": iter(items),
+            "get_nbytes": get_nbytes,
+            # (item, nbytes), (_END, 0) or (_ERROR, error)
+            "queue": deque(),
+            "running": False,
+            "waiting": False,
+            "done": False,
+        }
+        with self._condition:
+            self._schedule(input_state)
+        return self._consume(input_state)
+
+    def _schedule(self, input_state):
+        # called holding the condition
+        if (
+            self._closed
+            or input_state["running"]
+            or input_state["done"]
+            or len(input_state["queue"]) >= self._queue_size
+        ):
+            return
+        if input_state["queue"] and self._used_bytes >= self._max_bytes:
+            if not input_state["waiting"]:
+                input_state["waiting"] = True
+                self._budget_waiting.append(input_state)
+                self.stats["budget_waits"] += 1
+            return
+        input_state["running"] = True
+        self._executor.submit(self._produce, input_state)
+
+    def _schedule_budget_waiting(self):
+        while self._budget_waiting and self._used_bytes < self._max_bytes:
+            input_state = self._budget_waiting.popleft()
+            input_state["waiting"] = False
+            self._schedule(input_state)
+
+    def _produce(self, input_state):
+        try:
+            item = next(input_state["items"], _END)
+            value = 0 if item is _END else input_state["get_nbytes"](item)
+        except BaseException as error:
+            # the error is raised in the consumer
+            item, value = _ERROR, error
+        with self._condition:
+            input_state["running"] = False
+            input_state["queue"].append((item, value))
+            if item is _END or item is _ERROR:
+                input_state["done"] = True
+            else:
+                self._used_bytes += value
+                self.stats["max_used_bytes"] = max(
+                    self.stats["max_used_bytes"], self._used_bytes
+                )
+                self._schedule(input_state)
+            self._condition.notify_all()
+
+    def _consume(self, input_state):
+        items_queue = input_state["queue"]
+        while True:
+            with self._condition:
+                if not items_queue:
+                    self.stats["consumer_waits"] += 1
+                    self._schedule(input_state)
+                    while not items_queue:
+                        self._condition.wait()
+                item, value = items_queue.popleft()
+                if item is _END:
+                    return
+                if item is _ERROR:
+                    raise value
+                self._used_bytes -= value
+                self.stats["num_items"] += 1
+                self._schedule(input_state)
+                self._schedule_budget_waiting()
+            yield item
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+    def close(self):
+        # the running tasks finish their items before the inputs are closed
+        with self._condition:
+            self._closed = True
+            self._budget_waiting.clear()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,183 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from join_vcfs.vcf_parser import (
+    MISSING_ALLELE,
+    ABSENT_ALLELE,
+    read_vcf_metadata_lines,
+)
+from join_vcfs.bgzf import DEFAULT_NUM_DECOMPRESSION_THREADS
+from join_vcfs.vcf_joining import (
+    create_vcf_infos,
+    get_merged_samples,
+    get_merged_ploidy,
+    group_overlapping_vars,
+    close_vcf_infos,
+)
+from join_vcfs.vcf_writer import write_vcf, Compression
+from join_vcfs.contigs import infer_contig_table
+from join_vcfs.allele_merging import merge_var_group
+
+OLD_SAMPLES_FILLS = ("missing", "ref")
+_JOINED_VCF_ID = 0
+
+
+def _create_joined_vcf_info(joined_vcf_path, decompression_executor, binary_cache_dir):
+    # Without a binary cache the vars of the joined VCF are LazyVars, so only
+    # the lines of the groups that change are parsed, the rest are copied
+    if binary_cache_dir is not None:
+        return create_vcf_infos(
+            [joined_vcf_path],
+            decompression_executor,
+            binary_cache_dir=binary_cache_dir,
+        )[0]
+    return create_vcf_infos(
+        [joined_vcf_path],
+        decompression_executor,
+        use_var_batches=False,
+        lazy_vars=True,
+    )[0]
+
+
+def _mark_absent_samples(var):
+    # The joined VCF has its samples missing where they had no var, so the
+    # samples with every allele missing are taken as absent, they are REF at
+    # the group positions covered by the other vars. The alleles missing in
+    # a sample with a called allele are real missing calls.
+    is_absent = var["missing_mask"].all(axis=1)
+    if not is_absent.any():
+        return var
+    gts = var["gts"].copy()
+    gts[is_absent] = ABSENT_ALLELE
+    return {
+        "chrom": var["chrom"],
+        "pos": var["pos"],
+        "alleles": var["alleles"],
+        "gts": gts,
+        "missing_mask": var["missing_mask"],
+    }
+
+
+def _append_to_var_groups(var_groups, vcf_infos, old_samples_fill, stats):
+    samples, sample_slices = get_merged_samples(vcf_infos)
+    ploidy = get_merged_ploidy(vcf_infos)
+    joined_info = vcf_infos[_JOINED_VCF_ID]
+    old_samples = sample_slices[_JOINED_VCF_ID]
+    num_new_samples = len(samples) - joined_info["samples"].size
+    missing_gt = "/".join(["."] * ploidy)
+    new_samples_missing_gts = ("\t" + missing_gt) * num_new_samples + "\n"
+    new_samples_missing_gts = new_samples_missing_gts.encode()
+
+    for var_group in var_groups:
+        old_vars = var_group.vars.get(_JOINED_VCF_ID)
+        if old_vars is not None and len(var_group.vars) == 1:
+            # the group does not change, its vars are copied with the new
+            # samples missing, even if they overlap
+            for var in old_vars:
+                stats["num_copied_vars"] += 1
+                if "line" in var:
+                    yield {"line": var["line"].rstrip(b"\r\n") + new_samples_missing_gts}
+                    continue
+                gts = numpy.full(
+                    (len(samples), ploidy), MISSING_ALLELE, dtype=var["gts"].dtype
+                )
+                gts[old_samples] = var["gts"]
+                yield {
+                    "chrom": var["chrom"],
+                    "pos": var["pos"],
+                    "alleles": var["alleles"],
+                    "gts": gts,
+                    "missing_mask": gts == MISSING_ALLELE,
+                }
+            continue
+
+        # the new VCFs keep their missing calls
+        if old_vars is not None and len(old_vars) > 1:
+            old_vars = [_mark_absent_samples(var) for var in old_vars]
+            var_group = var_group._replace(
+                vars=var_group.vars | {_JOINED_VCF_ID: old_vars}
+            )
+        merged_var = merge_var_group(var_group, sample_slices, len(samples), ploidy)
+        if old_vars is None and old_samples_fill == "ref":
+            merged_var["gts"][old_samples] = 0
+            merged_var["missing_mask"][old_samples] = False
+        stats["num_merged_vars"] += 1
+        yield merged_var
+
+
+def append_samples(
+    joined_vcf_path: Path,
+    new_vcf_paths: list[Path],
+    ordered_chromosomes: list | None,
+    out_vcf_path: Path,
+    compression: Compression | None = None,
+    num_decompression_threads: int = DEFAULT_NUM_DECOMPRESSION_THREADS,
+    old_samples_fill: str = "missing",
+    binary_cache_dir: Path | None = None,
+) -> dict:
+    # The new VCFs are joined to an already joined one. Only the groups with
+    # new vars are merged again, the rest of its lines are copied with the new
+    # samples missing. The old samples at the new sites are filled as missing
+    # or as ref. With a binary_cache_dir the joined VCF is read from its
+    # binary cache. Without ordered_chromosomes the order is taken from the
+    # ##contig lines of the joined and the new VCFs. The header of the joined
+    # VCF is kept with the new samples added.
+    if ordered_chromosomes is None:
+        vcf_paths = [Path(joined_vcf_path)] + [Path(path) for path in new_vcf_paths]
+        ordered_chromosomes = list(infer_contig_table(vcf_paths))
+    if not ordered_chromosomes:
+        raise ValueError("Al least one chromosome should be given")
+    if old_samples_fill not in OLD_SAMPLES_FILLS:
+        raise ValueError(
+            f"The old samples fill should be one of {OLD_SAMPLES_FILLS}: {old_samples_fill}"
+        )
+    ordered_chromosomes = list(ordered_chromosomes)
+
+    decompression_executor = None
+    if num_decompression_threads > 1:
+        decompression_executor = ThreadPoolExecutor(num_decompression_threads)
+    vcf_infos = {}
+    stats = {"num_copied_vars": 0, "num_merged_vars": 0}
+    try:
+        vcf_infos[_JOINED_VCF_ID] = _create_joined_vcf_info(
+            joined_vcf_path,
+            decompression_executor,
+            binary_cache_dir,
+        )
+        new_vcf_infos = create_vcf_infos(new_vcf_paths, decompression_executor)
+        vcf_infos.update(
+            (vcf_id + 1, vcf_info) for vcf_id, vcf_info in new_vcf_infos.items()
+        )
+        old_samples = set(map(str, vcf_infos[_JOINED_VCF_ID]["samples"]))
+        new_samples = {
+            str(sample)
+            for vcf_info in new_vcf_infos.values()
+            for sample in vcf_info["samples"]
+        }
+        if old_samples.intersection(new_samples):
+            raise RuntimeError(
+                "Some samples are already in the joined VCF: "
+                + ",".join(sorted(old_samples.intersection(new_samples)))
+            )
+
+        var_groups = group_overlapping_vars(vcf_infos, ordered_chromosomes)
+        merged_vars = _append_to_var_groups(
+            var_groups, vcf_infos, old_samples_fill, stats
+        )
+        samples, _ = get_merged_samples(vcf_infos)
+        write_vcf(
+            out_vcf_path,
+            merged_vars,
+            samples=samples,
+            ploidy=get_merged_ploidy(vcf_infos),
+            chromosomes=ordered_chromosomes,
+            compression=compression,
+            metadata_lines=read_vcf_metadata_lines(joined_vcf_path),
+        )
+    finally:
+        close_vcf_infos(vcf_infos)
+        if decompression_executor is not None:
+            decompression_executor.shutdown(cancel_futures=True)
+    return stats
@@ -0,0 +1,195 @@
+from pathlib import Path
+import gzip
+import re
+import struct
+
+TABIX_MAGIC = b"TBI\x01"
+CSI_MAGIC = b"CSI\x01"
+TABIX_MIN_SHIFT = 14
+TABIX_DEPTH = 5
+INDEX_SUFFIXES = (".tbi", ".csi")
+
+_REGION_RE = re.compile(r"^(?P<chrom>[^:]+)(:(?P<start>[\d,]+)?(-(?P<end>[\d,]+)?)?)?$")
+
+
+def parse_region(region) -> tuple[str, int | None, int | None]:
+    # regions are 1-based and inclusive: chrom, chrom:start, chrom:start-end
+    if isinstance(region, tuple):
+        chrom, start, end = (tuple(region) + (None, None))[:3]
+        return chrom, start, end
+    match = _REGION_RE.match(region)
+    if match is None:
+        raise ValueError(f"Invalid region: {region}")
+    start, end = match.group("start"), match.group("end")
+    start = int(start.replace(",", "")) if start else None
+    end = int(end.replace(",", "")) if end else None
+    if start is not None and end is not None and end < start:
+        raise ValueError(f"Invalid region, the end is lower than the start: {region}")
+    return match.group("chrom"), start, end
+
+
+def _get_pseudo_bin(min_shift, depth):
+    return ((1 << ((depth + 1) * 3)) - 1) // 7 + 1
+
+
+def _reg2bins(beg, end, min_shift, depth):
+    # beg and end are 0-based, half-open
+    end -= 1
+    bins = []
+    shift = min_shift + depth * 3
+    first_bin_in_level = 0
+    for level in range(depth + 1):
+        bins.extend(
+            range(first_bin_in_level + (beg >> shift), first_bin_in_level + (end >> shift) + 1)
+        )
+        shift -= 3
+        first_bin_in_level += 1 << (level * 3)
+    return bins
+
+
+class _BinaryCursor:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def read(self, size):
+        chunk = self.data[self.pos : self.pos + size]
+        self.pos += size
+        return chunk
+
+
+def _parse_contig_names(names):
+    return [name.decode() for name in names.split(b"\x00") if name]
+
+
+def _parse_tabix_meta(cursor):
+    fmt, col_seq, col_beg, col_end, meta, skip, l_nm = cursor.unpack("<7i")
+    return {
+        "format": fmt,
+        "col_seq": col_seq,
+        "col_beg": col_beg,
+        "col_end": col_end,
+        "meta_char": chr(meta),
+        "skip": skip,
+        "contigs": _parse_contig_names(cursor.read(l_nm)),
+    }
+
+
+def _parse_bins(cursor, with_loffset):
+    bins = {}
+    (num_bins,) = cursor.unpack("<i")
+    for _ in range(num_bins):
+        (bin_,) = cursor.unpack("<I")
+        if with_loffset:
+            cursor.unpack("<Q")
+        (num_chunks,) = cursor.unpack("<i")
+        chunks = list(struct.iter_unpack("<QQ", cursor.read(16 * num_chunks)))
+        bins[bin_] = chunks
+    return bins
+
+
+def _parse_tabix(data):
+    cursor = _BinaryCursor(data)
+    cursor.pos = len(TABIX_MAGIC)
+    (num_refs,) = cursor.unpack("<i")
+    index = _parse_tabix_meta(cursor)
+    refs = []
+    for _ in range(num_refs):
+        bins = _parse_bins(cursor, with_loffset=False)
+        (num_intervals,) = cursor.unpack("<i")
+        linear_index = list(cursor.unpack(f"<{num_intervals}Q"))
+        refs.append({"bins": bins, "linear_index": linear_index})
+    index.update({"min_shift": TABIX_MIN_SHIFT, "depth": TABIX_DEPTH, "refs": refs})
+    return index
+
+
+def _parse_csi(data):
+    cursor = _BinaryCursor(data)
+    cursor.pos = len(CSI_MAGIC)
+    min_shift, depth, aux_len = cursor.unpack("<3i")
+    aux = cursor.read(aux_len)
+    if aux_len >= 28:
+        index = _parse_tabix_meta(_BinaryCursor(aux))
+    else:
+        index = {"contigs": []}
+    (num_refs,) = cursor.unpack("<i")
+    refs = [
+        {"bins": _parse_bins(cursor, with_loffset=True), "linear_index": []}
+        for _ in range(num_refs)
+    ]
+    if len(index["contigs"]) != num_refs:
+        raise ValueError("The CSI index has no contig names for its references")
+    index.update({"min_shift": min_shift, "depth": depth, "refs": refs})
+    return index
+
+
+def _get_contig_offsets(index):
+    pseudo_bin = _get_pseudo_bin(index["min_shift"], index["depth"])
+    contig_offsets = {}
+    for contig, ref in zip(index["contigs"], index["refs"]):
+        chunks = [
+            chunk
+            for bin_, bin_chunks in ref["bins"].items()
+            if bin_ != pseudo_bin
+            for chunk in bin_chunks
+        ]
+        if chunks:
+            contig_offsets[contig] = (
+                min(chunk[0] for chunk in chunks),
+                max(chunk[1] for chunk in chunks),
+            )
+    return contig_offsets
+
+
+def find_vcf_index(vcf_path: Path) -> Path | None:
+    vcf_path = Path(vcf_path)
+    for suffix in INDEX_SUFFIXES:
+        index_path = vcf_path.with_name(vcf_path.name + suffix)
+        if index_path.exists():
+            return index_path
+    return None
+
+
+def read_vcf_index(index_path: Path) -> dict:
+    data = gzip.decompress(Path(index_path).read_bytes())
+    if data.startswith(TABIX_MAGIC):
+        index = _parse_tabix(data)
+    elif data.startswith(CSI_MAGIC):
+        index = _parse_csi(data)
+    else:
+        raise ValueError(f"Unknown index format: {index_path}")
+    index["contig_offsets"] = _get_contig_offsets(index)
+    return index
+
+
+def get_region_start_offset(index, region) -> int | None:
+    # Returns the lowest virtual offset from which the vars overlapping the
+    # region can be found, None if the index has no vars for it
+    chrom, start, end = region
+    try:
+        ref = index["refs"][index["contigs"].index(chrom)]
+    except ValueError:
+        return None
+
+    min_shift, depth = index["min_shift"], index["depth"]
+    beg = 0 if start is None else start - 1
+    end = 1 << (min_shift + depth * 3) if end is None else end
+    min_offset = 0
+    linear_index = ref["linear_index"]
+    if linear_index:
+        min_offset = linear_index[min(beg >> min_shift, len(linear_index) - 1)]
+
+    offsets = [
+        chunk_beg
+        for bin_ in _reg2bins(beg, end, min_shift, depth)
+        for chunk_beg, chunk_end in ref["bins"].get(bin_, [])
+        if chunk_end > min_offset
+    ]
+    if not offsets:
+        return None
+    return max(min(offsets), min_offset)
@@ -1,183 +1,517 @@
 from pathlib import Path
 from typing import Generator
 from collections import defaultdict, namedtuple
-from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import batched, count
+import contextlib
+import functools
+import heapq
+import math
+import shutil
+import tempfile
+import time
 
+import numpy
 from more_itertools import peekable
 
-from join_vcfs.vcf_parser import parse_vcf
+from join_vcfs.vcf_parser import (
+    parse_vcf,
+    get_batch_var_alleles,
+    get_var_batch_nbytes,
+    LazyVar,
+    MISSING_ALLELE,
+    ABSENT_ALLELE,
+    REF_BLOCK_ALTS,
+    SparseGTs,
+    densify_gts,
+    get_batch_sparse_gts,
+    get_batch_var_sparse_gts,
+    sum_parse_cache_stats,
+    update_binary_cache,
+)
+from join_vcfs.bgzf import DEFAULT_NUM_DECOMPRESSION_THREADS
+from join_vcfs.file_pool import FileHandlePool
+from join_vcfs.prefetch import (
+    Prefetcher,
+    DEFAULT_PREFETCH_MEMORY_BUDGET,
+    DEFAULT_PREFETCH_THREADS,
+)
+from join_vcfs.metrics import (
+    JoinMetrics,
+    sum_metrics_reports,
+    get_parse_cache_hit_rates,
+    write_metrics_report,
+)
+from join_vcfs.vcf_index import find_vcf_index, read_vcf_index
+from join_vcfs.contigs import infer_contig_table
+from join_vcfs.vcf_writer import (
+    write_vcf,
+    concatenate_vcf_parts,
+    Compression,
+    _guess_compression,
+)
+from join_vcfs.gt_store import (
+    write_gt_store,
+    concatenate_gt_store_parts,
+    GTStoreSettings,
+    DEFAULT_GT_STORE_CHUNK_SIZE,
+)
+from join_vcfs.allele_merging import merge_var_group
 
 
 class InternalError(RuntimeError):
     pass
 
 
-class VarIterStatus(Enum):
-    NO_VARS_LEFT = 1
-    NO_VARS_IN_CURRENT_CHROM = 2
+def _calculate_var_span(var):
+    # the alleles of the lazy vars are not decoded to group them
+    if isinstance(var, LazyVar):
+        return var.chrom, var.pos, var.pos + var.ref_len - 1
+    return var["chrom"], var["pos"], var["pos"] + len(var["alleles"][0]) - 1
 
 
-def _overlaps(var_span, var_group_span):
-    if var_span[0] != var_group_span[0]:
-        return False
-    var_start, var_end = var_span[1], var_span[2]
-    bin_start, bin_end = var_group_span[1], var_group_span[2]
-    if var_start < bin_start:
-        msg = "Implementation error, a var has a start lower than the current var bin"
-        msg += f"var: {var_span[0]}:{var_start}-{var_end} var_group_span: {var_group_span[0]}:{bin_start}-{bin_end}"
-        raise InternalError(msg)
-    if var_start <= bin_end:
-        return True
-    else:
-        return False
+# ref_gts has the GTs of the gVCFs without vars in the group that have a
+# reference block that covers it
+VarGroup = namedtuple("VarGroup", ["vars", "span", "ref_gts"], defaults=[None])
+# A group reaches its limits when its span reaches max_span or it holds
+# max_vars vars. With the split policy it stops growing there and the vars
+# that overlap it start the next group, so the output can have overlapping
+# vars. With the flag policy it keeps growing and it is only reported.
+GroupLimits = namedtuple(
+    "GroupLimits", ["max_span", "max_vars", "policy"], defaults=[None, None, "split"]
+)
+GROUP_LIMIT_POLICIES = ("split", "flag")
+MAX_REPORTED_LONG_GROUPS = 100
 
 
-def _calculate_var_span(var):
-    return var["chrom"], var["pos"], var["pos"] + len(var["alleles"][0]) - 1
+# the rank of the chromosomes not found in the given order
+_UNKNOWN_CHROM_RANK = -1
 
 
-def _add_var_to_bin(vars_in_bin, var, var_span, iterator_id, var_group_span):
-    vars_in_bin[iterator_id].append(var)
-    var_span = _calculate_var_span(var)
-    span_has_been_elongated = False
-    if var_span[2] > var_group_span[2]:
-        var_group_span = (var_group_span[0], var_group_span[1], var_span[2])
-        span_has_been_elongated = True
-    return span_has_been_elongated, var_group_span
+class _VarIterCursor:
+    ref_blocks = None
 
+    def __init__(self, vars):
+        self._vars = peekable(vars)
+        self._chrom_ranks = {}
 
-def _get_first_span(vcf_infos, current_chrom, chroms_seen, last_pos_analyzed):
-    first_span = None
-    no_vars_left = True
-    no_vars_in_current_chrom = True
+    def set_chrom_ranks(self, chrom_ranks):
+        self._chrom_ranks = chrom_ranks
 
-    for vcf_info in vcf_infos.values():
-        try:
-            next_var = vcf_info["vars_iter"].peek()
-            no_vars_left = False
-        except StopIteration:
-            continue
+    def peek_chrom_pos(self):
+        next_var = self._vars.peek(None)
+        if next_var is None:
+            return None
+        return next_var["chrom"], next_var["pos"]
 
-        chrom = next_var["chrom"]
-        if chrom in chroms_seen:
-            raise RuntimeError(
-                f"A chromosome already seen has appeared: {chrom}:{next_var['pos']}, VCF seems not to be ordered"
-            )
-        if next_var["pos"] < last_pos_analyzed:
-            raise RuntimeError(
-                f"The VCF seems not to be ordered: {chrom}:{next_var['pos']}"
-            )
+    def peek_rank_pos(self):
+        next_var = self._vars.peek(None)
+        if next_var is None:
+            return None
+        rank = self._chrom_ranks.get(next_var["chrom"], _UNKNOWN_CHROM_RANK)
+        return rank, next_var["pos"]
 
-        if chrom != current_chrom:
-            continue
-        no_vars_in_current_chrom = False
-        next_var_span = _calculate_var_span(next_var)
-        if first_span is None:
-            first_span = next_var_span
-        else:
-            if next_var_span[1] < first_span[1]:
-                first_span = next_var_span
-    return first_span, no_vars_left, no_vars_in_current_chrom
+    def pop(self):
+        return next(self._vars)
 
 
-VarGroup = namedtuple("VarGroup", ["vars", "span"])
+class _RefBlocks:
+    # The gVCF reference blocks skipped by the cursors of all the inputs, as
+    # [chrom rank, start, end, GTs] lists. The blocks wait in a heap by their
+    # start until the groups reach them, then they are active, one per input,
+    # until the groups pass their end, so a group only looks at the blocks
+    # that cover its start, not at every input.
+    def __init__(self):
+        self._pending = []
+        self._expiring = []
+        self._active = {}
+        self._last_blocks = {}
+        self._counter = count()
 
+    def add(self, vcf_id, rank, start, end, gts):
+        last_block = self._last_blocks.get(vcf_id)
+        # the adjacent blocks of an input with the same GTs are joined
+        if (
+            last_block is not None
+            and last_block[0] == rank
+            and start <= last_block[2] + 1
+            and numpy.array_equal(last_block[3], gts)
+        ):
+            last_block[2] = max(last_block[2], end)
+            return
+        block = [rank, start, end, gts]
+        self._last_blocks[vcf_id] = block
+        heapq.heappush(self._pending, (rank, start, next(self._counter), vcf_id, block))
 
-def _group_overlapping_vars_for_chrom(
-    vcf_infos, current_chrom, chroms_seen, last_pos_analyzed
-) -> Generator[VarIterStatus | VarGroup]:
-    first_span, no_vars_left, no_vars_in_current_chrom = _get_first_span(
-        vcf_infos, current_chrom, chroms_seen, last_pos_analyzed
-    )
+    def _activate_blocks(self, rank, start):
+        pending = self._pending
+        while pending and (pending[0][0], pending[0][1]) <= (rank, start):
+            *_, vcf_id, block = heapq.heappop(pending)
+            self._active[vcf_id] = block
+            heapq.heappush(
+                self._expiring, (block[0], block[2], next(self._counter), vcf_id, block)
+            )
 
-    if no_vars_in_current_chrom:
-        yield VarIterStatus.NO_VARS_IN_CURRENT_CHROM
-    elif no_vars_left:
-        yield VarIterStatus.NO_VARS_LEFT
-
-    if first_span is None:
-        raise InternalError("Here first span should not be None")
-    last_pos_analyzed = first_span[1]
-
-    vars_in_bin = defaultdict(list)
-    var_group_span = first_span
-    # everytime we elongate a span we have to go through every vcf to collect
-    # the possible overlapping variations
-    while True:
-        span_has_been_elongated = False
-        var_was_added = False
-        for vcf_id, vcf_info in vcf_infos.items():
-            try:
-                next_var = vcf_info["vars_iter"].peek()
-            except StopIteration:
+    def _expire_blocks(self, rank, start):
+        expiring = self._expiring
+        while expiring and (expiring[0][0], expiring[0][1]) < (rank, start):
+            _, block_end, _, vcf_id, block = heapq.heappop(expiring)
+            if block[2] != block_end:
+                # the block has been joined to the next one
+                heapq.heappush(
+                    expiring, (block[0], block[2], next(self._counter), vcf_id, block)
+                )
                 continue
-            next_var_span = _calculate_var_span(next_var)
+            if self._active.get(vcf_id) is block:
+                del self._active[vcf_id]
+            if self._last_blocks.get(vcf_id) is block:
+                del self._last_blocks[vcf_id]
+
+    def get_covering_gts(self, rank, start, end, vcf_ids_with_vars):
+        # the groups are expected in order
+        self._activate_blocks(rank, start)
+        self._expire_blocks(rank, start)
+        return {
+            vcf_id: block[3]
+            for vcf_id, block in self._active.items()
+            if block[2] >= end and vcf_id not in vcf_ids_with_vars
+        }
+
+
+def _find_ref_block_idxs(batch):
+    # the vars with a single ALT that is a reference block ALT
+    var_allele_offsets = batch.var_allele_offsets
+    candidates = numpy.flatnonzero(numpy.diff(var_allele_offsets) == 2)
+    alt_starts = batch.allele_offsets[var_allele_offsets[candidates] + 1]
+    alt_ends = batch.allele_offsets[var_allele_offsets[candidates] + 2]
+    alt_lens = set(map(len, REF_BLOCK_ALTS))
+    return {
+        idx
+        for idx, start, end in zip(
+            candidates.tolist(), alt_starts.tolist(), alt_ends.tolist()
+        )
+        if end - start in alt_lens and batch.alleles_buffer[start:end] in REF_BLOCK_ALTS
+    }
+
+
+def _get_ref_block_gts(gts):
+    # the blocks only give REF or missing alleles
+    gts = gts.copy()
+    gts[gts != 0] = MISSING_ALLELE
+    return gts
+
+
+def _drop_ref_block_allele(var):
+    # the variants of a gVCF have a reference block ALT for the other alleles,
+    # their GTs with it are left missing
+    alleles = var["alleles"]
+    if alleles[-1].encode() not in REF_BLOCK_ALTS:
+        return var
+    allele_idx = len(alleles) - 1
+    var["alleles"] = alleles[:-1]
+    gts = var["gts"]
+    if isinstance(gts, SparseGTs):
+        if numpy.any(gts.values == allele_idx):
+            values = numpy.where(gts.values == allele_idx, MISSING_ALLELE, gts.values)
+            var["gts"] = gts._replace(values=values)
+    elif numpy.any(gts == allele_idx):
+        is_ref_block_allele = gts == allele_idx
+        var["gts"] = numpy.where(is_ref_block_allele, MISSING_ALLELE, gts)
+        var["missing_mask"] = var["missing_mask"] | is_ref_block_allele
+    return var
+
+
+class _VarBatchCursor:
+    # Walks the VarBatches of a VCF, only the popped vars are turned into dicts
+    # with a sparse_fill the GTs of the popped vars are SparseGTs.
+    # The chromosome codes of every batch are turned into chromosome ranks
+    # once, so peeking does not look up the chromosome names.
+    # With ref_blocks the gVCF reference blocks are not returned as vars,
+    # they are added to ref_blocks, shared by the inputs, when they are
+    # skipped.
+    def __init__(self, var_batches, sparse_fill=None, ref_blocks=None, vcf_id=None):
+        self._batches = iter(var_batches)
+        self._sparse_fill = sparse_fill
+        self.ref_blocks = ref_blocks
+        self._vcf_id = vcf_id
+        self._ref_block_idxs = ()
+        self._chrom_ranks = {}
+        self._ranks_chroms = None
+        self._load_next_batch()
+
+    def set_chrom_ranks(self, chrom_ranks):
+        self._chrom_ranks = chrom_ranks
+        self._ranks_chroms = None
+        if self._batch is not None:
+            self._set_batch_ranks()
+
+    def _set_batch_ranks(self):
+        # the batches of a VCF share their chromosome list, the parsed ones
+        # add the new chromosomes to it
+        chroms = self._batch.chroms
+        if chroms is not self._ranks_chroms or len(chroms) != self._code_ranks.size:
+            self._ranks_chroms = chroms
+            self._code_ranks = numpy.array(
+                [self._chrom_ranks.get(chrom, _UNKNOWN_CHROM_RANK) for chrom in chroms],
+                dtype=numpy.int64,
+            )
+        self._ranks = self._code_ranks[self._batch.chrom_codes].tolist()
 
-            if _overlaps(next_var_span, var_group_span):
-                var_was_added = True
+    def _load_next_batch(self):
+        for batch in self._batches:
+            if batch.poss.size:
+                self._batch = batch
+                self._idx = 0
+                self._chrom_codes = batch.chrom_codes.tolist()
+                self._poss = batch.poss.tolist()
+                self._allele_offsets = batch.allele_offsets.tolist()
+                self._var_allele_offsets = batch.var_allele_offsets.tolist()
+                if self._sparse_fill is not None:
+                    self._sparse_gts = get_batch_sparse_gts(batch, self._sparse_fill)
+                    self._sparse_gt_offsets = self._sparse_gts.offsets.tolist()
+                if self.ref_blocks is not None:
+                    self._ref_block_idxs = _find_ref_block_idxs(batch)
+                self._set_batch_ranks()
+                return
+        self._batch = None
 
-                try:
-                    next_var = next(vcf_info["vars_iter"])
-                except StopIteration:
-                    msg = "Implementation error, we have previously peeked the var iterator and we made sure that a var was coming"
-                    raise InternalError(msg)
+    def _advance(self):
+        self._idx += 1
+        if self._idx == len(self._poss):
+            self._load_next_batch()
 
-                span_has_been_elongated_this_time, var_group_span = _add_var_to_bin(
-                    vars_in_bin, next_var, next_var_span, vcf_id, var_group_span
+    def _skip_ref_blocks(self):
+        # the blocks of the chromosomes not in the order are ignored
+        while self._batch is not None and self._idx in self._ref_block_idxs:
+            idx = self._idx
+            rank = self._ranks[idx]
+            if rank != _UNKNOWN_CHROM_RANK:
+                self.ref_blocks.add(
+                    self._vcf_id,
+                    rank,
+                    self._poss[idx],
+                    int(self._batch.ends[idx]),
+                    _get_ref_block_gts(self._get_dense_gts(idx)),
                 )
-                if span_has_been_elongated_this_time:
-                    span_has_been_elongated = True
+            self._advance()
 
-            if var_group_span[0] in chroms_seen:
-                msg = f"A chromosome already seen has appeared: {next_var_span[0]}:-{next_var_span[1]}, VCF seems not to be ordered"
-                raise RuntimeError(msg)
-            if var_group_span[1] < last_pos_analyzed:
-                msg = f"A variation seems not to be ordered: {next_var_span[0]}:-{next_var_span[1]}, VCF seems not to be ordered"
-                raise RuntimeError(msg)
+    def _get_sparse_gts(self, idx):
+        return get_batch_var_sparse_gts(self._sparse_gts, self._sparse_gt_offsets, idx)
 
-        if not span_has_been_elongated and not var_was_added:
-            break
-    last_pos_analyzed = var_group_span[1]
-    yield VarGroup(vars_in_bin, var_group_span)
+    def _get_dense_gts(self, idx):
+        if self._sparse_fill is None:
+            return self._batch.gts[idx]
+        return densify_gts(self._get_sparse_gts(idx))
+
+    def peek_chrom_pos(self):
+        self._skip_ref_blocks()
+        if self._batch is None:
+            return None
+        idx = self._idx
+        return self._batch.chroms[self._chrom_codes[idx]], self._poss[idx]
+
+    def peek_rank_pos(self):
+        self._skip_ref_blocks()
+        if self._batch is None:
+            return None
+        idx = self._idx
+        return self._ranks[idx], self._poss[idx]
+
+    def pop(self):
+        self._skip_ref_blocks()
+        batch = self._batch
+        if batch is None:
+            raise StopIteration
+        idx = self._idx
+        if self._sparse_fill is None:
+            gts = batch.gts[idx]
+            missing_mask = batch.missing_mask[idx]
+        else:
+            gts = self._get_sparse_gts(idx)
+            missing_mask = None
+        var = {
+            "chrom": batch.chroms[self._chrom_codes[idx]],
+            "pos": self._poss[idx],
+            "alleles": get_batch_var_alleles(
+                batch.alleles_buffer,
+                self._allele_offsets,
+                self._var_allele_offsets[idx],
+                self._var_allele_offsets[idx + 1],
+            ),
+            "gts": gts,
+            "missing_mask": missing_mask,
+        }
+        self._advance()
+        if self.ref_blocks is not None:
+            var = _drop_ref_block_allele(var)
+        return var
+
+
+def _push_next_var(heap, vcf_id, vars_cursor, previous_key=None):
+    # the chromosomes are compared by their ranks, the names are only needed
+    # to report the errors
+    key = vars_cursor.peek_rank_pos()
+    if key is None:
+        return
+    if key[0] == _UNKNOWN_CHROM_RANK:
+        chrom, pos = vars_cursor.peek_chrom_pos()
+        raise RuntimeError(
+            f"A chromosome not found in the given chromosome order has appeared: {chrom}:{pos}"
+        )
+    if previous_key is not None and key < previous_key:
+        chrom, pos = vars_cursor.peek_chrom_pos()
+        if key[0] < previous_key[0]:
+            msg = f"A chromosome already seen has appeared: {chrom}:{pos}, VCF seems not to be ordered"
+        else:
+            msg = f"A variation seems not to be ordered: {chrom}:{pos}, VCF seems not to be ordered"
+        raise RuntimeError(msg)
+    heapq.heappush(heap, (key[0], key[1], vcf_id))
 
 
-def _group_overlapping_vars(
+def group_overlapping_vars(
     vcf_infos: dict[int, dict],
     remaining_chromosomes: list[str],
+    group_limits: GroupLimits | None = None,
 ) -> Generator[VarGroup]:
-    remaining_chromosomes = remaining_chromosomes[:]
-
-    current_chrom = remaining_chromosomes.pop(0)
-    last_pos_analyzed = 0
-    chroms_seen = []
-    while current_chrom is not None:
-        res = None
-        for res in _group_overlapping_vars_for_chrom(
-            vcf_infos, current_chrom, chroms_seen, last_pos_analyzed
-        ):
-            if res == VarIterStatus.NO_VARS_IN_CURRENT_CHROM:
-                if remaining_chromosomes:
-                    chroms_seen.append(current_chrom)
-                    current_chrom = remaining_chromosomes.pop(0)
-                    last_pos_analyzed = 0
-                else:
-                    current_chrom = None
-                break  # the for that iterates over the grouped vars
-            elif res == VarIterStatus.NO_VARS_LEFT:
-                break  # the for that iterates over the grouped vars
-            else:
-                # This is a vars_group
-                yield res
-        if res == VarIterStatus.NO_VARS_LEFT:
-            break  # the while that iterates over chromosomes
+    # k-way merge of the sorted var iterators. The heap holds one entry per
+    # iterator, keyed by the (chromosome rank, start) of its next var, so
+    # building a group only touches the iterators whose next var overlaps it
+    # and every var is popped once, however long the chain of overlaps is.
+    chrom_ranks = {chrom: rank for rank, chrom in enumerate(remaining_chromosomes)}
+    max_span = max_vars = math.inf
+    if group_limits is not None and group_limits.policy == "split":
+        max_span = group_limits.max_span or math.inf
+        max_vars = group_limits.max_vars or math.inf
+
+    # the gVCF inputs share their reference blocks
+    ref_blocks = None
+    for vcf_info in vcf_infos.values():
+        if vcf_info["vars_cursor"].ref_blocks is not None:
+            ref_blocks = vcf_info["vars_cursor"].ref_blocks
+    heap = []
+    for vcf_id, vcf_info in vcf_infos.items():
+        vcf_info["vars_cursor"].set_chrom_ranks(chrom_ranks)
+        _push_next_var(heap, vcf_id, vcf_info["vars_cursor"])
+
+    while heap:
+        chrom_rank, group_start, _ = heap[0]
+        group_chrom = None
+        group_end = group_start
+        vars_in_bin = defaultdict(list)
+        num_vars = 0
+        # the active interval end grows as overlapping vars are added, a
+        # group always takes at least its first var
+        while heap and heap[0][0] == chrom_rank and heap[0][1] <= group_end:
+            if num_vars and (
+                num_vars >= max_vars or group_end - group_start + 1 >= max_span
+            ):
+                break
+            key = heapq.heappop(heap)
+            vcf_id = key[2]
+            vars_cursor = vcf_infos[vcf_id]["vars_cursor"]
+            try:
+                var = vars_cursor.pop()
+            except StopIteration:
+                msg = "Implementation error, we have previously peeked the var iterator and we made sure that a var was coming"
+                raise InternalError(msg)
+            vars_in_bin[vcf_id].append(var)
+            num_vars += 1
+            var_span = _calculate_var_span(var)
+            group_chrom = var_span[0]
+            if var_span[2] > group_end:
+                group_end = var_span[2]
+            _push_next_var(heap, vcf_id, vars_cursor, key[:2])
+
+        # the next var of every input is past the group, so the blocks that
+        # could cover it have already been skipped
+        ref_gts = None
+        if ref_blocks is not None:
+            ref_gts = ref_blocks.get_covering_gts(
+                chrom_rank, group_start, group_end, vars_in_bin
+            )
+        yield VarGroup(vars_in_bin, (group_chrom, group_start, group_end), ref_gts)
+
+
+def _create_group_stats(group_limits):
+    return {
+        "policy": group_limits.policy,
+        "num_groups": 0,
+        "max_span": 0,
+        "max_vars": 0,
+        "num_long_groups": 0,
+        "long_groups": [],
+    }
+
+
+def _track_long_groups(var_groups, group_limits, group_stats):
+    # the groups that reach the limits are counted and the first ones are
+    # reported as [chrom, start, end, num_vars]
+    max_span = group_limits.max_span or math.inf
+    max_vars = group_limits.max_vars or math.inf
+    for var_group in var_groups:
+        chrom, start, end = var_group.span
+        span = end - start + 1
+        num_vars = sum(map(len, var_group.vars.values()))
+        group_stats["num_groups"] += 1
+        group_stats["max_span"] = max(group_stats["max_span"], span)
+        group_stats["max_vars"] = max(group_stats["max_vars"], num_vars)
+        if span >= max_span or num_vars >= max_vars:
+            group_stats["num_long_groups"] += 1
+            if len(group_stats["long_groups"]) < MAX_REPORTED_LONG_GROUPS:
+                group_stats["long_groups"].append([chrom, start, end, num_vars])
+        yield var_group
+
+
+def _check_group_limits(group_limits):
+    if group_limits.policy not in GROUP_LIMIT_POLICIES:
+        raise ValueError(
+            f"The long group policy should be one of {GROUP_LIMIT_POLICIES}: {group_limits.policy}"
+        )
+    limits = [limit for limit in group_limits[:2] if limit is not None]
+    if min(limits) < 1:
+        raise ValueError("The group limits should be at least 1")
 
 
-def _create_vcf_infos(vcf_paths) -> dict[int, dict]:
+def create_vcf_infos(
+    vcf_paths,
+    decompression_executor: ThreadPoolExecutor | None = None,
+    region: tuple | None = None,
+    use_var_batches: bool = True,
+    file_pool: FileHandlePool | None = None,
+    parse_cache_sizes: dict[str, int | None] | None = None,
+    binary_cache_dir: Path | None = None,
+    sparse_fill: int | None = None,
+    metrics: JoinMetrics | None = None,
+    prefetcher: Prefetcher | None = None,
+    lazy_vars: bool = False,
+    gvcf: bool = False,
+) -> dict[int, dict]:
+    # the VarBatches are read ahead by the prefetcher, the vars are not
+    # without var batches the vars can be LazyVars, so the grouping does not
+    # parse their GTs
+    # with gvcf the reference blocks of the inputs are tracked by their cursors
+    if gvcf and not use_var_batches:
+        raise ValueError("The gVCF reference blocks are only tracked in var batches")
     vcf_paths = [Path(path) for path in vcf_paths]
-    parsing_results = [parse_vcf(path) for path in vcf_paths]
+    parsing_results = [
+        parse_vcf(
+            path,
+            region=region,
+            decompression_executor=decompression_executor,
+            as_batches=use_var_batches,
+            file_pool=file_pool,
+            parse_cache_sizes=parse_cache_sizes,
+            binary_cache_dir=binary_cache_dir,
+            sparse_fill=sparse_fill,
+            metrics=metrics,
+            lazy_vars=lazy_vars and not use_var_batches,
+        )
+        for path in vcf_paths
+    ]
 
     vcf_infos = {}
     samples_seen = set()
+    ref_blocks = _RefBlocks() if gvcf else None
     for idx, result in enumerate(parsing_results):
         metadata = result["metadata"]
         this_samples = list(map(str, metadata["samples"]))
@@ -190,20 +524,644 @@ def _create_vcf_infos(vcf_paths) -> dict[int, dict]:
             )
         samples_seen.update(this_samples)
 
+        if use_var_batches:
+            var_batches = result["var_batches"]
+            if prefetcher is not None:
+                var_batches = prefetcher.prefetch(
+                    var_batches, get_var_batch_nbytes, name=vcf_paths[idx].name
+                )
+                if metrics is not None:
+                    var_batches = metrics.time_iter("prefetch_wait", var_batches)
+            vars_cursor = _VarBatchCursor(var_batches, sparse_fill, ref_blocks, idx)
+        else:
+            vars_cursor = _VarIterCursor(result["vars"])
         vcf_info = {
-            "vars_iter": peekable(result["vars"]),
+            "vars_cursor": vars_cursor,
             "samples": metadata["samples"],
             "ploidy": metadata["ploidy"],
             "fhand": result["fhand"],
+            "parse_caches": result["parse_caches"],
         }
         vcf_infos[idx] = vcf_info
     return vcf_infos
 
 
-def join_vcfs(vcf_paths: list[Path], ordered_chromosomes: list):
+def get_merged_samples(
+    vcf_infos: dict[int, dict],
+) -> tuple[list[str], dict[int, slice]]:
+    # the samples of the VCFs one after the other, with the slice of each VCF
+    sample_slices = {}
+    start = 0
+    for vcf_id, vcf_info in vcf_infos.items():
+        end = start + vcf_info["samples"].size
+        sample_slices[vcf_id] = slice(start, end)
+        start = end
+    samples = [str(sample) for info in vcf_infos.values() for sample in info["samples"]]
+    return samples, sample_slices
+
+
+def get_merged_ploidy(vcf_infos: dict[int, dict]) -> int:
+    ploidies = {vcf_info["ploidy"] for vcf_info in vcf_infos.values()}
+    if len(ploidies) > 1:
+        raise NotImplementedError(
+            f"Joining VCFs with different ploidies is not implemented: {sorted(ploidies)}"
+        )
+    return ploidies.pop()
+
+
+def _merge_var_groups(var_groups, vcf_infos, absent_allele=MISSING_ALLELE):
+    samples, sample_slices = get_merged_samples(vcf_infos)
+    ploidy = get_merged_ploidy(vcf_infos)
+    for var_group in var_groups:
+        yield merge_var_group(
+            var_group, sample_slices, len(samples), ploidy, absent_allele=absent_allele
+        )
+
+
+def close_vcf_infos(vcf_infos: dict[int, dict]):
+    for vcf_info in vcf_infos.values():
+        vcf_info["fhand"].close()
+
+
+Shard = namedtuple("Shard", ["chrom", "start", "end"])
+# The settings shared by all the joins of a join_vcfs call, created and
+# checked once by join_vcfs, see it for their meaning. group_limits and
+# gt_store are GroupLimits and GTStoreSettings or None. The tree joins replace
+# the ones that change for their intermediates.
+JoinSettings = namedtuple(
+    "JoinSettings",
+    [
+        "compression",
+        "num_decompression_threads",
+        "num_processes",
+        "shard_window_size",
+        "chrom_lengths",
+        "tmp_dir",
+        "max_open_files",
+        "parse_cache_sizes",
+        "binary_cache_dir",
+        "sparse_gts",
+        "collect_metrics",
+        "progress_interval",
+        "prefetch_queue_size",
+        "prefetch_memory_budget",
+        "prefetch_threads",
+        "group_limits",
+        "gvcf",
+        "gt_store",
+    ],
+)
+
+
+def _restrict_var_groups_to_shard(var_groups, shard):
+    # a group belongs to the shard in which it starts
+    for var_group in var_groups:
+        start = var_group.span[1]
+        if shard.start is not None and start < shard.start:
+            continue
+        if shard.end is not None and start >= shard.end:
+            break
+        yield var_group
+
+
+def _join(
+    vcf_paths,
+    ordered_chromosomes,
+    out_vcf_path,
+    settings: JoinSettings,
+    shard=None,
+    write_header=True,
+    from_intermediates=False,
+    to_intermediate=False,
+):
+    num_decompression_threads = settings.num_decompression_threads
+    max_open_files = settings.max_open_files
+    group_limits = settings.group_limits
+    # the BGZF inputs share the decompression threads
+    decompression_executor = None
+    if num_decompression_threads > 1:
+        decompression_executor = ThreadPoolExecutor(num_decompression_threads)
+    # the inputs are only kept open while they are read if there are too many
+    file_pool = None
+    if max_open_files is not None and max_open_files < len(vcf_paths):
+        file_pool = FileHandlePool(max_open_files)
+    # Vars that end before the shard start can not belong to a group that
+    # starts inside the shard, so the inputs are read from there
+    region = None if shard is None else (shard.chrom, shard.start, None)
+    # the sparse GTs are filled with ABSENT when the inputs are tree join
+    # intermediates, otherwise with REF, as most of the input GTs
+    sparse_fill = None
+    if settings.sparse_gts:
+        sparse_fill = ABSENT_ALLELE if from_intermediates else 0
+    metrics = None
+    if settings.collect_metrics or settings.progress_interval is not None:
+        metrics = JoinMetrics(settings.progress_interval)
+    group_stats = None
+    if group_limits is not None:
+        group_stats = _create_group_stats(group_limits)
+    # the inputs are read ahead in a thread pool while they are joined
+    prefetcher = None
+    if settings.prefetch_queue_size is not None:
+        prefetcher = Prefetcher(
+            settings.prefetch_queue_size,
+            settings.prefetch_memory_budget,
+            settings.prefetch_threads,
+        )
+    vcf_infos = {}
+
+    try:
+        vcf_infos = create_vcf_infos(
+            vcf_paths,
+            decompression_executor,
+            region=region,
+            file_pool=file_pool,
+            parse_cache_sizes=settings.parse_cache_sizes,
+            binary_cache_dir=settings.binary_cache_dir,
+            sparse_fill=sparse_fill,
+            metrics=metrics,
+            prefetcher=prefetcher,
+            gvcf=settings.gvcf,
+        )
+        var_bins = group_overlapping_vars(
+            vcf_infos, ordered_chromosomes, group_limits
+        )
+        if shard is not None:
+            var_bins = _restrict_var_groups_to_shard(var_bins, shard)
+        if group_stats is not None:
+            var_bins = _track_long_groups(var_bins, group_limits, group_stats)
+        if metrics is not None:
+            var_bins = metrics.track_var_groups(var_bins)
+        # the intermediates keep the samples without vars as absent
+        merged_vars = _merge_var_groups(
+            var_bins, vcf_infos, ABSENT_ALLELE if to_intermediate else MISSING_ALLELE
+        )
+        if metrics is not None:
+            merged_vars = metrics.time_iter("merge", merged_vars)
+        samples, _ = get_merged_samples(vcf_infos)
+        with contextlib.nullcontext() if metrics is None else metrics.stage("write"):
+            if settings.gt_store is None:
+                write_vcf(
+                    out_vcf_path,
+                    merged_vars,
+                    samples=samples,
+                    ploidy=get_merged_ploidy(vcf_infos),
+                    chromosomes=ordered_chromosomes,
+                    compression=settings.compression,
+                    write_header=write_header,
+                    is_part=shard is not None,
+                )
+            else:
+                write_gt_store(
+                    out_vcf_path,
+                    merged_vars,
+                    samples=samples,
+                    ploidy=get_merged_ploidy(vcf_infos),
+                    chromosomes=ordered_chromosomes,
+                    chunk_size=settings.gt_store.chunk_size,
+                    compress_chunks=settings.gt_store.compress_chunks,
+                )
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+        close_vcf_infos(vcf_infos)
+        if file_pool is not None:
+            file_pool.close()
+        if decompression_executor is not None:
+            decompression_executor.shutdown(cancel_futures=True)
+    return {
+        "file_pool": None if file_pool is None else dict(file_pool.stats),
+        "prefetch": None if prefetcher is None else prefetcher.get_stats(),
+        "groups": group_stats,
+        "parse_caches": sum_parse_cache_stats(
+            vcf_info["parse_caches"].get_stats() for vcf_info in vcf_infos.values()
+        ),
+        "metrics": None if metrics is None else metrics.get_report(),
+    }
+
+
+def _sum_process_stats(stats_list, max_keys):
+    # the processes have their own pools and prefetchers, so their maximums
+    # are not added
+    stats_list = [stats for stats in stats_list if stats]
+    if not stats_list:
+        return None
+    summed = {key: sum(stats[key] for stats in stats_list) for key in stats_list[0]}
+    for key in max_keys:
+        summed[key] = max(stats[key] for stats in stats_list)
+    return summed
+
+
+def _sum_group_stats(stats_list):
+    # only the first long groups of all the processes are kept
+    stats_list = [stats for stats in stats_list if stats]
+    if not stats_list:
+        return None
+    summed = _sum_process_stats(
+        [
+            {
+                key: value
+                for key, value in stats.items()
+                if key not in ("policy", "long_groups")
+            }
+            for stats in stats_list
+        ],
+        ["max_span", "max_vars"],
+    )
+    summed["policy"] = stats_list[0]["policy"]
+    long_groups = [group for stats in stats_list for group in stats["long_groups"]]
+    summed["long_groups"] = long_groups[:MAX_REPORTED_LONG_GROUPS]
+    return summed
+
+
+def _sum_join_stats(stats_list):
+    return {
+        "file_pool": _sum_process_stats(
+            (stats["file_pool"] for stats in stats_list), ["max_open_files"]
+        ),
+        "prefetch": _sum_process_stats(
+            (stats["prefetch"] for stats in stats_list), ["max_used_bytes"]
+        ),
+        "groups": _sum_group_stats(stats["groups"] for stats in stats_list),
+        "parse_caches": sum_parse_cache_stats(
+            stats["parse_caches"] for stats in stats_list
+        ),
+        "metrics": sum_metrics_reports(stats["metrics"] for stats in stats_list),
+    }
+
+
+def _join_shard(
+    shard_idx_and_shard,
+    vcf_paths,
+    ordered_chromosomes,
+    parts_dir,
+    settings,
+    from_intermediates,
+):
+    shard_idx, shard = shard_idx_and_shard
+    part_path = Path(parts_dir) / f"part_{shard_idx:06d}"
+    stats = _join(
+        vcf_paths,
+        ordered_chromosomes,
+        part_path,
+        settings,
+        shard=shard,
+        write_header=shard_idx == 0,
+        from_intermediates=from_intermediates,
+    )
+    return part_path, stats
+
+
+def _estimate_chrom_lengths_from_indexes(vcf_paths):
+    # the tabix linear index has one entry per 16 kb window with vars
+    chrom_lengths = {}
+    for vcf_path in vcf_paths:
+        index_path = find_vcf_index(vcf_path)
+        if index_path is None:
+            continue
+        index = read_vcf_index(index_path)
+        for contig, ref in zip(index["contigs"], index["refs"]):
+            length = len(ref["linear_index"]) << index["min_shift"]
+            chrom_lengths[contig] = max(chrom_lengths.get(contig, 0), length)
+    return chrom_lengths
+
+
+def _plan_shards(vcf_paths, ordered_chromosomes, window_size, chrom_lengths):
+    if window_size is None:
+        return [Shard(chrom, None, None) for chrom in ordered_chromosomes]
+
+    chrom_lengths = dict(chrom_lengths or {})
+    if any(chrom not in chrom_lengths for chrom in ordered_chromosomes):
+        estimated_lengths = _estimate_chrom_lengths_from_indexes(vcf_paths)
+        chrom_lengths = estimated_lengths | chrom_lengths
+
+    shards = []
+    for chrom in ordered_chromosomes:
+        length = chrom_lengths.get(chrom)
+        if not length:
+            shards.append(Shard(chrom, None, None))
+            continue
+        window_starts = list(range(1, length + 1, window_size))
+        for start, next_start in zip(window_starts, window_starts[1:] + [None]):
+            # the last window is left open in case the length is an underestimate
+            shards.append(Shard(chrom, None if start == 1 else start, next_start))
+    return shards
+
+
+def _join_in_parallel(
+    vcf_paths, ordered_chromosomes, out_vcf_path, settings, from_intermediates
+):
+    shards = _plan_shards(
+        vcf_paths,
+        ordered_chromosomes,
+        settings.shard_window_size,
+        settings.chrom_lengths,
+    )
+    join_shard = functools.partial(
+        _join_shard,
+        vcf_paths=vcf_paths,
+        ordered_chromosomes=ordered_chromosomes,
+        settings=settings,
+        from_intermediates=from_intermediates,
+    )
+    with (
+        tempfile.TemporaryDirectory(dir=settings.tmp_dir) as parts_dir,
+        ProcessPoolExecutor(settings.num_processes) as executor,
+    ):
+        if settings.binary_cache_dir is not None:
+            # the caches are built once before the shards share them
+            update_cache = functools.partial(
+                update_binary_cache,
+                binary_cache_dir=settings.binary_cache_dir,
+                num_decompression_threads=settings.num_decompression_threads,
+            )
+            list(executor.map(update_cache, vcf_paths))
+        results = list(
+            executor.map(
+                functools.partial(join_shard, parts_dir=parts_dir), enumerate(shards)
+            )
+        )
+        part_paths = [part_path for part_path, _ in results]
+        gt_store = settings.gt_store
+        if gt_store is None:
+            concatenate_vcf_parts(out_vcf_path, part_paths, settings.compression)
+        else:
+            # the parts are stores that are chunked again
+            concatenate_gt_store_parts(
+                out_vcf_path, part_paths, gt_store.chunk_size, gt_store.compress_chunks
+            )
+    return _sum_join_stats([stats for _, stats in results])
+
+
+def _join_all(
+    vcf_paths, ordered_chromosomes, out_vcf_path, settings, from_intermediates=False
+):
+    if settings.num_processes > 1:
+        # every shard is joined in a worker process into a temporary part
+        return _join_in_parallel(
+            vcf_paths, ordered_chromosomes, out_vcf_path, settings, from_intermediates
+        )
+    else:
+        return _join(
+            vcf_paths,
+            ordered_chromosomes,
+            out_vcf_path,
+            settings,
+            from_intermediates=from_intermediates,
+        )
+
+
+def _join_tree_batch(
+    batch_idx_and_paths, ordered_chromosomes, level_dir, settings, is_first_level
+):
+    batch_idx, vcf_paths = batch_idx_and_paths
+    out_path = Path(level_dir) / f"batch_{batch_idx:06d}.vcf.gz"
+    if len(vcf_paths) == 1 and not is_first_level:
+        # the previous level is removed, so its intermediate is kept
+        shutil.move(vcf_paths[0], out_path)
+        return out_path, None
+    stats = _join(
+        vcf_paths,
+        ordered_chromosomes,
+        out_path,
+        settings._replace(compression=Compression.BGZF),
+        # the samples of the intermediates are absent where they had no vars
+        from_intermediates=not is_first_level,
+        to_intermediate=True,
+    )
+    return out_path, stats
+
+
+def _get_level_setting(settings, level):
+    # the last setting is kept for the remaining levels
+    if not isinstance(settings, (list, tuple)):
+        return settings
+    return settings[min(level, len(settings) - 1)]
+
+
+def _join_tree_levels(
+    vcf_paths,
+    ordered_chromosomes,
+    settings,
+    fan_ins,
+    level_tmp_dirs,
+    level_dir_stack,
+):
+    # Every level joins batches of fan_in files into intermediate multi
+    # sample files until the remaining ones can be joined at once. Returns
+    # the remaining paths and the stats of the intermediate joins, the
+    # intermediates of a level are removed once the next one is joined.
+    stats_list = []
+    level = 0
+    previous_level_dir = None
+    while len(vcf_paths) > _get_level_setting(fan_ins, level):
+        fan_in = _get_level_setting(fan_ins, level)
+        level_dir = level_dir_stack.enter_context(
+            tempfile.TemporaryDirectory(
+                dir=_get_level_setting(level_tmp_dirs, level), prefix=f"level{level}_"
+            )
+        )
+        # only the inputs are binary cached
+        level_settings = settings
+        if level:
+            level_settings = settings._replace(binary_cache_dir=None)
+        join_batch = functools.partial(
+            _join_tree_batch,
+            ordered_chromosomes=ordered_chromosomes,
+            level_dir=level_dir,
+            settings=level_settings,
+            is_first_level=level == 0,
+        )
+        batches = enumerate(batched(vcf_paths, fan_in))
+        if settings.num_processes > 1:
+            with ProcessPoolExecutor(settings.num_processes) as executor:
+                results = list(executor.map(join_batch, batches))
+        else:
+            results = list(map(join_batch, batches))
+        vcf_paths = [path for path, _ in results]
+        stats_list.extend(stats for _, stats in results if stats is not None)
+        if previous_level_dir is not None:
+            shutil.rmtree(previous_level_dir, ignore_errors=True)
+        previous_level_dir = level_dir
+        level += 1
+    return vcf_paths, stats_list
+
+
+def _join_tree(
+    vcf_paths,
+    ordered_chromosomes,
+    out_vcf_path,
+    settings,
+    tree_fan_in,
+    tree_tmp_dirs,
+):
+    fan_ins = tree_fan_in if isinstance(tree_fan_in, (list, tuple)) else [tree_fan_in]
+    if tree_tmp_dirs is None:
+        tree_tmp_dirs = settings.tmp_dir
+    with contextlib.ExitStack() as level_dir_stack:
+        remaining_paths, stats_list = _join_tree_levels(
+            vcf_paths,
+            ordered_chromosomes,
+            settings,
+            fan_ins,
+            tree_tmp_dirs,
+            level_dir_stack,
+        )
+        from_intermediates = remaining_paths != vcf_paths
+        if from_intermediates:
+            settings = settings._replace(binary_cache_dir=None)
+        stats = _join_all(
+            remaining_paths,
+            ordered_chromosomes,
+            out_vcf_path,
+            settings,
+            from_intermediates=from_intermediates,
+        )
+    return _sum_join_stats(stats_list + [stats])
+
+
+def _check_join_settings(settings, tree_fan_in):
+    if settings.group_limits is not None:
+        _check_group_limits(settings.group_limits)
+    if settings.prefetch_queue_size is not None and settings.prefetch_queue_size < 1:
+        raise ValueError("The prefetch queue size should be at least 1")
+    if settings.prefetch_threads < 1:
+        raise ValueError("The number of prefetch threads should be at least 1")
+    if tree_fan_in is None:
+        return
+    fan_ins = tree_fan_in if isinstance(tree_fan_in, (list, tuple)) else [tree_fan_in]
+    if not fan_ins or min(fan_ins) < 2:
+        raise ValueError("The tree fan in should be at least 2")
+    if settings.gvcf:
+        raise NotImplementedError(
+            "Tree joins of gVCFs are not implemented, the intermediates have no reference blocks"
+        )
+    if settings.gt_store is not None:
+        raise NotImplementedError("Tree joins into a GT store are not implemented")
+
+
+def join_vcfs(
+    vcf_paths: list[Path],
+    ordered_chromosomes: list | None,
+    out_vcf_path: Path,
+    compression: Compression | None = None,
+    num_decompression_threads: int = DEFAULT_NUM_DECOMPRESSION_THREADS,
+    num_processes: int = 1,
+    shard_window_size: int | None = None,
+    chrom_lengths: dict[str, int] | None = None,
+    tmp_dir: Path | None = None,
+    max_open_files: int | None = None,
+    parse_cache_sizes: dict[str, int | None] | None = None,
+    binary_cache_dir: Path | None = None,
+    tree_fan_in: int | list[int] | None = None,
+    tree_tmp_dirs: Path | list[Path] | None = None,
+    sparse_gts: bool = False,
+    metrics_report_path: Path | None = None,
+    progress_interval: float | None = None,
+    prefetch_queue_size: int | None = None,
+    prefetch_memory_budget: int = DEFAULT_PREFETCH_MEMORY_BUDGET,
+    prefetch_threads: int = DEFAULT_PREFETCH_THREADS,
+    max_group_span: int | None = None,
+    max_group_vars: int | None = None,
+    long_group_policy: str = "split",
+    gvcf: bool = False,
+    gt_store: bool = False,
+    gt_store_chunk_size: int = DEFAULT_GT_STORE_CHUNK_SIZE,
+    compress_gt_store_chunks: bool = False,
+) -> dict:
+    # Without ordered_chromosomes the order is taken from the ##contig lines
+    # of the inputs, or from their indexes, and the contig lengths are used
+    # to plan the shards.
+    # max_open_files limits the inputs open at once in every process, the
+    # returned stats report how many times they had to be reopened and the
+    # hits and misses of the parse caches, sized by parse_cache_sizes.
+    # The inputs parsed once are kept in binary_cache_dir and mapped in
+    # later joins until they change.
+    # With a tree_fan_in the inputs are joined level by level, in batches of
+    # fan_in inputs per level, into intermediate files written in the level
+    # tmp dirs. Both can be given per level, the last one is kept for the
+    # remaining levels.
+    # With sparse_gts only the GTs that differ from the most common one are
+    # kept from the parsing to the writing of every var.
+    # With a metrics_report_path the stage times and the grouping counters
+    # are written as JSON and returned under "metrics", with a
+    # progress_interval in seconds the current position and the vars/s of
+    # every process are reported while joining.
+    # With a prefetch_queue_size the inputs are read and parsed ahead in a
+    # pool of prefetch_threads threads, up to that number of batches per
+    # input and to a prefetch_memory_budget in bytes shared by all of them.
+    # The groups of overlapping vars that reach a max_group_span or
+    # max_group_vars are split or only flagged, following the
+    # long_group_policy, and they are reported under "groups". With several
+    # processes a group that crosses a shard boundary can be split at other
+    # vars than in a single process join.
+    # With gvcf the inputs are gVCFs, their reference blocks are not written
+    # and their samples get the GTs of the blocks that cover the vars of the
+    # other inputs, usually REF, instead of missing.
+    # With gt_store the joined vars are written into a GT store in the
+    # out_vcf_path dir instead of a VCF, in chunks of gt_store_chunk_size
+    # vars, compressed with compress_gt_store_chunks. It can be read with
+    # read_gt_store.
+    vcf_paths = [Path(path) for path in vcf_paths]
+    if ordered_chromosomes is None:
+        contig_table = infer_contig_table(vcf_paths)
+        ordered_chromosomes = list(contig_table)
+        contig_lengths = {
+            chrom: length for chrom, length in contig_table.items() if length
+        }
+        chrom_lengths = contig_lengths | (chrom_lengths or {})
     if not ordered_chromosomes:
         raise ValueError("Al least one chromosome should be given")
-    remaining_chromosomes = ordered_chromosomes[:]
-    vcf_infos = _create_vcf_infos(vcf_paths)
+    out_vcf_path = Path(out_vcf_path)
+    ordered_chromosomes = list(ordered_chromosomes)
+    if compression is None:
+        compression = _guess_compression(out_vcf_path)
+    group_limits = None
+    if max_group_span is not None or max_group_vars is not None:
+        group_limits = GroupLimits(max_group_span, max_group_vars, long_group_policy)
+    gt_store_settings = None
+    if gt_store:
+        gt_store_settings = GTStoreSettings(gt_store_chunk_size, compress_gt_store_chunks)
+    settings = JoinSettings(
+        compression=compression,
+        num_decompression_threads=num_decompression_threads,
+        num_processes=num_processes,
+        shard_window_size=shard_window_size,
+        chrom_lengths=chrom_lengths,
+        tmp_dir=tmp_dir,
+        max_open_files=max_open_files,
+        parse_cache_sizes=parse_cache_sizes,
+        binary_cache_dir=binary_cache_dir,
+        sparse_gts=sparse_gts,
+        collect_metrics=metrics_report_path is not None,
+        progress_interval=progress_interval,
+        prefetch_queue_size=prefetch_queue_size,
+        prefetch_memory_budget=prefetch_memory_budget,
+        prefetch_threads=prefetch_threads,
+        group_limits=group_limits,
+        gvcf=gvcf,
+        gt_store=gt_store_settings,
+    )
+    _check_join_settings(settings, tree_fan_in)
+
+    start = time.perf_counter()
+    if tree_fan_in is None:
+        stats = _join_all(vcf_paths, ordered_chromosomes, out_vcf_path, settings)
+    else:
+        stats = _join_tree(
+            vcf_paths,
+            ordered_chromosomes,
+            out_vcf_path,
+            settings,
+            tree_fan_in,
+            tree_tmp_dirs,
+        )
 
-    var_bins = _group_overlapping_vars(vcf_infos, remaining_chromosomes)
+    if stats["metrics"] is not None:
+        stats["metrics"]["elapsed_wall"] = time.perf_counter() - start
+        stats["metrics"]["parse_cache_hit_rates"] = get_parse_cache_hit_rates(
+            stats["parse_caches"]
+        )
+        stats["metrics"]["file_pool"] = stats["file_pool"]
+    if metrics_report_path is not None:
+        write_metrics_report(metrics_report_path, stats["metrics"])
+    return stats
@@ -1,12 +1,42 @@
 from pathlib import Path
 import array
 from enum import Enum
+from collections import namedtuple
 import gzip
 import functools
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, batched, chain
+from typing import Iterator
 
 import numpy
 
+from join_vcfs.bgzf import (
+    BGZFReader,
+    is_bgzf,
+    GZIP_MAGIC,
+    DEFAULT_NUM_DECOMPRESSION_THREADS,
+)
+from join_vcfs.binary_cache import (
+    BinaryCacheFile,
+    get_binary_cache_path,
+    read_binary_cache,
+    write_binary_cache,
+)
+from join_vcfs.mmap_reader import MmapLineReader, LineBlock, can_map_file
+from join_vcfs.vcf_index import (
+    find_vcf_index,
+    read_vcf_index,
+    parse_region,
+    get_region_start_offset,
+)
+
 MISSING_ALLELE = -1
+# The samples of the tree join intermediates that had no var are written
+# with this allele, so they are not taken as missing by the next levels. It
+# is parsed as missing, with its own value.
+ABSENT_ALLELE = -2
+ABSENT_ALLELE_STR = b"-"
 PYTHON_ARRAY_TYPE = "i"
 BYTE_SIZE_OF_INT = array.array(PYTHON_ARRAY_TYPE, [0]).itemsize
 MAX_ALLELE_NUMBER = {1: 127, 2: 32767, 4: 2147483647}[BYTE_SIZE_OF_INT]
@@ -25,74 +55,193 @@ VCF_SAMPLE_LINE_ITEMS = [
 ]
 
 
-class _VCFKind(Enum):
+VCF_NUM_FIXED_FIELDS = len(VCF_SAMPLE_LINE_ITEMS)
+VAR_LINES_BATCH_NUM_GTS = 2**20
+_ORD_NEWLINE = ord("\n")
+# the ALT of the gVCF reference blocks, they span from POS to their INFO END
+REF_BLOCK_ALTS = (b"<NON_REF>", b"<*>")
+_ORD_COLON = ord(":")
+_ORD_MISSING = ord(".")
+_ORD_ABSENT = ord(ABSENT_ALLELE_STR)
+_ORD_ZERO = ord("0")
+_ORD_UNPHASED_SEP = ord("/")
+_ORD_PHASED_SEP = ord("|")
+# the values of the allele chars decoded for all the samples at once, single
+# digits, missing or absent
+_FAST_ALLELE_CHAR_VALUES = numpy.zeros(256, dtype=GT_NUMPY_DTYPE)
+_FAST_ALLELE_CHAR_VALUES[_ORD_ZERO : _ORD_ZERO + 10] = numpy.arange(10)
+_FAST_ALLELE_CHAR_VALUES[_ORD_MISSING] = MISSING_ALLELE
+_FAST_ALLELE_CHAR_VALUES[_ORD_ABSENT] = ABSENT_ALLELE
+_IS_FAST_ALLELE_CHAR = numpy.zeros(256, dtype=bool)
+_IS_FAST_ALLELE_CHAR[_ORD_ZERO : _ORD_ZERO + 10] = True
+_IS_FAST_ALLELE_CHAR[[_ORD_MISSING, _ORD_ABSENT]] = True
+
+
+VCF_KIND_DETECTION_SIZE = 512
+
+
+class VCFKind(Enum):
     VCF = "vcf"
     GzippedVCF = "GzippedVCF"
+    BGZippedVCF = "BGZippedVCF"
+
+
+def _guess_vcf_kind_from_start(start: bytes):
+    if start[:1] == b"#":
+        return VCFKind.VCF
+    elif start[:2] == GZIP_MAGIC:
+        if is_bgzf(start):
+            return VCFKind.BGZippedVCF
+        return VCFKind.GzippedVCF
+    raise ValueError("Invalid VCF file, it does not start with # and its not gzipped")
 
 
 def _guess_vcf_file_kind(path: Path):
-    is_gzipped = False
     with path.open("rb") as fhand:
-        start = fhand.read(2)
-        if start[:1] == b"#":
-            return _VCFKind.VCF
-        elif start[:2] == b"\x1f\x8b":
-            is_gzipped = True
+        start = fhand.read(VCF_KIND_DETECTION_SIZE)
+        kind = _guess_vcf_kind_from_start(start)
+        if kind == VCFKind.VCF:
+            return kind
+        fhand.seek(0)
+        with gzip.GzipFile(fileobj=fhand) as gzip_fhand:
+            if gzip_fhand.read(1) != b"#":
+                raise ValueError("Invalid VCF gzipped file, it does not start with #")
+    return kind
 
-    if not is_gzipped:
-        raise ValueError(
-            "Invalid VCF file, it does not start with # and its not gzipped"
-        )
 
-    with gzip.open(path) as fhand:
-        start = fhand.read(1)
-        if start[:1] == b"#":
-            return _VCFKind.GzippedVCF
-    raise ValueError("Invalid VCF gzipped file, it does not start with #")
+# the quoted values of the contig lines can have commas
+_CONTIG_FIELD_RE = re.compile(r'([A-Za-z_][\w.]*)=("(?:[^"\\]|\\.)*"|[^,]*)')
+_CONTIG_LINE_START = b"##contig=<"
 
 
-def _parse_metadata(fhand):
-    metadata = {}
+def _parse_contig_line(line):
+    # ##contig=<ID=chr1,length=248956422,...> gives ("chr1", 248956422)
+    content = line.decode().rstrip()
+    if not content.endswith(">"):
+        raise ValueError(f"Invalid contig line: {content}")
+    fields = dict(_CONTIG_FIELD_RE.findall(content[len(_CONTIG_LINE_START) : -1]))
+    if not fields.get("ID"):
+        raise ValueError(f"Invalid contig line, it has no ID: {content}")
+    length = fields.get("length")
+    return fields["ID"], int(length) if length else None
+
+
+def _parse_header(fhand, caches=None):
+    # the contigs are given in the header order with their lengths
+    metadata = {"contigs": {}}
     for line in fhand:
-        if line.startswith(b"##"):
+        if line.startswith(_CONTIG_LINE_START):
+            chrom, length = _parse_contig_line(line)
+            metadata["contigs"][chrom] = length
+        elif line.startswith(b"##"):
             pass
         elif line.startswith(b"#CHROM"):
             items = line.decode().strip().split("\t")
             if items[:9] != VCF_SAMPLE_LINE_ITEMS:
                 raise ValueError(
-                    "Invalid VCF file, it has an invalid sample line: {line.decode()}"
+                    f"Invalid VCF file, it has an invalid sample line: {line.decode()}"
                 )
             metadata["samples"] = items[9:]
             break
         else:
             raise ValueError("Invalid VCF file, it has no header")
+    if "samples" not in metadata:
+        raise ValueError("Invalid VCF file, it has no #CHROM line")
 
     metadata["samples"] = numpy.array(metadata["samples"])
     num_samples = metadata["samples"].size
     metadata["num_samples"] = num_samples
     try:
-        var_line = next(fhand)
+        first_var_line = next(fhand)
     except StopIteration:
         raise ValueError("Empty VCF file, it has no variants")
-    var_ = _parse_var_line(var_line, num_samples, ploidy=None)
+    var_ = _parse_var_line(first_var_line, num_samples, ploidy=None, caches=caches)
     metadata["ploidy"] = var_["gts"].shape[1]
 
-    return metadata
+    # the first var line has been read, so it is handed to the var parser
+    return metadata, first_var_line
 
 
-def _open_vcf(fpath):
-    kind = _guess_vcf_file_kind(fpath)
-    if kind == _VCFKind.GzippedVCF:
-        fhand = gzip.open(fpath, mode="rb")
-    else:
-        fhand = fpath.open("rb")
+def _parse_metadata(fhand):
+    return _parse_header(fhand)[0]
+
+
+def read_vcf_contigs(vcf_path: Path) -> dict[str, int | None]:
+    # only the header is read, so the VCF can have no vars
+    contigs = {}
+    with _open_vcf(Path(vcf_path), num_decompression_threads=1) as fhand:
+        for line in fhand:
+            if line.startswith(_CONTIG_LINE_START):
+                chrom, length = _parse_contig_line(line)
+                contigs[chrom] = length
+            elif not line.startswith(b"##"):
+                break
+    return contigs
+
+
+def read_vcf_metadata_lines(vcf_path: Path) -> list[str]:
+    # the ## lines of the header, in their order
+    metadata_lines = []
+    with _open_vcf(Path(vcf_path), num_decompression_threads=1) as fhand:
+        for line in fhand:
+            if not line.startswith(b"##"):
+                break
+            metadata_lines.append(line.decode().rstrip("\r\n"))
+    return metadata_lines
+
+
+class _GzipFileWithRawFile(gzip.GzipFile):
+    # GzipFile does not close the file objects that it is given
+    def __init__(self, raw_fhand):
+        super().__init__(fileobj=raw_fhand, mode="rb")
+        self._raw_fhand = raw_fhand
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._raw_fhand.close()
+
+
+def open_vcf_fhand(path: Path, kind: VCFKind | None = None):
+    # The gzipped VCFs are inflated, the plain and the BGZF ones are given
+    # as the raw binary file, so the BGZF blocks can be read with
+    # read_bgzf_block. Without a kind it is guessed from the buffered start
+    # of the file, that is opened once.
+    raw_fhand = Path(path).open("rb")
+    if kind is None:
+        try:
+            kind = _guess_vcf_kind_from_start(raw_fhand.peek(VCF_KIND_DETECTION_SIZE))
+        except ValueError:
+            raw_fhand.close()
+            raise
+    if kind == VCFKind.GzippedVCF:
+        return _GzipFileWithRawFile(raw_fhand), kind
+    return raw_fhand, kind
+
+
+def _open_vcf(
+    fpath,
+    num_decompression_threads=DEFAULT_NUM_DECOMPRESSION_THREADS,
+    decompression_executor=None,
+):
+    fhand, kind = open_vcf_fhand(fpath)
+    if kind == VCFKind.BGZippedVCF:
+        fhand = BGZFReader(
+            fhand,
+            num_threads=num_decompression_threads,
+            executor=decompression_executor,
+        )
+    elif kind == VCFKind.VCF and can_map_file(fhand):
+        fhand = MmapLineReader(fhand)
     return fhand
 
 
-@functools.lru_cache
 def _parse_allele(allele):
     if allele == b".":
         return True, MISSING_ALLELE
+    elif allele == ABSENT_ALLELE_STR:
+        return True, ABSENT_ALLELE
     else:
         allele = int(allele)
     if allele > MAX_ALLELE_NUMBER:
@@ -102,118 +251,1130 @@ def _parse_allele(allele):
     return False, allele
 
 
-_EXPECT_PHASED = False
-
-
-@functools.lru_cache
-def _parse_gt(gt):
-    if _EXPECT_PHASED:
-        sep, other_sep = b"|", b"/"
-        is_phased = True
-    else:
-        sep, other_sep = b"/", b"|"
-        is_phased = False
-    try:
-        return is_phased, tuple(map(_parse_allele, gt.split(sep)))
-    except ValueError:
-        pass
-    is_phased = not is_phased
-    return is_phased, tuple(map(_parse_allele, gt.split(other_sep)))
-
-
-@functools.lru_cache
 def _decode_chrom(chrom):
     return chrom.decode()
 
 
-@functools.lru_cache
 def _get_gt_fmt_idx(gt_fmt):
     return gt_fmt.split(b":").index(b"GT")
 
 
-@functools.lru_cache
 def _parse_qual(qual):
     if qual == b".":
         return numpy.nan
     return float(qual)
 
 
-@functools.lru_cache
 def _parse_id(id_):
     if id_ == b".":
         return None
     return id_.decode()
 
 
-def _parse_var_line(line, num_samples, ploidy=None) -> dict:
-    fields = line.split(b"\t")
-    ref = fields[3].decode()
-    alt = fields[4]
+# None is an unbounded cache and 0 no cache at all, IDs and QUALs are almost
+# unique for every var, so caching them only churns
+DEFAULT_PARSE_CACHE_SIZES = {
+    "allele": 128,
+    "gt": 1024,
+    "chrom": 128,
+    "gt_fmt_idx": 128,
+    "qual": 0,
+    "id": 0,
+}
+
+
+def _cache(func, maxsize):
+    if maxsize == 0:
+        return func
+    return functools.lru_cache(maxsize=maxsize)(func)
+
+
+def _get_cache_stats(func, maxsize):
+    if maxsize == 0:
+        return {"hits": 0, "misses": 0, "evictions": 0, "size": 0, "maxsize": 0}
+    info = func.cache_info()
+    # every miss is stored, so the ones not found in the cache were evicted
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "evictions": info.misses - info.currsize,
+        "size": info.currsize,
+        "maxsize": maxsize,
+    }
+
+
+class ParseCaches:
+    # The caches of the values parsed from the var lines of a VCF, along with
+    # the phasing found in its last parsed GT
+    def __init__(self, sizes: dict[str, int | None] | None = None):
+        sizes = DEFAULT_PARSE_CACHE_SIZES | (sizes or {})
+        unknown_caches = set(sizes).difference(DEFAULT_PARSE_CACHE_SIZES)
+        if unknown_caches:
+            raise ValueError(f"Unknown parse caches: {sorted(unknown_caches)}")
+        self.sizes = sizes
+        self.expect_phased = False
+        self.parse_allele = _cache(_parse_allele, sizes["allele"])
+        self.parse_gt = _cache(self._parse_gt, sizes["gt"])
+        self.decode_chrom = _cache(_decode_chrom, sizes["chrom"])
+        self.get_gt_fmt_idx = _cache(_get_gt_fmt_idx, sizes["gt_fmt_idx"])
+        self.parse_qual = _cache(_parse_qual, sizes["qual"])
+        self.parse_id = _cache(_parse_id, sizes["id"])
+
+    def _parse_gt(self, gt):
+        # the result does not depend on the expected phasing, it only saves
+        # a failed split when the file is phased
+        if self.expect_phased:
+            sep, other_sep = b"|", b"/"
+        else:
+            sep, other_sep = b"/", b"|"
+        try:
+            return self.expect_phased, tuple(map(self.parse_allele, gt.split(sep)))
+        except ValueError:
+            pass
+        self.expect_phased = not self.expect_phased
+        return self.expect_phased, tuple(map(self.parse_allele, gt.split(other_sep)))
+
+    def get_stats(self) -> dict[str, dict]:
+        funcs = {
+            "allele": self.parse_allele,
+            "gt": self.parse_gt,
+            "chrom": self.decode_chrom,
+            "gt_fmt_idx": self.get_gt_fmt_idx,
+            "qual": self.parse_qual,
+            "id": self.parse_id,
+        }
+        return {
+            name: _get_cache_stats(func, self.sizes[name]) for name, func in funcs.items()
+        }
+
+
+def sum_parse_cache_stats(stats_list) -> dict[str, dict]:
+    summed = {}
+    for stats in stats_list:
+        for name, cache_stats in stats.items():
+            if name not in summed:
+                summed[name] = dict(cache_stats)
+                continue
+            for key, value in cache_stats.items():
+                if key != "maxsize":
+                    summed[name][key] += value
+    return summed
+
+
+SparseGTs = namedtuple("SparseGTs", ["shape", "fill", "idxs", "values"])
+# Only the GTs that differ from fill are kept. idxs are their positions in
+# the flattened (num_samples, ploidy) array, sample_idx * ploidy + allele_idx,
+# so the (sample, allele, value) triplets are idxs // ploidy, idxs % ploidy
+# and values. Missing alleles are kept as MISSING_ALLELE.
+
+
+def sparsify_gts(gts, fill: int) -> SparseGTs:
+    flat_gts = gts.reshape(-1)
+    idxs = numpy.flatnonzero(flat_gts != fill)
+    return SparseGTs(gts.shape, fill, idxs, flat_gts[idxs])
+
+
+def densify_gts(gts: SparseGTs, out=None):
+    if out is None:
+        out = numpy.empty(gts.shape, dtype=GT_NUMPY_DTYPE)
+    out.fill(gts.fill)
+    out.reshape(-1)[gts.idxs] = gts.values
+    return out
+
+
+SparseBatchGTs = namedtuple(
+    "SparseBatchGTs", ["shape", "fill", "offsets", "idxs", "values"]
+)
+# The SparseGTs of all the vars of a batch, those of var i are found between
+# offsets i and i + 1. shape is the (num_samples, ploidy) shape of every var.
+
+
+def _sparsify_batch_gts(gts, fill) -> SparseBatchGTs:
+    num_vars = gts.shape[0]
+    flat_gts = gts.reshape(num_vars, -1)
+    var_idxs, idxs = numpy.nonzero(flat_gts != fill)
+    offsets = numpy.zeros(num_vars + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(var_idxs, minlength=num_vars), out=offsets[1:])
+    return SparseBatchGTs(gts.shape[1:], fill, offsets, idxs, flat_gts[var_idxs, idxs])
+
+
+def _concatenate_sparse_gts(shape, fill, var_sparse_gts) -> SparseBatchGTs:
+    # var_sparse_gts gives the (idxs, values) of every var
+    offsets = numpy.zeros(len(var_sparse_gts) + 1, dtype=numpy.int64)
+    numpy.cumsum([idxs.size for idxs, _ in var_sparse_gts], out=offsets[1:])
+    idxs = [idxs for idxs, _ in var_sparse_gts]
+    values = [values for _, values in var_sparse_gts]
+    return SparseBatchGTs(
+        shape,
+        fill,
+        offsets,
+        numpy.concatenate(idxs) if idxs else numpy.empty(0, dtype=numpy.int64),
+        numpy.concatenate(values) if values else numpy.empty(0, dtype=GT_NUMPY_DTYPE),
+    )
+
+
+def get_batch_var_sparse_gts(sparse_gts: SparseBatchGTs, offsets, idx) -> SparseGTs:
+    # the offsets are expected as a list, converted by the caller
+    start, end = offsets[idx], offsets[idx + 1]
+    return SparseGTs(
+        sparse_gts.shape,
+        sparse_gts.fill,
+        sparse_gts.idxs[start:end],
+        sparse_gts.values[start:end],
+    )
+
+
+def _get_info_end(info):
+    for item in info.split(b";"):
+        if item.startswith(b"END="):
+            return int(item[4:])
+    return None
+
+
+def _get_var_span_len(fields):
+    # The reference blocks span to their END, the rest of the vars their REF.
+    # The <*> records of a plain VCF, as the ones of bcftools mpileup, have
+    # no END.
+    if fields[4] in REF_BLOCK_ALTS:
+        end = _get_info_end(fields[7])
+        if end is not None:
+            return end - int(fields[1]) + 1
+    return len(fields[3])
+
+
+def _parse_alleles(ref, alt):
+    ref = ref.decode()
     if alt != b".":
-        alt = alt.decode().split(",")
-        alleles = [ref] + alt
+        return [ref] + alt.decode().split(",")
     else:
-        alleles = [ref]
+        return [ref]
 
-    gt_fmt_idx = _get_gt_fmt_idx(fields[8])
+
+def _create_var(fields, alleles, gts, missing_mask, caches):
+    return {
+        "chrom": caches.decode_chrom(fields[0]),
+        "pos": int(fields[1]),
+        "alleles": alleles,
+        "id": caches.parse_id(fields[2]),
+        "qual": caches.parse_qual(fields[5]),
+        "gts": gts,
+        "missing_mask": missing_mask,
+    }
+
+
+_SPARSE_FILL_CHARS = {0: b"0", MISSING_ALLELE: b".", ABSENT_ALLELE: ABSENT_ALLELE_STR}
+
+
+def _parse_sparse_gts(fields, num_samples, ploidy, gt_fmt_idx, fill, caches):
+    # only the GTs that differ from fill are stored, so the cost depends on
+    # the number of samples that are not fill, not on their total
+    fill_char = _SPARSE_FILL_CHARS[fill]
+    fill_gt_str = b"/".join([fill_char] * ploidy)
+    idxs = []
+    values = []
+    gt_idx = 0
+    for gt_str in fields[9:]:
+        gt_str = gt_str.split(b":")[gt_fmt_idx]
+        if gt_str != fill_gt_str and gt_str != fill_char:
+            alleles = [allele for _, allele in caches.parse_gt(gt_str)[1]]
+            # as in the dense GTs, the alleles not given are REF
+            alleles.extend([0] * (ploidy - len(alleles)))
+            for allele_idx, allele in enumerate(alleles[:ploidy]):
+                if allele != fill:
+                    idxs.append(gt_idx + allele_idx)
+                    values.append(allele)
+        gt_idx += ploidy
+    return SparseGTs(
+        (num_samples, ploidy),
+        fill,
+        numpy.array(idxs, dtype=numpy.int64),
+        numpy.array(values, dtype=GT_NUMPY_DTYPE),
+    )
+
+
+class GTBuffers:
+    # A ring of num_slots preallocated GT and missing mask buffers for the
+    # lines parsed one by one. The GTs of a line are numpy views of its slot,
+    # so they are only valid until num_slots more lines are parsed with the
+    # same buffers, they have to be copied to be kept.
+    def __init__(self, num_samples, ploidy, num_slots=1):
+        slot_size = num_samples * ploidy
+        self.num_samples = num_samples
+        self.ploidy = ploidy
+        self.gts = array.array(
+            PYTHON_ARRAY_TYPE, bytes(num_slots * slot_size * BYTE_SIZE_OF_INT)
+        )
+        self.missing_mask = array.array("b", bytes(num_slots * slot_size))
+        shape = (num_slots, num_samples, ploidy)
+        gts = numpy.frombuffer(self.gts, dtype=GT_NUMPY_DTYPE).reshape(shape)
+        missing_mask = numpy.frombuffer(self.missing_mask, dtype=bool).reshape(shape)
+        self._slots = [
+            (slot_idx * slot_size, gts[slot_idx], missing_mask[slot_idx])
+            for slot_idx in range(num_slots)
+        ]
+        self._next_slot_idx = 0
+
+    def next_slot(self):
+        # returns the slot offset in the buffers and its views, cleared as
+        # only the alleles that are not 0 are set
+        slot = self._slots[self._next_slot_idx]
+        self._next_slot_idx = (self._next_slot_idx + 1) % len(self._slots)
+        slot[1].fill(0)
+        slot[2].fill(False)
+        return slot
+
+
+def _parse_line_gts(fields, num_samples, ploidy, caches, sparse_fill, gt_buffers=None):
+    # returns the gts and missing_mask of the split line, with GTBuffers
+    # they are views of its next slot
+    gt_fmt_idx = caches.get_gt_fmt_idx(fields[8])
 
     if ploidy is None:
-        alleles = _parse_gt(fields[9].split(b":")[gt_fmt_idx])
-        ploidy = len(alleles)
+        ploidy = len(caches.parse_gt(fields[9].split(b":")[gt_fmt_idx])[1])
+
+    if sparse_fill is not None:
+        gts = _parse_sparse_gts(
+            fields, num_samples, ploidy, gt_fmt_idx, sparse_fill, caches
+        )
+        return gts, None
 
     ref_gt_str = b"/".join([b"0"] * ploidy)
-    gts = array.array(
-        PYTHON_ARRAY_TYPE, bytearray(num_samples * ploidy * BYTE_SIZE_OF_INT)
-    )
-    missing_mask = array.array("b", bytearray(num_samples * ploidy))
-    sample_idx = 0
+    if gt_buffers is None:
+        gts = array.array(
+            PYTHON_ARRAY_TYPE, bytearray(num_samples * ploidy * BYTE_SIZE_OF_INT)
+        )
+        missing_mask = array.array("b", bytearray(num_samples * ploidy))
+        sample_idx = 0
+    else:
+        sample_idx, gts_view, missing_mask_view = gt_buffers.next_slot()
+        gts, missing_mask = gt_buffers.gts, gt_buffers.missing_mask
     for gt_str in fields[9:]:
         gt_str = gt_str.split(b":")[gt_fmt_idx]
         if gt_str == ref_gt_str:
             sample_idx += ploidy
             continue
-        for allele_idx, (is_missing, allele) in enumerate(_parse_gt(gt_str)[1]):
+        for allele_idx, (is_missing, allele) in enumerate(caches.parse_gt(gt_str)[1]):
             if is_missing:
                 missing_mask[sample_idx + allele_idx] = 1
             if allele != 0:
                 gts[sample_idx + allele_idx] = allele
         sample_idx += ploidy
+    if gt_buffers is not None:
+        return gts_view, missing_mask_view
     gts = numpy.frombuffer(gts, dtype=GT_NUMPY_DTYPE).reshape(num_samples, ploidy)
-    missing_mask = (
-        numpy.frombuffer(missing_mask, dtype=numpy.int8)
-        .reshape(num_samples, ploidy)
-        .astype(bool)
+    missing_mask = numpy.frombuffer(missing_mask, dtype=bool).reshape(
+        num_samples, ploidy
     )
-    return {
-        "chrom": _decode_chrom(fields[0]),
-        "pos": int(fields[1]),
-        "alleles": alleles,
-        "id": _parse_id(fields[2]),
-        "qual": _parse_qual(fields[5]),
-        "gts": gts,
-        "missing_mask": missing_mask,
-    }
+    return gts, missing_mask
 
 
-def _read_vars(fhand, metadata) -> map[dict]:
-    for line in fhand:
-        if line.startswith(b"#CHROM"):
+def _parse_var_line(
+    line, num_samples, ploidy=None, caches=None, sparse_fill=None, gt_buffers=None
+) -> dict:
+    # with a sparse_fill the GTs are returned as SparseGTs, with GTBuffers
+    # they are views of its buffers, see GTBuffers for how long they are valid
+    if caches is None:
+        caches = ParseCaches()
+    fields = line.rstrip(b"\r\n").split(b"\t")
+    alleles = _parse_alleles(fields[3], fields[4])
+    gts, missing_mask = _parse_line_gts(
+        fields, num_samples, ploidy, caches, sparse_fill, gt_buffers
+    )
+    return _create_var(fields, alleles, gts, missing_mask, caches)
+
+
+_NOT_PARSED = object()
+
+
+class LazyVar:
+    # A var that keeps its line and only decodes its chrom, pos and REF
+    # length when created, the rest of its fields are parsed when they are
+    # first accessed. It can be used as the var dicts, read only, and its
+    # line is written as it is.
+    __slots__ = (
+        "line",
+        "chrom",
+        "pos",
+        "ref_len",
+        "_fields",
+        "_num_samples",
+        "_ploidy",
+        "_caches",
+        "_sparse_fill",
+        "_alleles",
+        "_id",
+        "_qual",
+        "_gts",
+        "_missing_mask",
+    )
+    _KEYS = ("chrom", "pos", "alleles", "id", "qual", "gts", "missing_mask", "line")
+
+    def __init__(self, line, num_samples, ploidy, caches=None, sparse_fill=None):
+        if caches is None:
+            caches = ParseCaches()
+        # the fixed fields are split, the sample ones are kept together
+        fields = line.split(b"\t", 9)
+        self.line = line
+        self.chrom = caches.decode_chrom(fields[0])
+        self.pos = int(fields[1])
+        self.ref_len = len(fields[3])
+        self._fields = fields
+        self._num_samples = num_samples
+        self._ploidy = ploidy
+        self._caches = caches
+        self._sparse_fill = sparse_fill
+        self._alleles = None
+        self._id = _NOT_PARSED
+        self._qual = _NOT_PARSED
+        self._gts = None
+        self._missing_mask = None
+
+    @property
+    def alleles(self):
+        if self._alleles is None:
+            self._alleles = _parse_alleles(self._fields[3], self._fields[4])
+        return self._alleles
+
+    @property
+    def id(self):
+        if self._id is _NOT_PARSED:
+            self._id = self._caches.parse_id(self._fields[2])
+        return self._id
+
+    @property
+    def qual(self):
+        if self._qual is _NOT_PARSED:
+            self._qual = self._caches.parse_qual(self._fields[5])
+        return self._qual
+
+    def _parse_gts(self):
+        fields = self.line.rstrip(b"\r\n").split(b"\t")
+        self._gts, self._missing_mask = _parse_line_gts(
+            fields, self._num_samples, self._ploidy, self._caches, self._sparse_fill
+        )
+
+    @property
+    def gts(self):
+        if self._gts is None:
+            self._parse_gts()
+        return self._gts
+
+    @property
+    def missing_mask(self):
+        if self._gts is None:
+            self._parse_gts()
+        return self._missing_mask
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._KEYS else default
+
+    def __contains__(self, key):
+        return key in self._KEYS
+
+    def keys(self):
+        return self._KEYS
+
+
+def _get_regular_line_seps(arr, seps, num_lines, num_seps_per_line):
+    # seps holds the positions of the tabs and newlines of every line, a
+    # regular line has one per field
+    if seps.size == num_lines * num_seps_per_line:
+        line_seps = seps.reshape(num_lines, num_seps_per_line)
+        if numpy.all(arr[line_seps[:, -1]] == _ORD_NEWLINE):
+            return numpy.arange(num_lines), line_seps
+    newline_positions = seps[arr[seps] == _ORD_NEWLINE]
+    seps_per_line = numpy.diff(
+        numpy.searchsorted(seps, newline_positions, side="right"), prepend=0
+    )
+    is_regular = seps_per_line == num_seps_per_line
+    regular_lines = numpy.flatnonzero(is_regular)
+    line_seps = seps[numpy.repeat(is_regular, seps_per_line)]
+    return regular_lines, line_seps.reshape(-1, num_seps_per_line)
+
+
+def _get_fast_gt_lines(arr, seps, num_lines, num_samples, ploidy):
+    # returns the fast lines, their FORMAT ends and the chars of their GT
+    # alleles, with a (num_lines, num_samples, ploidy) shape
+    regular_lines, line_seps = _get_regular_line_seps(
+        arr, seps, num_lines, VCF_NUM_FIXED_FIELDS + num_samples
+    )
+    if not regular_lines.size:
+        return regular_lines, None, None
+
+    # A fast GT is followed by ":" or by the end of the field: "0/1:", "0/1\t"
+    gt_width = 2 * ploidy - 1
+    sample_starts = line_seps[:, VCF_NUM_FIXED_FIELDS - 1 : -1] + 1
+    # positions past the buffer end are clipped to its last newline, which
+    # never passes the allele and separator checks
+    gt_end_chars = arr.take(sample_starts + gt_width, mode="clip")
+    is_ok = (gt_end_chars == _ORD_COLON) | (gt_end_chars <= _ORD_NEWLINE)
+
+    gt_chars = numpy.empty(sample_starts.shape + (ploidy,), dtype=numpy.uint8)
+    for allele_idx in range(ploidy):
+        allele_chars = arr.take(sample_starts, mode="clip")
+        is_ok &= _IS_FAST_ALLELE_CHAR[allele_chars]
+        gt_chars[:, :, allele_idx] = allele_chars
+        sample_starts += 1
+        if allele_idx < ploidy - 1:
+            sep_chars = arr.take(sample_starts, mode="clip")
+            is_ok &= (sep_chars == _ORD_UNPHASED_SEP) | (sep_chars == _ORD_PHASED_SEP)
+            sample_starts += 1
+    is_fast_line = numpy.all(is_ok, axis=1)
+
+    format_ends = line_seps[:, VCF_NUM_FIXED_FIELDS - 1]
+    if numpy.all(is_fast_line):
+        return regular_lines, format_ends, gt_chars
+    return (
+        regular_lines[is_fast_line],
+        format_ends[is_fast_line],
+        gt_chars[is_fast_line],
+    )
+
+
+def _decode_gt_chars(gt_chars):
+    # the absent alleles are also missing
+    gts = _FAST_ALLELE_CHAR_VALUES[gt_chars]
+    return gts, gts < 0
+
+
+def _sparsify_gt_chars(gt_chars, fill) -> SparseBatchGTs:
+    # only the alleles that are not the fill char are decoded
+    num_vars = gt_chars.shape[0]
+    flat_chars = gt_chars.reshape(num_vars, -1)
+    var_idxs, idxs = numpy.nonzero(flat_chars != ord(_SPARSE_FILL_CHARS[fill]))
+    offsets = numpy.zeros(num_vars + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(var_idxs, minlength=num_vars), out=offsets[1:])
+    values = _FAST_ALLELE_CHAR_VALUES[flat_chars[var_idxs, idxs]]
+    return SparseBatchGTs(gt_chars.shape[1:], fill, offsets, idxs, values)
+
+
+VarBatch = namedtuple(
+    "VarBatch",
+    [
+        "chroms",
+        "chrom_codes",
+        "poss",
+        "ends",
+        "alleles_buffer",
+        "allele_offsets",
+        "var_allele_offsets",
+        "ids",
+        "quals",
+        "gts",
+        "missing_mask",
+        "sparse_gts",
+    ],
+    defaults=[None],
+)
+# chroms is the list of chromosome names shared by all the batches of a VCF,
+# indexed by chrom_codes. The alleles of var i are found in alleles_buffer
+# between allele_offsets[j] and allele_offsets[j + 1], for j in
+# var_allele_offsets[i]:var_allele_offsets[i + 1]. gts and missing_mask have
+# a (num_vars, num_samples, ploidy) shape. The batches parsed with a
+# sparse_fill have SparseBatchGTs instead, and no gts or missing_mask.
+
+
+def _parse_var_batch(
+    lines,
+    num_samples,
+    ploidy,
+    chroms=None,
+    chrom_codes=None,
+    caches=None,
+    gt_buffers=None,
+    sparse_fill=None,
+) -> VarBatch:
+    # The GTs of the lines with single digit alleles, a fixed width GT and GT
+    # as the first FORMAT item are decoded for all samples at once, the rest
+    # of the lines are decoded one by one into the gt_buffers and copied to
+    # the batch, so they do not allocate their GTs.
+    # With a sparse_fill only the alleles that differ from it are decoded,
+    # into the batch sparse_gts, the batch has no dense GTs.
+    # The lines can be given as a LineBlock, then they are not joined.
+    if chroms is None:
+        chroms, chrom_codes = [], {}
+    if caches is None:
+        caches = ParseCaches()
+    if not isinstance(lines, LineBlock):
+        if not lines[-1].endswith(b"\n"):
+            lines = (*lines[:-1], lines[-1] + b"\n")
+        lines = LineBlock(b"".join(lines), [0, *accumulate(map(len, lines))])
+    num_vars = len(lines)
+    buffer = lines.buffer
+    line_starts = lines.line_starts
+    arr = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    # tabs and newlines are the only control chars found in a VCF
+    seps = numpy.flatnonzero(arr <= _ORD_NEWLINE)
+    fast_lines, format_ends, gt_chars = _get_fast_gt_lines(
+        arr, seps, num_vars, num_samples, ploidy
+    )
+
+    fast_line_idxs = dict(zip(fast_lines.tolist(), range(fast_lines.size)))
+    if fast_line_idxs:
+        format_ends = format_ends.tolist()
+    gts = missing_mask = sparse_gts = None
+    if sparse_fill is not None:
+        if fast_line_idxs:
+            sparse_gts = _sparsify_gt_chars(gt_chars, sparse_fill)
+        # the sparse GTs of the lines decoded one by one
+        line_sparse_gts = {}
+    elif fast_line_idxs:
+        gts, missing_mask = _decode_gt_chars(gt_chars)
+    if sparse_fill is None and len(fast_line_idxs) != num_vars:
+        fast_gts, fast_missing_mask = gts, missing_mask
+        gts = numpy.empty((num_vars, num_samples, ploidy), dtype=GT_NUMPY_DTYPE)
+        missing_mask = numpy.empty(gts.shape, dtype=bool)
+        if fast_line_idxs:
+            gts[fast_lines] = fast_gts
+            missing_mask[fast_lines] = fast_missing_mask
+
+    var_chrom_codes = []
+    poss = []
+    span_lens = []
+    alleles = []
+    var_num_alleles = []
+    ids = []
+    quals = []
+    for line_idx in range(num_vars):
+        fields = None
+        fast_idx = fast_line_idxs.get(line_idx)
+        if fast_idx is not None:
+            # only the fixed fields are copied out of the buffer
+            line_start = line_starts[line_idx]
+            fields = bytes(buffer[line_start : format_ends[fast_idx]]).split(b"\t")
+            if fields[8][:2] != b"GT" or fields[8][2:3] not in (b"", b":"):
+                fields = None
+        if fields is None:
+            fields = lines.get_line(line_idx).rstrip(b"\r\n").split(b"\t")
+            if sparse_fill is not None:
+                line_sparse_gts[line_idx] = _parse_line_gts(
+                    fields, num_samples, ploidy, caches, sparse_fill
+                )[0]
+            else:
+                if gt_buffers is None:
+                    gt_buffers = GTBuffers(num_samples, ploidy)
+                gts[line_idx], missing_mask[line_idx] = _parse_line_gts(
+                    fields, num_samples, ploidy, caches, None, gt_buffers
+                )
+
+        chrom_code = chrom_codes.get(fields[0])
+        if chrom_code is None:
+            chrom_code = len(chroms)
+            chrom_codes[fields[0]] = chrom_code
+            chroms.append(fields[0].decode())
+        var_chrom_codes.append(chrom_code)
+        poss.append(int(fields[1]))
+        span_lens.append(_get_var_span_len(fields))
+        alleles.append(fields[3])
+        if fields[4] != b".":
+            alts = fields[4].split(b",")
+            alleles.extend(alts)
+            var_num_alleles.append(len(alts) + 1)
+        else:
+            var_num_alleles.append(1)
+        ids.append(caches.parse_id(fields[2]))
+        quals.append(caches.parse_qual(fields[5]))
+
+    if sparse_fill is not None and (line_sparse_gts or sparse_gts is None):
+        sparse_gts = _merge_line_sparse_gts(
+            (num_samples, ploidy),
+            sparse_fill,
+            num_vars,
+            fast_line_idxs,
+            sparse_gts,
+            line_sparse_gts,
+        )
+
+    poss = numpy.array(poss, dtype=numpy.int64)
+    allele_offsets = numpy.zeros(len(alleles) + 1, dtype=numpy.int64)
+    numpy.cumsum(list(map(len, alleles)), out=allele_offsets[1:])
+    var_allele_offsets = numpy.zeros(num_vars + 1, dtype=numpy.int64)
+    numpy.cumsum(var_num_alleles, out=var_allele_offsets[1:])
+    return VarBatch(
+        chroms=chroms,
+        chrom_codes=numpy.array(var_chrom_codes, dtype=numpy.int32),
+        poss=poss,
+        ends=poss + numpy.array(span_lens, dtype=numpy.int64) - 1,
+        alleles_buffer=b"".join(alleles),
+        allele_offsets=allele_offsets,
+        var_allele_offsets=var_allele_offsets,
+        ids=ids,
+        quals=numpy.array(quals, dtype=float),
+        gts=gts,
+        missing_mask=missing_mask,
+        sparse_gts=sparse_gts,
+    )
+
+
+def _merge_line_sparse_gts(
+    shape, fill, num_vars, fast_line_idxs, fast_sparse_gts, line_sparse_gts
+) -> SparseBatchGTs:
+    # the lines decoded one by one take the place of the fast ones
+    var_sparse_gts = []
+    if fast_sparse_gts is not None:
+        fast_offsets = fast_sparse_gts.offsets.tolist()
+    for line_idx in range(num_vars):
+        gts = line_sparse_gts.get(line_idx)
+        if gts is None:
+            gts = get_batch_var_sparse_gts(
+                fast_sparse_gts, fast_offsets, fast_line_idxs[line_idx]
+            )
+        var_sparse_gts.append((gts.idxs, gts.values))
+    return _concatenate_sparse_gts(shape, fill, var_sparse_gts)
+
+
+def get_var_batch_nbytes(batch: VarBatch) -> int:
+    # the ids are not counted and the alleles are counted by their offsets,
+    # as the buffer of the cached batches is the whole mapped file
+    arrays = (
+        batch.chrom_codes,
+        batch.poss,
+        batch.ends,
+        batch.allele_offsets,
+        batch.var_allele_offsets,
+        batch.quals,
+    )
+    if batch.sparse_gts is None:
+        arrays += (batch.gts, batch.missing_mask)
+    else:
+        arrays += (
+            batch.sparse_gts.offsets,
+            batch.sparse_gts.idxs,
+            batch.sparse_gts.values,
+        )
+    alleles_nbytes = 0
+    if batch.allele_offsets.size:
+        alleles_nbytes = int(batch.allele_offsets[-1] - batch.allele_offsets[0])
+    return sum(array.nbytes for array in arrays) + alleles_nbytes
+
+
+def get_batch_var_alleles(alleles_buffer, allele_offsets, first_allele, last_allele):
+    # the offsets are expected as lists, the batch ones converted by the caller
+    return [
+        alleles_buffer[allele_offsets[idx] : allele_offsets[idx + 1]].decode()
+        for idx in range(first_allele, last_allele)
+    ]
+
+
+def get_batch_sparse_gts(batch: VarBatch, sparse_fill: int) -> SparseBatchGTs:
+    # the dense batches are sparsified
+    sparse_gts = batch.sparse_gts
+    if sparse_gts is None:
+        return _sparsify_batch_gts(batch.gts, sparse_fill)
+    if sparse_gts.fill != sparse_fill:
+        raise ValueError(
+            f"The batch GTs are filled with {sparse_gts.fill}, not with {sparse_fill}"
+        )
+    return sparse_gts
+
+
+def iter_batch_vars(batch: VarBatch, sparse_fill: int | None = None) -> Iterator[dict]:
+    # with a sparse_fill the GTs are returned as SparseGTs, without it the
+    # sparse batches are densified
+    allele_offsets = batch.allele_offsets.tolist()
+    var_allele_offsets = batch.var_allele_offsets.tolist()
+    sparse_gts = batch.sparse_gts
+    if sparse_fill is not None:
+        sparse_gts = get_batch_sparse_gts(batch, sparse_fill)
+    if sparse_gts is not None:
+        gt_offsets = sparse_gts.offsets.tolist()
+    for idx, (chrom_code, pos, qual) in enumerate(
+        zip(batch.chrom_codes.tolist(), batch.poss.tolist(), batch.quals.tolist())
+    ):
+        if sparse_gts is None:
+            gts = batch.gts[idx]
+            missing_mask = batch.missing_mask[idx]
+        elif sparse_fill is None:
+            gts = densify_gts(get_batch_var_sparse_gts(sparse_gts, gt_offsets, idx))
+            missing_mask = gts < 0
+        else:
+            gts = get_batch_var_sparse_gts(sparse_gts, gt_offsets, idx)
+            missing_mask = None
+        yield {
+            "chrom": batch.chroms[chrom_code],
+            "pos": pos,
+            "alleles": get_batch_var_alleles(
+                batch.alleles_buffer,
+                allele_offsets,
+                var_allele_offsets[idx],
+                var_allele_offsets[idx + 1],
+            ),
+            "id": batch.ids[idx],
+            "qual": qual,
+            "gts": gts,
+            "missing_mask": missing_mask,
+        }
+
+
+def _filter_region_lines(lines, region):
+    chrom, start, end = region
+    chrom = chrom.encode()
+    chrom_found = False
+    for line in lines:
+        fields = line.split(b"\t", 8)
+        if fields[0] != chrom:
+            if chrom_found:
+                # the VCF is sorted, so the region chromosome is finished
+                break
+            continue
+        chrom_found = True
+        pos = int(fields[1])
+        if end is not None and pos > end:
             break
+        if start is not None and pos + _get_var_span_len(fields) - 1 < start:
+            continue
+        yield line
+
+
+def _get_var_batch_size(num_samples, ploidy):
+    return max(1, VAR_LINES_BATCH_NUM_GTS // (num_samples * ploidy))
+
+
+def _batch_lines(lines, batch_size):
+    # the lines of a mapped VCF are taken in blocks of the map, without
+    # copying them
+    if isinstance(lines, MmapLineReader):
+        return lines.iter_line_blocks(batch_size)
+    return batched(lines, batch_size)
 
+
+def _read_var_batches(
+    lines, metadata, caches=None, metrics=None, input_name=None, sparse_fill=None
+) -> Iterator[VarBatch]:
     num_samples = len(metadata["samples"])
-    parse_var_line = functools.partial(
-        _parse_var_line, num_samples=num_samples, ploidy=metadata["ploidy"]
+    ploidy = metadata["ploidy"]
+    # the chromosome codes and the caches are shared by all the batches
+    if caches is None:
+        caches = ParseCaches()
+    parse_var_batch = functools.partial(
+        _parse_var_batch,
+        num_samples=num_samples,
+        ploidy=ploidy,
+        chroms=[],
+        chrom_codes={},
+        caches=caches,
+        gt_buffers=GTBuffers(num_samples, ploidy),
+        sparse_fill=sparse_fill,
+    )
+    line_batches = _batch_lines(lines, _get_var_batch_size(num_samples, ploidy))
+    if metrics is not None:
+        return metrics.track_var_batches(input_name, line_batches, parse_var_batch)
+    return map(parse_var_batch, line_batches)
+
+
+def _read_vars(
+    lines, metadata, caches=None, sparse_fill=None, metrics=None, input_name=None
+) -> Iterator[dict]:
+    var_batches = _read_var_batches(
+        lines, metadata, caches, metrics, input_name, sparse_fill
     )
-    vars = map(parse_var_line, fhand)
+    iter_vars = functools.partial(iter_batch_vars, sparse_fill=sparse_fill)
+    vars = chain.from_iterable(map(iter_vars, var_batches))
     return vars
 
 
-def parse_vcf(vcf_path: Path) -> dict:
+def _read_lazy_vars(lines, metadata, caches=None, sparse_fill=None) -> Iterator[LazyVar]:
+    num_samples = len(metadata["samples"])
+    ploidy = metadata["ploidy"]
+    if caches is None:
+        caches = ParseCaches()
+    for line in lines:
+        yield LazyVar(line, num_samples, ploidy, caches, sparse_fill)
+
+
+def _can_seek_virtual_offset(fhand):
+    return isinstance(fhand, BGZFReader) or (
+        getattr(fhand, "kind", None) == VCFKind.BGZippedVCF
+    )
+
+
+def _get_region_lines(fhand, first_var_line, region, index):
+    if index is None or not _can_seek_virtual_offset(fhand):
+        return _filter_region_lines(chain((first_var_line,), fhand), region)
+
+    offset = get_region_start_offset(index, region)
+    if offset is None:
+        return iter(())
+    fhand.seek_virtual_offset(offset)
+    return _filter_region_lines(fhand, region)
+
+
+def _get_binary_cache_arrays(var_batches):
+    # the batches of a VCF share their chroms list
+    chroms = []
+    chrom_codes, poss, ends, quals, gts, missing_masks = [], [], [], [], [], []
+    alleles, allele_offsets, var_allele_offsets = [], [], []
+    ids = []
+    alleles_size = 0
+    num_alleles = 0
+    for batch in var_batches:
+        chroms = batch.chroms
+        chrom_codes.append(batch.chrom_codes)
+        poss.append(batch.poss)
+        ends.append(batch.ends)
+        quals.append(batch.quals)
+        gts.append(batch.gts)
+        missing_masks.append(batch.missing_mask)
+        alleles.append(batch.alleles_buffer)
+        allele_offsets.append(batch.allele_offsets[:-1] + alleles_size)
+        var_allele_offsets.append(batch.var_allele_offsets[:-1] + num_alleles)
+        alleles_size += len(batch.alleles_buffer)
+        num_alleles += int(batch.var_allele_offsets[-1])
+        ids.extend(batch.ids)
+    allele_offsets.append(numpy.array([alleles_size], dtype=numpy.int64))
+    var_allele_offsets.append(numpy.array([num_alleles], dtype=numpy.int64))
+
+    # a missing ID is stored as an empty string
+    encoded_ids = [b"" if id_ is None else id_.encode() for id_ in ids]
+    id_offsets = numpy.zeros(len(encoded_ids) + 1, dtype=numpy.int64)
+    numpy.cumsum(list(map(len, encoded_ids)), out=id_offsets[1:])
+
+    arrays = {
+        "chrom_codes": numpy.concatenate(chrom_codes),
+        "poss": numpy.concatenate(poss),
+        "ends": numpy.concatenate(ends),
+        "alleles": numpy.frombuffer(b"".join(alleles), dtype=numpy.uint8),
+        "allele_offsets": numpy.concatenate(allele_offsets),
+        "var_allele_offsets": numpy.concatenate(var_allele_offsets),
+        "ids": numpy.frombuffer(b"".join(encoded_ids), dtype=numpy.uint8),
+        "id_offsets": id_offsets,
+        "quals": numpy.concatenate(quals),
+        "gts": numpy.concatenate(gts).astype(GT_NUMPY_DTYPE, copy=False),
+        "missing_mask": numpy.concatenate(missing_masks),
+    }
+    return chroms, arrays
+
+
+def _build_binary_cache(fpath, cache_path, **parse_kwargs):
+    result = parse_vcf(fpath, as_batches=True, **parse_kwargs)
+    try:
+        chroms, arrays = _get_binary_cache_arrays(result["var_batches"])
+    finally:
+        result["fhand"].close()
+    metadata = result["metadata"]
+    header = {
+        "samples": [str(sample) for sample in metadata["samples"]],
+        "ploidy": metadata["ploidy"],
+        "contigs": metadata["contigs"],
+        "chroms": chroms,
+        "num_vars": len(arrays["poss"]),
+    }
+    write_binary_cache(cache_path, fpath, header, arrays)
+
+
+def _open_binary_cache(fpath, binary_cache_dir, **parse_kwargs) -> BinaryCacheFile:
+    cache_path = get_binary_cache_path(binary_cache_dir, fpath)
+    cached = read_binary_cache(cache_path, fpath)
+    if cached is None:
+        _build_binary_cache(fpath, cache_path, **parse_kwargs)
+        cached = read_binary_cache(cache_path, fpath)
+    if cached is None:
+        raise RuntimeError(f"The VCF has changed while its binary cache was built: {fpath}")
+    return cached
+
+
+def update_binary_cache(vcf_path: Path, binary_cache_dir: Path, **parse_kwargs):
+    _open_binary_cache(Path(vcf_path), binary_cache_dir, **parse_kwargs).close()
+
+
+class _BufferStrings:
+    # the strings stored in a buffer between consecutive offsets, the empty
+    # ones are missing
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        if start == end:
+            return None
+        return self._buffer[start:end].decode()
+
+
+def _slice_binary_cache(cached, start, end) -> VarBatch:
+    # The arrays are views of the mapped file, only the offsets are copied to
+    # point into its alleles and IDs
+    arrays = cached.arrays
+    array_offsets = cached.header["arrays"]
+    var_allele_offsets = arrays["var_allele_offsets"][start : end + 1]
+    first_allele = var_allele_offsets[0]
+    last_allele = var_allele_offsets[-1]
+    allele_offsets = arrays["allele_offsets"][first_allele : last_allele + 1]
+    id_offsets = arrays["id_offsets"][start : end + 1]
+    return VarBatch(
+        chroms=cached.header["chroms"],
+        chrom_codes=arrays["chrom_codes"][start:end],
+        poss=arrays["poss"][start:end],
+        ends=arrays["ends"][start:end],
+        alleles_buffer=cached.buffer,
+        allele_offsets=allele_offsets + array_offsets["alleles"]["offset"],
+        var_allele_offsets=var_allele_offsets - first_allele,
+        ids=_BufferStrings(cached.buffer, id_offsets + array_offsets["ids"]["offset"]),
+        quals=arrays["quals"][start:end],
+        gts=arrays["gts"][start:end],
+        missing_mask=arrays["missing_mask"][start:end],
+    )
+
+
+def _get_binary_cache_var_ranges(cached, region):
+    num_vars = cached.header["num_vars"]
+    if region is None:
+        return [(0, num_vars)]
+    chrom, start, end = region
+    try:
+        chrom_code = cached.header["chroms"].index(chrom)
+    except ValueError:
+        return []
+    arrays = cached.arrays
+    in_region = arrays["chrom_codes"] == chrom_code
+    if start is not None:
+        in_region &= arrays["ends"] >= start
+    if end is not None:
+        in_region &= arrays["poss"] <= end
+    idxs = numpy.flatnonzero(in_region)
+    if not idxs.size:
+        return []
+    # the runs of consecutive vars are sliced without copying them
+    breaks = numpy.flatnonzero(numpy.diff(idxs) != 1) + 1
+    run_starts = idxs[numpy.concatenate(([0], breaks))]
+    run_ends = idxs[numpy.concatenate((breaks - 1, [idxs.size - 1]))] + 1
+    return list(zip(run_starts.tolist(), run_ends.tolist()))
+
+
+def _iter_binary_cache_var_batches(cached, region, batch_size) -> Iterator[VarBatch]:
+    for start, end in _get_binary_cache_var_ranges(cached, region):
+        for batch_start in range(start, end, batch_size):
+            yield _slice_binary_cache(cached, batch_start, min(batch_start + batch_size, end))
+
+
+def _parse_binary_cached_vcf(
+    fpath,
+    binary_cache_dir,
+    region,
+    as_batches,
+    parse_cache_sizes,
+    sparse_fill,
+    metrics,
+    **parse_kwargs,
+):
+    cached = _open_binary_cache(fpath, binary_cache_dir, **parse_kwargs)
+    header = cached.header
+    samples = numpy.array(header["samples"])
+    metadata = {
+        "samples": samples,
+        "num_samples": samples.size,
+        "ploidy": header["ploidy"],
+        "contigs": header["contigs"],
+    }
+    if region is not None:
+        region = parse_region(region)
+    var_batches = _iter_binary_cache_var_batches(
+        cached, region, _get_var_batch_size(samples.size, header["ploidy"])
+    )
+    if metrics is not None:
+        var_batches = metrics.track_cached_var_batches(str(fpath), var_batches)
+    result = {
+        "metadata": metadata,
+        "fhand": cached,
+        "index": None,
+        "parse_caches": ParseCaches(parse_cache_sizes),
+    }
+    if as_batches:
+        result["var_batches"] = var_batches
+    else:
+        iter_vars = functools.partial(iter_batch_vars, sparse_fill=sparse_fill)
+        result["vars"] = chain.from_iterable(map(iter_vars, var_batches))
+    return result
+
+
+def parse_vcf(
+    vcf_path: Path,
+    region: str | tuple | None = None,
+    num_decompression_threads: int = DEFAULT_NUM_DECOMPRESSION_THREADS,
+    decompression_executor: ThreadPoolExecutor | None = None,
+    as_batches: bool = False,
+    file_pool=None,
+    parse_cache_sizes: dict[str, int | None] | None = None,
+    binary_cache_dir: Path | None = None,
+    sparse_fill: int | None = None,
+    metrics=None,
+    lazy_vars: bool = False,
+) -> dict:
+    # with as_batches the vars are returned as VarBatches under "var_batches"
+    # with a sparse_fill the GTs of the vars are returned as SparseGTs, and
+    # the parsed batches have SparseBatchGTs, the cached ones are dense
+    # with a FileHandlePool the file is only kept open while it is being read
+    # with a binary_cache_dir the vars are parsed once and mapped afterwards
+    # with JoinMetrics the read and parse times and the parsed lines are tracked
+    # with lazy_vars the vars are LazyVars, only their GTs, ID and QUAL
+    # are parsed when they are accessed
     fpath = Path(vcf_path)
-    fhand = _open_vcf(fpath)
-    metadata = _parse_metadata(fhand)
+    if lazy_vars and (as_batches or binary_cache_dir is not None):
+        raise ValueError(
+            "Lazy vars are created from the VCF lines, not from batches or binary caches"
+        )
+    if binary_cache_dir is not None:
+        return _parse_binary_cached_vcf(
+            fpath,
+            binary_cache_dir,
+            region,
+            as_batches,
+            parse_cache_sizes,
+            sparse_fill,
+            metrics,
+            num_decompression_threads=num_decompression_threads,
+            decompression_executor=decompression_executor,
+            file_pool=file_pool,
+        )
+    if file_pool is None:
+        fhand = _open_vcf(
+            fpath,
+            num_decompression_threads=num_decompression_threads,
+            decompression_executor=decompression_executor,
+        )
+    else:
+        fhand = file_pool.open(fpath, decompression_executor=decompression_executor)
+    try:
+        caches = ParseCaches(parse_cache_sizes)
+        metadata, first_var_line = _parse_header(fhand, caches)
+    except Exception:
+        fhand.close()
+        raise
+
+    index_path = find_vcf_index(fpath)
+    index = None if index_path is None else read_vcf_index(index_path)
 
-    fhand = _open_vcf(fpath)
-    vars = _read_vars(fhand, metadata)
+    if region is None and isinstance(fhand, MmapLineReader):
+        # the first var line is read again from the map
+        fhand.seek(fhand.tell() - len(first_var_line))
+        lines = fhand
+    elif region is None:
+        lines = chain((first_var_line,), fhand)
+    else:
+        lines = _get_region_lines(fhand, first_var_line, parse_region(region), index)
 
-    return {"metadata": metadata, "vars": vars, "fhand": fhand}
+    result = {
+        "metadata": metadata,
+        "fhand": fhand,
+        "index": index,
+        "parse_caches": caches,
+    }
+    if as_batches:
+        result["var_batches"] = _read_var_batches(
+            lines, metadata, caches, metrics, str(fpath), sparse_fill
+        )
+    elif lazy_vars:
+        result["vars"] = _read_lazy_vars(lines, metadata, caches, sparse_fill)
+    else:
+        result["vars"] = _read_vars(
+            lines, metadata, caches, sparse_fill, metrics, str(fpath)
+        )
+    return result
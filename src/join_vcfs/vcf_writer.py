@@ -0,0 +1,235 @@
+from pathlib import Path
+from enum import Enum
+import gzip
+import re
+import shutil
+
+import numpy
+
+from join_vcfs.bgzf import BGZFWriter, BGZF_EOF_BLOCK
+from join_vcfs.vcf_parser import (
+    VCF_SAMPLE_LINE_ITEMS,
+    GT_NUMPY_DTYPE,
+    MISSING_ALLELE,
+    ABSENT_ALLELE,
+    ABSENT_ALLELE_STR,
+    SparseGTs,
+    densify_gts,
+    sparsify_gts,
+)
+
+DEFAULT_WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+VCF_FILE_FORMAT = "VCFv4.5"
+GT_FORMAT_HEADER_LINE = (
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">'
+)
+_GT_FORMAT_LINE_START = "##FORMAT=<ID=GT,"
+_CONTIG_ID_RE = re.compile(r"##contig=<(?:.*,)?ID=([^,>]+)")
+_ORD_ZERO = ord("0")
+_ORD_MISSING = ord(".")
+_ORD_ABSENT = ord(ABSENT_ALLELE_STR)
+_ORD_UNPHASED_SEP = ord("/")
+_ORD_TAB = ord("\t")
+_ORD_NEWLINE = ord("\n")
+
+
+class Compression(Enum):
+    PLAIN = "plain"
+    GZIP = "gzip"
+    BGZF = "bgzf"
+
+
+def _guess_compression(path: Path):
+    if path.suffix in (".gz", ".bgz"):
+        return Compression.BGZF
+    return Compression.PLAIN
+
+
+def open_output(path: Path, compression: Compression, write_eof: bool = True):
+    if compression == Compression.BGZF:
+        return BGZFWriter(path.open("wb"), write_eof=write_eof)
+    elif compression == Compression.GZIP:
+        return gzip.open(path, "wb")
+    else:
+        return path.open("wb")
+
+
+def _build_header(samples, chromosomes, metadata_lines=None):
+    # the given metadata lines are kept, only the GT format and the contigs
+    # that they lack are added
+    if metadata_lines is None:
+        metadata_lines = [f"##fileformat={VCF_FILE_FORMAT}"]
+    lines = list(metadata_lines)
+    if not any(line.startswith(_GT_FORMAT_LINE_START) for line in lines):
+        lines.append(GT_FORMAT_HEADER_LINE)
+    contigs = {
+        match.group(1) for match in map(_CONTIG_ID_RE.match, lines) if match
+    }
+    lines.extend(
+        f"##contig=<ID={chrom}>" for chrom in chromosomes if chrom not in contigs
+    )
+    lines.append("\t".join(VCF_SAMPLE_LINE_ITEMS + list(samples)))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _format_allele(allele, is_missing):
+    if allele == ABSENT_ALLELE:
+        return ABSENT_ALLELE_STR.decode()
+    return "." if is_missing else str(allele)
+
+
+def _format_gts_slow(gts, missing_mask):
+    sample_gts = []
+    for sample_alleles, sample_missing in zip(gts.tolist(), missing_mask.tolist()):
+        sample_gts.append(
+            "/".join(map(_format_allele, sample_alleles, sample_missing))
+        )
+    return ("\t".join(sample_gts) + "\n").encode()
+
+
+def _format_gts_into(gts_chars, gts, missing_mask):
+    # gts_chars is a reusable (num_samples, 2 * ploidy) uint8 array in which
+    # every allele is followed by its separator: "0/1\t0/0\t...1/1\n"
+    if gts.max(initial=0) > 9:
+        return False
+    allele_chars = gts_chars[:, 0::2]
+    numpy.add(gts, _ORD_ZERO, out=allele_chars, casting="unsafe")
+    allele_chars[missing_mask] = _ORD_MISSING
+    # only the tree join intermediates have absent alleles
+    if gts.min(initial=0) == ABSENT_ALLELE:
+        allele_chars[gts == ABSENT_ALLELE] = _ORD_ABSENT
+    gts_chars[:, 1:-1:2] = _ORD_UNPHASED_SEP
+    gts_chars[:, -1] = _ORD_TAB
+    gts_chars[-1, -1] = _ORD_NEWLINE
+    return True
+
+
+class _ReusableWriteBuffer:
+    def __init__(self, fhand, size):
+        self._fhand = fhand
+        self._buffer = memoryview(bytearray(size))
+        self._size = size
+        self._pos = 0
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        num_bytes = data.nbytes
+        if self._pos + num_bytes > self._size:
+            self.flush()
+            if num_bytes > self._size:
+                self._fhand.write(data)
+                return
+        self._buffer[self._pos : self._pos + num_bytes] = data
+        self._pos += num_bytes
+
+    def flush(self):
+        if self._pos:
+            self._fhand.write(self._buffer[: self._pos])
+            self._pos = 0
+
+
+def write_vcf(
+    out_path: Path,
+    merged_vars,
+    samples,
+    ploidy: int,
+    chromosomes: list[str],
+    compression: Compression | None = None,
+    buffer_size: int = DEFAULT_WRITE_BUFFER_SIZE,
+    write_header: bool = True,
+    is_part: bool = False,
+    metadata_lines: list[str] | None = None,
+):
+    # parts are meant to be concatenated with concatenate_vcf_parts
+    out_path = Path(out_path)
+    if compression is None:
+        compression = _guess_compression(out_path)
+
+    gts_chars = numpy.empty((len(samples), 2 * ploidy), dtype=numpy.uint8)
+    # the SparseGTs are only expanded into these arrays to be formatted
+    dense_gts = numpy.empty((len(samples), ploidy), dtype=GT_NUMPY_DTYPE)
+    dense_missing_mask = numpy.empty((len(samples), ploidy), dtype=bool)
+    with open_output(out_path, compression, write_eof=not is_part) as fhand:
+        buffer = _ReusableWriteBuffer(fhand, buffer_size)
+        if write_header:
+            buffer.write(_build_header(samples, chromosomes, metadata_lines))
+        for var in merged_vars:
+            # the vars that are already formatted are written as they are
+            line = var.get("line")
+            if line is not None:
+                buffer.write(line)
+                continue
+            alleles = var["alleles"]
+            alts = ",".join(alleles[1:]) if len(alleles) > 1 else "."
+            buffer.write(
+                f"{var['chrom']}\t{var['pos']}\t.\t{alleles[0]}\t{alts}\t.\t.\t.\tGT\t".encode()
+            )
+            gts, missing_mask = var["gts"], var["missing_mask"]
+            if isinstance(gts, SparseGTs):
+                gts = densify_gts(gts, out=dense_gts)
+                missing_mask = numpy.less(gts, 0, out=dense_missing_mask)
+            if _format_gts_into(gts_chars, gts, missing_mask):
+                buffer.write(gts_chars)
+            else:
+                buffer.write(_format_gts_slow(gts, missing_mask))
+        buffer.flush()
+
+
+def concatenate_vcf_parts(
+    out_path: Path, part_paths, compression: Compression | None = None
+):
+    # gzip members and BGZF blocks can be concatenated as they are, only the
+    # BGZF EOF block has to be added at the end
+    out_path = Path(out_path)
+    if compression is None:
+        compression = _guess_compression(out_path)
+    with out_path.open("wb") as out_fhand:
+        for part_path in part_paths:
+            with Path(part_path).open("rb") as part_fhand:
+                shutil.copyfileobj(part_fhand, out_fhand)
+        if compression == Compression.BGZF:
+            out_fhand.write(BGZF_EOF_BLOCK)
+
+
+def write_sparse_gts_matrix(out_path: Path, merged_vars, samples, ploidy: int):
+    # The vars are stored in a npz file without expanding their GTs, the
+    # ones of var i are gt_idxs and gt_values between gt_offsets i and i + 1,
+    # and the rest of them are gt_fills[i]. Dense GTs are sparsified.
+    chroms = {}
+    chrom_codes = []
+    poss = []
+    alleles = []
+    allele_offsets = [0]
+    gt_fills = []
+    gt_offsets = [0]
+    gt_idxs = []
+    gt_values = []
+    for var in merged_vars:
+        chrom_codes.append(chroms.setdefault(var["chrom"], len(chroms)))
+        poss.append(var["pos"])
+        alleles.extend(var["alleles"])
+        allele_offsets.append(len(alleles))
+        gts = var["gts"]
+        if not isinstance(gts, SparseGTs):
+            gts = numpy.where(var["missing_mask"], MISSING_ALLELE, gts)
+            gts = sparsify_gts(gts, MISSING_ALLELE)
+        gt_fills.append(gts.fill)
+        gt_idxs.append(gts.idxs)
+        gt_values.append(gts.values)
+        gt_offsets.append(gt_offsets[-1] + gts.idxs.size)
+
+    with Path(out_path).open("wb") as fhand:
+        numpy.savez(
+            fhand,
+            samples=numpy.array(samples, dtype=str),
+            ploidy=numpy.array(ploidy),
+            chroms=numpy.array(list(chroms), dtype=str),
+            chrom_codes=numpy.array(chrom_codes, dtype=numpy.int32),
+            poss=numpy.array(poss, dtype=numpy.int64),
+            alleles=numpy.array(alleles, dtype=str),
+            allele_offsets=numpy.array(allele_offsets, dtype=numpy.int64),
+            gt_fills=numpy.array(gt_fills, dtype=GT_NUMPY_DTYPE),
+            gt_offsets=numpy.array(gt_offsets, dtype=numpy.int64),
+            gt_idxs=numpy.concatenate(gt_idxs or [numpy.empty(0, dtype=numpy.int64)]),
+            gt_values=numpy.concatenate(gt_values or [numpy.empty(0, dtype=GT_NUMPY_DTYPE)]),
+        )
@@ -0,0 +1,99 @@
+import numpy
+import pytest
+
+from join_vcfs.allele_merging import merge_var_group
+from join_vcfs.vcf_joining import VarGroup
+
+
+def _create_var(pos, alleles, gts):
+    gts = numpy.array(gts)
+    return {
+        "chrom": "20",
+        "pos": pos,
+        "alleles": alleles,
+        "gts": gts,
+        "missing_mask": gts < 0,
+    }
+
+
+def test_merge_same_ref():
+    var_group = VarGroup(
+        {
+            0: [_create_var(5, ["G", "A"], [[0, 1], [-1, 0]])],
+            1: [_create_var(5, ["G", "T", "A"], [[2, 1]])],
+        },
+        ("20", 5, 5),
+    )
+    sample_slices = {0: slice(0, 2), 1: slice(2, 3), 2: slice(3, 4)}
+    merged = merge_var_group(var_group, sample_slices, num_samples=4, ploidy=2)
+    assert merged["pos"] == 5
+    assert merged["alleles"] == ["G", "A", "T"]
+    assert numpy.array_equal(merged["gts"], [[0, 1], [-1, 0], [1, 2], [-1, -1]])
+    assert numpy.array_equal(merged["missing_mask"], merged["gts"] == -1)
+
+
+def test_merge_deletion_spanning_snps():
+    var_group = VarGroup(
+        {
+            0: [_create_var(1, ["GATCGAT", "A"], [[0, 1]])],
+            1: [
+                _create_var(2, ["A", "C"], [[1, 1], [0, -1]]),
+                _create_var(5, ["G", "T"], [[0, 1], [0, 0]]),
+            ],
+        },
+        ("20", 1, 7),
+    )
+    sample_slices = {0: slice(0, 1), 1: slice(1, 3), 2: slice(3, 4)}
+    merged = merge_var_group(var_group, sample_slices, num_samples=4, ploidy=2)
+    assert merged["alleles"] == ["GATCGAT", "A", "GCTCGAT", "GCTCTAT"]
+    assert numpy.array_equal(
+        merged["gts"], [[0, 1], [2, 3], [0, -1], [-1, -1]]
+    )
+
+
+def test_merge_vars_with_absent_samples():
+    # the absent haplotypes had no var there, they are REF where the other
+    # vars of the input give them an allele, the missing ones stay missing
+    var_group = VarGroup(
+        {
+            0: [_create_var(1, ["GATCGAT", "A"], [[0, 1]])],
+            1: [
+                _create_var(2, ["A", "C"], [[1, 1], [-2, -2], [1, -1], [-2, -2]]),
+                _create_var(5, ["G", "T"], [[-2, -2], [0, 1], [0, 0], [-2, -2]]),
+            ],
+        },
+        ("20", 1, 7),
+    )
+    sample_slices = {0: slice(0, 1), 1: slice(1, 5)}
+    merged = merge_var_group(var_group, sample_slices, num_samples=5, ploidy=2)
+    assert merged["alleles"] == ["GATCGAT", "A", "GCTCGAT", "GATCTAT"]
+    assert numpy.array_equal(
+        merged["gts"], [[0, 1], [2, 2], [0, 3], [2, -1], [-1, -1]]
+    )
+
+
+def test_merge_overlapping_alts_from_same_input():
+    var_group = VarGroup(
+        {
+            0: [
+                _create_var(1, ["GAT", "G"], [[1, 0]]),
+                _create_var(2, ["A", "C"], [[1, 0]]),
+            ],
+        },
+        ("20", 1, 3),
+    )
+    merged = merge_var_group(var_group, {0: slice(0, 1)}, num_samples=1, ploidy=2)
+    assert numpy.array_equal(merged["gts"], [[-1, 0]])
+
+
+def test_merge_inconsistent_refs():
+    var_group = VarGroup(
+        {
+            0: [_create_var(1, ["GAT", "G"], [[1, 0]])],
+            1: [_create_var(2, ["T", "C"], [[1, 0]])],
+        },
+        ("20", 1, 3),
+    )
+    sample_slices = {0: slice(0, 1), 1: slice(1, 2)}
+    with pytest.raises(ValueError):
+        merge_var_group(var_group, sample_slices, num_samples=2, ploidy=2)
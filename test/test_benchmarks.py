@@ -0,0 +1,43 @@
+import json
+import tempfile
+from pathlib import Path
+
+from join_vcfs.vcf_parser import parse_vcf
+from benchmarks.synthetic_vcfs import generate_synthetic_vcfs
+from benchmarks.run_benchmarks import run_benchmarks
+
+
+def test_synthetic_vcfs():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = {"num_vcfs": 3, "num_vars": 200, "overlap_rate": 1.0, "ploidy": 3}
+        synthetic = generate_synthetic_vcfs(Path(tmp_dir) / "plain", config)
+        assert synthetic["chromosomes"] == ["chr1", "chr2"]
+        vcf_poss = []
+        for path, num_vars in zip(synthetic["vcf_paths"], synthetic["num_vars"]):
+            result = parse_vcf(path)
+            assert result["metadata"]["ploidy"] == 3
+            vcf_poss.append([(var["chrom"], var["pos"]) for var in result["vars"]])
+            assert len(vcf_poss[-1]) == num_vars
+            result["fhand"].close()
+        assert vcf_poss[0] == vcf_poss[1] == vcf_poss[2]
+
+        config = dict(config, compression="bgzf", overlap_rate=0.0)
+        synthetic = generate_synthetic_vcfs(Path(tmp_dir) / "bgzf", config)
+        assert synthetic["vcf_paths"][0].name.endswith(".vcf.gz")
+        result = parse_vcf(synthetic["vcf_paths"][0])
+        assert sum(1 for _ in result["vars"]) == synthetic["num_vars"][0]
+        result["fhand"].close()
+
+
+def test_run_benchmarks():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = Path(tmp_dir) / "bench.json"
+        run_benchmarks(out_path, ["default", "gzip"], work_dir=tmp_dir, scale=0.01)
+        results = json.loads(out_path.read_text())
+        assert [scenario["name"] for scenario in results["scenarios"]] == ["default", "gzip"]
+        scenario = results["scenarios"][0]
+        assert scenario["parse"]["items"] == scenario["num_input_vars"]
+        for stage in ("parse", "grouping", "join"):
+            assert scenario[stage]["items_per_second"] > 0
+            assert scenario[stage]["peak_rss_kib"] > 0
+        assert scenario["join"]["items"] == scenario["grouping"]["items"]
@@ -0,0 +1,105 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy
+import pytest
+
+from join_vcfs.binary_cache import get_binary_cache_path, read_binary_cache
+from join_vcfs.vcf_parser import parse_vcf
+
+VCF = b"""##fileformat=VCFv4.5
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001\tNA00002
+1\t3\trs1\tG\tA\t20\tPASS\t.\tGT\t0/1\t./.
+1\t5\t.\tGATCG\tG\t.\tPASS\t.\tGT:DP\t0/1:3\t1/1:4
+1\t12\trs3\tT\tC,CT\t30\tPASS\t.\tGT\t1|2\t0/0
+2\t4\t.\tA\t.\t20\tPASS\t.\tGT\t0/0\t0/12
+2\t15\t.\tC\tT\t20\tPASS\t.\tGT\t0/1\t0/0
+"""
+
+
+def _parse_vars(vcf_path, **kwargs):
+    res = parse_vcf(vcf_path, **kwargs)
+    vars = [
+        (
+            var["chrom"],
+            var["pos"],
+            var["alleles"],
+            var["id"],
+            None if numpy.isnan(var["qual"]) else var["qual"],
+            var["gts"].tolist(),
+            var["missing_mask"].tolist(),
+        )
+        for var in res["vars"]
+    ]
+    res["fhand"].close()
+    return res["metadata"], vars
+
+
+def test_binary_cache():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_path = Path(tmp_dir) / "sample.vcf"
+        vcf_path.write_bytes(VCF)
+        cache_dir = Path(tmp_dir) / "cache"
+        cache_path = get_binary_cache_path(cache_dir, vcf_path)
+
+        _, expected = _parse_vars(vcf_path)
+        metadata, vars = _parse_vars(vcf_path, binary_cache_dir=cache_dir)
+        assert vars == expected
+        assert list(metadata["samples"]) == ["NA00001", "NA00002"]
+        assert metadata["ploidy"] == 2
+        assert cache_path.exists()
+
+        # the cache is read without parsing the VCF again
+        cache_mtime = cache_path.stat().st_mtime_ns
+        _, vars = _parse_vars(vcf_path, binary_cache_dir=cache_dir)
+        assert vars == expected
+        assert cache_path.stat().st_mtime_ns == cache_mtime
+
+        for region in ["1:5-12", "1:7", "2", "3"]:
+            _, vars = _parse_vars(vcf_path, binary_cache_dir=cache_dir, region=region)
+            assert vars == _parse_vars(vcf_path, region=region)[1]
+
+        res = parse_vcf(vcf_path, binary_cache_dir=cache_dir, as_batches=True)
+        batch = next(res["var_batches"])
+        assert batch.poss.tolist() == [3, 5, 12, 4, 15]
+        assert batch.ids[0] == "rs1"
+        assert batch.ids[1] is None
+
+        # a touched VCF keeps its cache, a modified one gets it rebuilt
+        stat = vcf_path.stat()
+        os.utime(vcf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        cache_inode = cache_path.stat().st_ino
+        assert read_binary_cache(cache_path, vcf_path) is not None
+        # the new mtime is not written in place, the cache is replaced
+        assert cache_path.stat().st_ino != cache_inode
+        cache_inode = cache_path.stat().st_ino
+        assert read_binary_cache(cache_path, vcf_path) is not None
+        assert cache_path.stat().st_ino == cache_inode
+        vcf_path.write_bytes(VCF.replace(b"1\t3\trs1", b"1\t4\trs1"))
+        assert read_binary_cache(cache_path, vcf_path) is None
+        _, vars = _parse_vars(vcf_path, binary_cache_dir=cache_dir)
+        assert vars[0][1] == 4
+        assert read_binary_cache(cache_path, vcf_path) is not None
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason="root can write read only files")
+def test_read_only_binary_cache():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_path = Path(tmp_dir) / "sample.vcf"
+        vcf_path.write_bytes(VCF)
+        cache_dir = Path(tmp_dir) / "cache"
+        cache_path = get_binary_cache_path(cache_dir, vcf_path)
+        _, expected = _parse_vars(vcf_path, binary_cache_dir=cache_dir)
+
+        stat = vcf_path.stat()
+        os.utime(vcf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        cache_path.chmod(0o444)
+        cache_dir.chmod(0o555)
+        try:
+            # a touched VCF is checked by its content, the cache is not updated
+            assert read_binary_cache(cache_path, vcf_path) is not None
+            _, vars = _parse_vars(vcf_path, binary_cache_dir=cache_dir)
+            assert vars == expected
+        finally:
+            cache_dir.chmod(0o755)
@@ -0,0 +1,60 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from join_vcfs.contigs import (
+    reconcile_contig_tables,
+    get_vcf_contig_table,
+    infer_contig_table,
+)
+
+HEADER = b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001\n"
+
+
+def test_reconcile_contig_tables():
+    tables = [
+        {"chr1": 100, "chr2": None, "chr4": 40},
+        {"chr2": 200, "chr3": None, "chr4": None},
+        {"scaffold_1": 5},
+    ]
+    assert reconcile_contig_tables(tables) == {
+        "chr1": 100,
+        "chr2": 200,
+        "chr3": None,
+        "chr4": 40,
+        "scaffold_1": 5,
+    }
+    # the contigs only ordered in a later table go after the first ones found
+    assert list(reconcile_contig_tables([{"b": None}, {"a": None, "b": None}])) == [
+        "a",
+        "b",
+    ]
+    assert reconcile_contig_tables([]) == {}
+
+    with pytest.raises(ValueError):
+        reconcile_contig_tables([{"chr1": None, "chr2": None}, {"chr2": None, "chr1": None}])
+    with pytest.raises(ValueError):
+        reconcile_contig_tables([{"chr1": 100}, {"chr1": 101}])
+
+
+def test_infer_contig_table():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path1 = Path(tmp_dir) / "1.vcf"
+        path1.write_bytes(
+            b"##fileformat=VCFv4.5\n##contig=<ID=2,length=20>\n##contig=<ID=10>\n"
+            + HEADER
+        )
+        path2 = Path(tmp_dir) / "2.vcf"
+        path2.write_bytes(
+            b"##contig=<ID=1,length=30>\n##contig=<ID=2,length=20>\n"
+            + HEADER
+            + b"1\t1\t.\tA\tT\t.\t.\t.\tGT\t0/1\n"
+        )
+        assert get_vcf_contig_table(path1) == {"2": 20, "10": None}
+        assert infer_contig_table([path1, path2]) == {"1": 30, "2": 20, "10": None}
+
+        path3 = Path(tmp_dir) / "3.vcf"
+        path3.write_bytes(HEADER)
+        with pytest.raises(ValueError):
+            infer_contig_table([path1, path3])
@@ -0,0 +1,66 @@
+import gzip
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from join_vcfs.bgzf import BGZFWriter
+from join_vcfs.file_pool import FileHandlePool
+from join_vcfs.vcf_parser import parse_vcf
+
+
+def _create_vcf(sample, num_vars):
+    lines = [f"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{sample}"]
+    for pos in range(1, num_vars + 1):
+        lines.append(f"1\t{pos}\t.\tG\tA\t20\tPASS\t.\tGT\t0/{pos % 2}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _write_vcf(path, vcf, compression):
+    if compression == "bgzf":
+        with BGZFWriter(path.open("wb")) as fhand:
+            # small writes, so the lines are split between several blocks
+            for start in range(0, len(vcf), 1000):
+                fhand.write(vcf[start : start + 1000])
+                fhand.flush()
+    elif compression == "gzip":
+        path.write_bytes(gzip.compress(vcf))
+    else:
+        path.write_bytes(vcf)
+
+
+def test_file_pool():
+    compressions = ["plain", "gzip", "bgzf", "bgzf"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_paths = []
+        for idx, compression in enumerate(compressions):
+            vcf_path = Path(tmp_dir) / f"sample{idx}.vcf"
+            _write_vcf(vcf_path, _create_vcf(f"sample{idx}", 300), compression)
+            vcf_paths.append(vcf_path)
+
+        expected = []
+        for vcf_path in vcf_paths:
+            res = parse_vcf(vcf_path, num_decompression_threads=1)
+            expected.append([(var["pos"], var["gts"].tolist()) for var in res["vars"]])
+            res["fhand"].close()
+
+        with FileHandlePool(max_open_files=2, read_ahead_size=512) as pool:
+            results = [parse_vcf(vcf_path, file_pool=pool) for vcf_path in vcf_paths]
+            var_iters = [res["vars"] for res in results]
+            # the vars are read interleaved, so the files are evicted and reopened
+            vars = [[] for _ in vcf_paths]
+            for _ in range(300):
+                for idx, var_iter in enumerate(var_iters):
+                    var = next(var_iter)
+                    vars[idx].append((var["pos"], var["gts"].tolist()))
+            for res in results:
+                res["fhand"].close()
+            assert vars == expected
+            assert pool.stats["max_open_files"] == 2
+            assert pool.stats["reopens"] > 0
+            assert pool.stats["evictions"] > 0
+
+
+def test_file_pool_wrong_size():
+    with pytest.raises(ValueError):
+        FileHandlePool(max_open_files=0)
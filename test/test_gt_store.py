@@ -0,0 +1,94 @@
+import tempfile
+from pathlib import Path
+
+import numpy
+import pytest
+
+from join_vcfs.gt_store import (
+    write_gt_store,
+    read_gt_store,
+    concatenate_gt_store_parts,
+    GTStoreWriter,
+)
+from join_vcfs.vcf_parser import sparsify_gts
+
+
+def _create_vars():
+    return [
+        {
+            "chrom": "20",
+            "pos": 5,
+            "alleles": ["G", "A", "T"],
+            "gts": numpy.array([[0, 1], [-1, 2]]),
+            "missing_mask": numpy.array([[False, False], [True, False]]),
+        },
+        {
+            "chrom": "20",
+            "pos": 7,
+            "alleles": ["C"],
+            "gts": numpy.array([[0, 0], [0, 0]]),
+            "missing_mask": numpy.array([[False, False], [False, False]]),
+        },
+        {
+            "chrom": "21",
+            "pos": 9,
+            "alleles": ["C", "A", "T", "G", "GA", "GC", "GT", "CA", "CT", "CG", "TT"],
+            "gts": numpy.array([[0, 10], [-1, -1]]),
+            "missing_mask": numpy.array([[False, False], [True, True]]),
+        },
+    ]
+
+
+def test_gt_store():
+    vars = _create_vars()
+    # the sparse GTs are expanded into the chunks
+    sparse_var = dict(vars[1], gts=sparsify_gts(vars[1]["gts"], 0), missing_mask=None)
+    expected_gts = numpy.array([var["gts"] for var in vars])
+    expected_missing_mask = numpy.array([var["missing_mask"] for var in vars])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for compress_chunks in (False, True):
+            store_dir = Path(tmp_dir) / f"store_{compress_chunks}"
+            write_gt_store(
+                store_dir,
+                [vars[0], sparse_var, vars[2]],
+                samples=["S1", "S2"],
+                ploidy=2,
+                chromosomes=["20", "21"],
+                chunk_size=2,
+                compress_chunks=compress_chunks,
+            )
+            store = read_gt_store(store_dir)
+            assert store.samples == ["S1", "S2"]
+            assert store.num_chunks == 2
+            assert store.arrays["poss"].tolist() == [5, 7, 9]
+            assert store.arrays["chrom_codes"].tolist() == [0, 0, 1]
+            assert store.get_var_alleles(2) == vars[2]["alleles"]
+            chunk_gts, chunk_missing_mask = store.get_chunk(1)
+            assert chunk_gts.tolist() == expected_gts[2:].tolist()
+            assert chunk_missing_mask.tolist() == expected_missing_mask[2:].tolist()
+            if compress_chunks:
+                assert store.gts is None
+            else:
+                # the whole GT array is mapped
+                assert isinstance(store.gts, numpy.memmap)
+                assert store.gts.tolist() == expected_gts.tolist()
+                assert store.missing_mask.tolist() == expected_missing_mask.tolist()
+
+        joined_dir = Path(tmp_dir) / "joined"
+        part_dirs = [Path(tmp_dir) / "store_False", Path(tmp_dir) / "store_True"]
+        concatenate_gt_store_parts(joined_dir, part_dirs, chunk_size=4)
+        store = read_gt_store(joined_dir)
+        assert [len(chunk_gts) for chunk_gts, _ in map(store.get_chunk, range(2))] == [4, 2]
+        assert store.gts.tolist() == expected_gts.tolist() * 2
+        assert [var["pos"] for var in store.iter_vars()] == [5, 7, 9] * 2
+
+        empty_dir = Path(tmp_dir) / "empty"
+        write_gt_store(empty_dir, [], ["S1", "S2"], 2, ["20"])
+        assert read_gt_store(empty_dir).gts.shape == (0, 2, 2)
+
+        # a store that failed while written has no header
+        with pytest.raises(ValueError):
+            with GTStoreWriter(store_dir, ["S1", "S2"], 2, ["20"]) as writer:
+                writer.add_var(vars[2])
+        with pytest.raises(ValueError):
+            read_gt_store(store_dir)
@@ -0,0 +1,43 @@
+import time
+
+from join_vcfs.metrics import JoinMetrics, sum_metrics_reports, get_parse_cache_hit_rates
+from join_vcfs.vcf_joining import VarGroup
+
+
+def _slow_items(items, seconds):
+    for item in items:
+        time.sleep(seconds)
+        yield item
+
+
+def test_stage_times_are_exclusive():
+    metrics = JoinMetrics()
+    read_items = metrics.time_iter("read", _slow_items(range(3), 0.01))
+    with metrics.stage("write"):
+        assert list(metrics.time_iter("merge", read_items)) == [0, 1, 2]
+    stages = metrics.get_report()["stages"]
+    assert stages["read"]["wall"] >= 0.03
+    assert stages["merge"]["wall"] < stages["read"]["wall"]
+    assert stages["write"]["wall"] < stages["read"]["wall"]
+    assert stages["parse"]["wall"] == 0
+
+
+def test_group_counters_and_progress():
+    messages = []
+    metrics = JoinMetrics(progress_interval=0, progress_callback=messages.append)
+    var_groups = [
+        VarGroup({0: [{}], 1: [{}, {}]}, ("20", pos, pos + pos % 5)) for pos in range(2048)
+    ]
+    assert len(list(metrics.track_var_groups(var_groups))) == 2048
+    report = metrics.get_report()
+    assert report["groups"]["num_groups"] == 2048
+    assert report["groups"]["elongation_loop_iterations"] == 3 * 2048
+    assert report["groups"]["size_histogram"] == {"4": 2048}
+    assert list(report["groups"]["span_histogram"]) == ["1", "2", "4", "8"]
+    assert len(messages) == 2
+    assert messages[0].startswith("20:1023\t")
+
+    summed = sum_metrics_reports([report, None, report])
+    assert summed["groups"]["num_groups"] == 2 * 2048
+    assert summed["groups"]["size_histogram"] == {"4": 2 * 2048}
+    assert get_parse_cache_hit_rates({"gt": {"hits": 3, "misses": 1}}) == {"gt": 0.75}
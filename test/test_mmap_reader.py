@@ -0,0 +1,79 @@
+import os
+import tempfile
+from pathlib import Path
+
+from join_vcfs.mmap_reader import MmapLineReader, can_map_file
+from join_vcfs.vcf_parser import parse_vcf, _open_vcf
+
+LINES = [b"line1\n", b"a longer line2\n", b"\n", b"line4\n", b"l5"]
+
+
+def test_mmap_line_reader():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "lines.txt"
+        path.write_bytes(b"".join(LINES))
+
+        # the small chunks make the lines cross them
+        with MmapLineReader(path.open("rb"), scan_chunk_size=4) as reader:
+            assert list(reader) == LINES
+            reader.seek(len(LINES[0]))
+            assert next(reader) == LINES[1]
+            assert reader.tell() == len(LINES[0]) + len(LINES[1])
+
+            reader.seek(0)
+            blocks = list(reader.iter_line_blocks(2))
+            assert list(map(len, blocks)) == [2, 2, 1]
+            lines = [block.get_line(idx) for block in blocks for idx in range(len(block))]
+            # the last line gets its newline
+            assert lines == LINES[:-1] + [b"l5\n"]
+            assert isinstance(blocks[0].buffer, memoryview)
+        assert reader.closed
+
+        path.write_bytes(b"".join(LINES[:-1]))
+        with MmapLineReader(path.open("rb")) as reader:
+            reader.seek(len(LINES[0]))
+            blocks = list(reader.iter_line_blocks(10))
+            assert len(blocks) == 1
+            assert bytes(blocks[0].buffer) == b"".join(LINES[1:-1])
+
+
+def test_can_map_file():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "empty.txt"
+        path.write_bytes(b"")
+        with path.open("rb") as fhand:
+            assert not can_map_file(fhand)
+        path.write_bytes(b"#")
+        with path.open("rb") as fhand:
+            assert can_map_file(fhand)
+
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, "rb") as read_fhand, os.fdopen(write_fd, "wb"):
+        assert not can_map_file(read_fhand)
+
+
+VCF = b"""##fileformat=VCFv4.5
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001\tNA00002
+20\t1\t.\tG\tA\t20\tPASS\t.\tGT\t0|0\t1/1
+20\t3\t.\tA\tG,T\t20\tPASS\t.\tGT:DP\t.|2:3\t0/1:4
+20\t8\t.\tGAT\tG\t20\tPASS\t.\tGT\t10/1\t0/1
+"""
+
+
+def test_mapped_vcf_parsing():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "in.vcf"
+        path.write_bytes(VCF)
+        with _open_vcf(path) as fhand:
+            assert isinstance(fhand, MmapLineReader)
+
+        result = parse_vcf(path)
+        vars = list(result["vars"])
+        result["fhand"].close()
+        assert [var["pos"] for var in vars] == [1, 3, 8]
+        assert vars[1]["alleles"] == ["A", "G", "T"]
+        assert vars[2]["gts"].tolist() == [[10, 1], [0, 1]]
+
+        result = parse_vcf(path, lazy_vars=True)
+        assert [var.pos for var in result["vars"]] == [1, 3, 8]
+        result["fhand"].close()
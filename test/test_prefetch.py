@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from join_vcfs.prefetch import Prefetcher
+
+
+def _failing_items():
+    yield 1
+    raise RuntimeError("read error")
+
+
+def test_prefetch():
+    with Prefetcher(queue_size=2) as prefetcher:
+        items = prefetcher.prefetch(range(100), lambda item: 1)
+        assert list(items) == list(range(100))
+        assert prefetcher.get_stats()["num_items"] == 100
+
+        items = prefetcher.prefetch(_failing_items(), lambda item: 1)
+        assert next(items) == 1
+        with pytest.raises(RuntimeError):
+            next(items)
+
+
+def test_prefetch_memory_budget():
+    num_threads = threading.active_count()
+    prefetcher = Prefetcher(queue_size=10, memory_budget=250)
+    inputs = [prefetcher.prefetch(range(20), lambda item: 100) for _ in range(3)]
+    # the inputs are consumed alternately, every one has at least an item
+    # queued even if the others fill the budget
+    for expected in range(20):
+        assert [next(items) for items in inputs] == [expected] * 3
+    stats = prefetcher.get_stats()
+    assert stats["budget_waits"] > 0
+    assert stats["max_used_bytes"] <= 250 + 3 * 100
+
+    # the producers blocked by the budget or by full queues are stopped
+    unread = [prefetcher.prefetch(range(1000), lambda item: 1) for _ in range(2)]
+    assert next(unread[0]) == 0
+    prefetcher.close()
+    assert threading.active_count() == num_threads
+
+    with pytest.raises(ValueError):
+        Prefetcher(queue_size=0)
+
+
+def test_prefetch_thread_pool():
+    num_threads = threading.active_count()
+    # the inputs share the threads of the pool, one is enough for all of them
+    with Prefetcher(queue_size=2, num_threads=1) as prefetcher:
+        inputs = [prefetcher.prefetch(range(50), lambda item: 1) for _ in range(10)]
+        for expected in range(50):
+            assert [next(items) for items in inputs] == [expected] * 10
+            assert threading.active_count() <= num_threads + 1
+        assert all(next(items, None) is None for items in inputs)
+    assert threading.active_count() == num_threads
+
+    with pytest.raises(ValueError):
+        Prefetcher(num_threads=0)
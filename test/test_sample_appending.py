@@ -0,0 +1,140 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from join_vcfs.sample_appending import append_samples
+from join_vcfs.vcf_joining import join_vcfs
+
+OLD_VCFS = [
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1
+1\t3\t.\tG\tA\t20\tPASS\t.\tGT\t0/.
+1\t6\t.\tA\tT\t20\tPASS\t.\tGT\t0/1
+1\t12\t.\tT\tC\t20\tPASS\t.\tGT\t1/1
+2\t4\t.\tA\tT\t20\tPASS\t.\tGT\t0/1""",
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS2
+1\t5\t.\tGATCG\tG\t20\tPASS\t.\tGT\t0/1
+2\t4\t.\tA\tG\t20\tPASS\t.\tGT\t1/1""",
+]
+
+# The new var at 1:3 joins the groups at 1:3 and 1:5 of the joined VCF. S1
+# has a missing call in the first one and S3 in its second var, they are
+# kept missing.
+NEW_VCFS = [
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS3
+1\t3\t.\tGTG\tG\t20\tPASS\t.\tGT\t0/1
+1\t7\t.\tT\tC\t20\tPASS\t.\tGT\t./0
+2\t15\t.\tC\tT\t20\tPASS\t.\tGT\t0/1""",
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS4
+1\t20\t.\tC\tCA\t20\tPASS\t.\tGT\t0/1
+2\t4\t.\tA\tT\t20\tPASS\t.\tGT\t0/1""",
+]
+
+
+def _write_vcfs(vcfs, dir_path, prefix):
+    paths = []
+    for idx, vcf in enumerate(vcfs):
+        path = Path(dir_path) / f"{prefix}{idx}.vcf"
+        path.write_bytes(vcf)
+        paths.append(path)
+    return paths
+
+
+def test_append_samples():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        old_paths = _write_vcfs(OLD_VCFS, tmp_dir, "old")
+        new_paths = _write_vcfs(NEW_VCFS, tmp_dir, "new")
+        joined_path = Path(tmp_dir) / "joined.vcf"
+        join_vcfs(old_paths, ["1", "2"], joined_path)
+        all_joined_path = Path(tmp_dir) / "all_joined.vcf"
+        join_vcfs(old_paths + new_paths, ["1", "2"], all_joined_path)
+        expected = all_joined_path.read_bytes()
+
+        appended_path = Path(tmp_dir) / "appended.vcf"
+        stats = append_samples(joined_path, new_paths, ["1", "2"], appended_path)
+        assert appended_path.read_bytes() == expected
+        lines = appended_path.read_bytes().splitlines()
+        assert b"1\t3\t.\tGTGATCG\tGTGTTCG,GTG,GATCG\t.\t.\t.\tGT\t0/.\t0/2\t./3\t./." in lines
+        # only the group at 1:12 is copied from the joined VCF
+        assert stats == {"num_copied_vars": 1, "num_merged_vars": 4}
+
+        cache_dir = Path(tmp_dir) / "cache"
+        appended_path = Path(tmp_dir) / "appended_from_cache.vcf"
+        append_samples(
+            joined_path,
+            new_paths,
+            ["1", "2"],
+            appended_path,
+            binary_cache_dir=cache_dir,
+        )
+        assert appended_path.read_bytes() == expected
+
+        appended_path = Path(tmp_dir) / "appended_with_ref.vcf"
+        append_samples(
+            joined_path, new_paths, ["1", "2"], appended_path, old_samples_fill="ref"
+        )
+        lines = appended_path.read_bytes().splitlines()
+        assert b"1\t20\t.\tC\tCA\t.\t.\t.\tGT\t0/0\t0/0\t./.\t0/1" in lines
+        assert b"2\t15\t.\tC\tT\t.\t.\t.\tGT\t0/0\t0/0\t0/1\t./." in lines
+
+        with pytest.raises(RuntimeError):
+            append_samples(joined_path, old_paths[:1], ["1", "2"], appended_path)
+
+
+# a joined VCF with overlapping vars, as the ones split by the group limits
+JOINED_OVERLAPPING_VCF = b"""##fileformat=VCFv4.5
+##contig=<ID=1>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2
+1\t3\t.\tGAT\tG\t.\t.\t.\tGT\t0/1\t./.
+1\t4\t.\tA\tC\t.\t.\t.\tGT\t./.\t1/.
+"""
+
+
+def test_append_samples_to_overlapping_vars():
+    # the groups without new vars are copied, even if they have several vars
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        joined_path = Path(tmp_dir) / "joined.vcf"
+        joined_path.write_bytes(JOINED_OVERLAPPING_VCF)
+        new_paths = _write_vcfs(NEW_VCFS[1:], tmp_dir, "new")
+        for binary_cache_dir in (None, Path(tmp_dir) / "cache"):
+            appended_path = Path(tmp_dir) / "appended.vcf"
+            stats = append_samples(
+                joined_path,
+                new_paths,
+                ["1", "2"],
+                appended_path,
+                binary_cache_dir=binary_cache_dir,
+            )
+            assert stats == {"num_copied_vars": 2, "num_merged_vars": 2}
+            lines = appended_path.read_bytes().splitlines()
+            assert lines[-4:-1] == [
+                b"1\t3\t.\tGAT\tG\t.\t.\t.\tGT\t0/1\t./.\t./.",
+                b"1\t4\t.\tA\tC\t.\t.\t.\tGT\t./.\t1/.\t./.",
+                b"1\t20\t.\tC\tCA\t.\t.\t.\tGT\t./.\t./.\t0/1",
+            ]
+
+
+JOINED_ANNOTATED_VCF = b"""##fileformat=VCFv4.2
+##FILTER=<ID=PASS,Description="All filters passed">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##contig=<ID=1,length=100>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1
+1\t3\trs1\tG\tA\t30\tPASS\tDP=10\tGT\t0/1
+"""
+
+
+def test_append_samples_keeps_header():
+    # the copied lines keep the metadata lines that describe them
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        joined_path = Path(tmp_dir) / "joined.vcf"
+        joined_path.write_bytes(JOINED_ANNOTATED_VCF)
+        new_paths = _write_vcfs(NEW_VCFS[1:], tmp_dir, "new")
+        appended_path = Path(tmp_dir) / "appended.vcf"
+        append_samples(joined_path, new_paths, ["1", "2"], appended_path)
+        lines = appended_path.read_bytes().splitlines()
+        assert lines[:7] == JOINED_ANNOTATED_VCF.splitlines()[:5] + [
+            b"##contig=<ID=2>",
+            b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS4",
+        ]
+        assert lines[7] == b"1\t3\trs1\tG\tA\t30\tPASS\tDP=10\tGT\t0/1\t./."
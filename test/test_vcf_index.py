@@ -0,0 +1,114 @@
+import struct
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from join_vcfs.bgzf import BGZFWriter
+from join_vcfs.vcf_index import (
+    _reg2bins,
+    parse_region,
+    read_vcf_index,
+    TABIX_MAGIC,
+)
+from join_vcfs.vcf_parser import parse_vcf
+from join_vcfs.file_pool import FileHandlePool
+
+HEADER = b"""##fileformat=VCFv4.5
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001
+"""
+
+CHROM_VARS = {
+    "1": b"""1\t3\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+1\t8\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+""",
+    "2": b"""2\t1\t.\tGATCGATC\tA\t20\tPASS\t.\tGT\t0/1
+2\t12\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+2\t20\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+""",
+    "3": b"""3\t5\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+""",
+}
+
+
+def _build_tabix_index(contig_chunks):
+    names = b"".join(name.encode() + b"\x00" for name in contig_chunks)
+    index = TABIX_MAGIC + struct.pack("<i", len(contig_chunks))
+    index += struct.pack("<7i", 2, 1, 2, 0, ord("#"), 0, len(names)) + names
+    for chunk_start, chunk_end in contig_chunks.values():
+        # a single bin, the root one, holding the whole contig
+        index += struct.pack("<iIi", 1, 0, 1) + struct.pack("<QQ", chunk_start, chunk_end)
+        index += struct.pack("<iQ", 1, chunk_start)
+    return index
+
+
+def _write_indexed_vcf(vcf_path):
+    contig_chunks = {}
+    with open(vcf_path, "wb") as raw_fhand:
+        writer = BGZFWriter(raw_fhand)
+        writer.write(HEADER)
+        writer.flush()
+        for chrom, vars in CHROM_VARS.items():
+            start = raw_fhand.tell() << 16
+            writer.write(vars)
+            writer.flush()
+            contig_chunks[chrom] = (start, raw_fhand.tell() << 16)
+        writer.close()
+
+    with open(str(vcf_path) + ".tbi", "wb") as index_fhand:
+        with BGZFWriter(index_fhand) as writer:
+            writer.write(_build_tabix_index(contig_chunks))
+    return contig_chunks
+
+
+def test_reg2bins():
+    assert _reg2bins(0, 1, 14, 5) == [0, 1, 9, 73, 585, 4681]
+    assert _reg2bins(0, 1 << 14, 14, 5) == [0, 1, 9, 73, 585, 4681]
+    assert _reg2bins(0, (1 << 14) + 1, 14, 5) == [0, 1, 9, 73, 585, 4681, 4682]
+
+
+def test_parse_region():
+    assert parse_region("chr1") == ("chr1", None, None)
+    assert parse_region("chr1:1,000-2000") == ("chr1", 1000, 2000)
+    assert parse_region("chr1:1000") == ("chr1", 1000, None)
+    assert parse_region(("chr1", 10, 20)) == ("chr1", 10, 20)
+    with pytest.raises(ValueError):
+        parse_region("chr1:20-10")
+
+
+def test_region_parsing():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_path = Path(tmp_dir) / "vars.vcf.gz"
+        contig_chunks = _write_indexed_vcf(vcf_path)
+
+        index = read_vcf_index(Path(str(vcf_path) + ".tbi"))
+        assert index["contigs"] == ["1", "2", "3"]
+        assert index["contig_offsets"] == contig_chunks
+
+        res = parse_vcf(vcf_path, region="2")
+        assert res["index"]["contigs"] == ["1", "2", "3"]
+        assert [var["pos"] for var in res["vars"]] == [1, 12, 20]
+        res["fhand"].close()
+
+        res = parse_vcf(vcf_path, region="2:5-12")
+        assert [var["pos"] for var in res["vars"]] == [1, 12]
+        res["fhand"].close()
+
+        with FileHandlePool(max_open_files=1) as pool:
+            res = parse_vcf(vcf_path, region="2:5-12", file_pool=pool)
+            assert [var["pos"] for var in res["vars"]] == [1, 12]
+            res["fhand"].close()
+
+        res = parse_vcf(vcf_path, region="3:6")
+        assert list(res["vars"]) == []
+        res["fhand"].close()
+
+        res = parse_vcf(vcf_path, region="4")
+        assert list(res["vars"]) == []
+        res["fhand"].close()
+
+        Path(str(vcf_path) + ".tbi").unlink()
+        res = parse_vcf(vcf_path, region="2:13-")
+        assert res["index"] is None
+        assert [var["pos"] for var in res["vars"]] == [20]
+        res["fhand"].close()
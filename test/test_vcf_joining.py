@@ -1,9 +1,19 @@
+import gzip
+import json
 import tempfile
 from pathlib import Path
 
 import pytest
 
-from join_vcfs.vcf_joining import _create_vcf_infos, _group_overlapping_vars
+from join_vcfs import vcf_joining
+from join_vcfs.vcf_joining import (
+    create_vcf_infos,
+    join_vcfs,
+    GroupLimits,
+    _RefBlocks,
+)
+from join_vcfs.gt_store import read_gt_store
+from join_vcfs.vcf_writer import write_vcf
 
 VCF1 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001
 20\t1\t.\tG\tA\t20\tPASS\t.\tGT\t0|0
@@ -36,10 +46,14 @@ VCF5 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00005
 20\t20\t.\tG\tA\t20\tPASS\t.\tGT\t0|0"""
 
 
-def group_overlapping_vars(vcf_paths, sorted_chromosomes):
+def group_overlapping_vars(vcf_paths, sorted_chromosomes, group_limits=None):
     remaining_chromosomes = sorted_chromosomes[:]
-    vcf_infos = _create_vcf_infos(vcf_paths)
-    var_bins = list(_group_overlapping_vars(vcf_infos, remaining_chromosomes))
+    vcf_infos = create_vcf_infos(vcf_paths)
+    var_bins = list(
+        vcf_joining.group_overlapping_vars(
+            vcf_infos, remaining_chromosomes, group_limits
+        )
+    )
     bin_spans = [bin.span for bin in var_bins]
     bin_vars = [bin.vars for bin in var_bins]
 
@@ -133,6 +147,47 @@ VCF_WITH_WRONG_CHROMOSOME_ORDER = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tI
 1\t20\t.\tG\tA\t20\tPASS\t.\tGT\t0|0"""
 
 
+def test_binning_with_and_without_var_batches():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp6,
+        tempfile.NamedTemporaryFile() as tmp7,
+    ):
+        vcf_paths = [
+            write_in_temp_file(tmp1, VCF1),
+            write_in_temp_file(tmp6, VCF6),
+            write_in_temp_file(tmp7, VCF7),
+        ]
+        var_groups = []
+        for use_var_batches, lazy_vars in ((True, False), (False, False), (False, True)):
+            vcf_infos = create_vcf_infos(
+                vcf_paths, use_var_batches=use_var_batches, lazy_vars=lazy_vars
+            )
+            var_groups.append(
+                list(vcf_joining.group_overlapping_vars(vcf_infos, ["20", "22"]))
+            )
+        batch_groups, iter_groups, lazy_groups = var_groups
+        # the lazy vars are grouped without parsing their GTs
+        assert all(
+            var._gts is None
+            for group in lazy_groups
+            for vars in group.vars.values()
+            for var in vars
+        )
+        assert [group.span for group in batch_groups] == [
+            group.span for group in iter_groups
+        ]
+        assert [group.span for group in lazy_groups] == [
+            group.span for group in iter_groups
+        ]
+        for batch_group, iter_group in zip(batch_groups + batch_groups, iter_groups + lazy_groups):
+            assert batch_group.vars.keys() == iter_group.vars.keys()
+            for vcf_id, vars in batch_group.vars.items():
+                for batch_var, iter_var in zip(vars, iter_group.vars[vcf_id]):
+                    assert batch_var["alleles"] == iter_var["alleles"]
+                    assert (batch_var["gts"] == iter_var["gts"]).all()
+
+
 def test_wrong_chrom_order():
     with (
         tempfile.NamedTemporaryFile() as tmp1,
@@ -161,6 +216,507 @@ def test_wrong_order():
             group_overlapping_vars([tmp1_path], sorted_chromosomes=["1"])
 
 
+VCF6 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00006
+20\t2\t.\tGATC\tA\t20\tPASS\t.\tGT\t0|1
+20\t9\t.\tGA\tG\t20\tPASS\t.\tGT\t0|1"""
+
+VCF7 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00007
+20\t5\t.\tGATC\tA\t20\tPASS\t.\tGT\t0|1
+20\t11\t.\tG\tA\t20\tPASS\t.\tGT\t0|1
+22\t1\t.\tG\tA\t20\tPASS\t.\tGT\t0|1"""
+
+
+def test_binning_with_chained_overlaps():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp6,
+        tempfile.NamedTemporaryFile() as tmp7,
+    ):
+        tmp1_path = write_in_temp_file(tmp1, VCF1)
+        tmp6_path = write_in_temp_file(tmp6, VCF6)
+        tmp7_path = write_in_temp_file(tmp7, VCF7)
+
+        bin_spans, bin_vars = group_overlapping_vars(
+            [tmp1_path, tmp6_path, tmp7_path], sorted_chromosomes=["20", "22"]
+        )
+        assert bin_spans == [
+            ("20", 1, 1),
+            ("20", 2, 8),
+            ("20", 9, 10),
+            ("20", 11, 11),
+            ("22", 1, 1),
+        ]
+        assert {vcf_id: len(vars) for vcf_id, vars in bin_vars[1].items()} == {
+            0: 5,
+            1: 1,
+            2: 1,
+        }
+
+
+def test_binning_with_group_limits():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp6,
+        tempfile.NamedTemporaryFile() as tmp7,
+    ):
+        tmp1_path = write_in_temp_file(tmp1, VCF1)
+        tmp6_path = write_in_temp_file(tmp6, VCF6)
+        tmp7_path = write_in_temp_file(tmp7, VCF7)
+        vcf_paths = [tmp1_path, tmp6_path, tmp7_path]
+
+        bin_spans, bin_vars = group_overlapping_vars(
+            vcf_paths, ["20", "22"], GroupLimits(max_vars=3)
+        )
+        assert bin_spans == [
+            ("20", 1, 1),
+            ("20", 2, 5),
+            ("20", 4, 4),
+            ("20", 5, 8),
+            ("20", 9, 10),
+            ("20", 11, 11),
+            ("22", 1, 1),
+        ]
+        assert max(sum(map(len, vars.values())) for vars in bin_vars) == 3
+
+        bin_spans = group_overlapping_vars(
+            vcf_paths, ["20", "22"], GroupLimits(max_span=2)
+        )[0]
+        assert bin_spans[1] == ("20", 2, 5)
+
+        # the flagged groups are not split
+        bin_spans = group_overlapping_vars(
+            vcf_paths, ["20", "22"], GroupLimits(max_vars=3, policy="flag")
+        )[0]
+        assert bin_spans[1] == ("20", 2, 8)
+
+        # the smallest limits leave a var per group
+        unlimited_spans = group_overlapping_vars(vcf_paths, ["20", "22"])[0]
+        for limits in (GroupLimits(max_span=1), GroupLimits(max_vars=1)):
+            bin_spans, bin_vars = group_overlapping_vars(vcf_paths, ["20", "22"], limits)
+            assert [sum(map(len, vars.values())) for vars in bin_vars] == [1] * 11
+            flagged_spans = group_overlapping_vars(
+                vcf_paths, ["20", "22"], limits._replace(policy="flag")
+            )[0]
+            assert flagged_spans == unlimited_spans
+
+
+def test_chrom_not_in_given_order():
+    with (
+        tempfile.NamedTemporaryFile() as tmp7,
+    ):
+        tmp7_path = write_in_temp_file(tmp7, VCF7)
+
+        with pytest.raises(RuntimeError):
+            group_overlapping_vars([tmp7_path], sorted_chromosomes=["20"])
+
+
+VCF8 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00008
+20\t3\t.\tA\tT,G\t20\tPASS\t.\tGT\t1|2
+20\t8\t.\tG\tA\t20\tPASS\t.\tGT\t0|0
+20\t20\t.\tG\tA\t20\tPASS\t.\tGT\t0|0"""
+
+
+def test_join_vcfs():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp8,
+        tempfile.TemporaryDirectory() as tmp_dir,
+    ):
+        tmp1_path = write_in_temp_file(tmp1, VCF1)
+        tmp8_path = write_in_temp_file(tmp8, VCF8)
+        out_path = Path(tmp_dir) / "joined.vcf"
+
+        join_vcfs([tmp1_path, tmp8_path], ["20"], out_path)
+        lines = out_path.read_bytes().splitlines()
+        assert lines[3] == b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001\tNA00008"
+        assert lines[4:] == [
+            b"20\t1\t.\tG\tA\t.\t.\t.\tGT\t0/0\t./.",
+            b"20\t2\t.\tT\tA\t.\t.\t.\tGT\t./0\t./.",
+            b"20\t3\t.\tA\tG,T\t.\t.\t.\tGT\t./0\t2/1",
+            b"20\t4\t.\tT\t.\t.\t.\t.\tGT\t0/0\t./.",
+            b"20\t5\t.\tG\tA\t.\t.\t.\tGT\t0/1\t./.",
+            b"20\t6\t.\tG\tA\t.\t.\t.\tGT\t0/1\t./.",
+            b"20\t8\t.\tG\tA\t.\t.\t.\tGT\t./.\t0/0",
+            b"20\t20\t.\tG\tA\t.\t.\t.\tGT\t./.\t0/0",
+        ]
+
+        pooled_out_path = Path(tmp_dir) / "joined_with_pool.vcf"
+        stats = join_vcfs([tmp1_path, tmp8_path], ["20"], pooled_out_path, max_open_files=1)
+        assert pooled_out_path.read_bytes() == out_path.read_bytes()
+        assert stats["file_pool"]["max_open_files"] == 1
+        assert stats["file_pool"]["reopens"] > 0
+
+        report_path = Path(tmp_dir) / "metrics.json"
+        stats = join_vcfs(
+            [tmp1_path, tmp8_path], ["20"], out_path, metrics_report_path=report_path
+        )
+        report = json.loads(report_path.read_text())
+        assert report == stats["metrics"]
+        assert report["lines_parsed"] == {str(tmp1_path): 6, str(tmp8_path): 3}
+        assert report["groups"]["num_groups"] == 8
+        assert set(report["stages"]) == {"read", "parse", "prefetch_wait", "group", "merge", "write"}
+        assert report["parse_cache_hit_rates"]["gt"] is not None
+
+        prefetched_path = Path(tmp_dir) / "joined_prefetched.vcf"
+        for max_open_files, prefetch_threads in ((None, 4), (1, 1)):
+            stats = join_vcfs(
+                [tmp1_path, tmp8_path],
+                ["20"],
+                prefetched_path,
+                max_open_files=max_open_files,
+                prefetch_queue_size=1,
+                prefetch_threads=prefetch_threads,
+            )
+            assert prefetched_path.read_bytes() == out_path.read_bytes()
+            assert stats["prefetch"]["num_items"] == 2
+        with pytest.raises(ValueError):
+            join_vcfs(
+                [tmp1_path, tmp8_path],
+                ["20"],
+                prefetched_path,
+                prefetch_queue_size=1,
+                prefetch_threads=0,
+            )
+
+        sparse_out_path = Path(tmp_dir) / "joined_sparse.vcf"
+        join_vcfs([tmp1_path, tmp8_path], ["20"], sparse_out_path, sparse_gts=True)
+        assert sparse_out_path.read_bytes() == out_path.read_bytes()
+
+
+VCF_CHAIN1 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001
+20\t1\t.\tGATC\tG\t20\tPASS\t.\tGT\t0/1
+20\t5\t.\tGAT\tG\t20\tPASS\t.\tGT\t0/1
+20\t9\t.\tGAT\tG\t20\tPASS\t.\tGT\t0/1
+20\t30\t.\tA\tT\t20\tPASS\t.\tGT\t0/1"""
+
+VCF_CHAIN2 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00002
+20\t3\t.\tTCG\tT\t20\tPASS\t.\tGT\t0/1
+20\t7\t.\tTCG\tT\t20\tPASS\t.\tGT\t0/1
+20\t11\t.\tTC\tT\t20\tPASS\t.\tGT\t0/1"""
+
+
+def test_join_vcfs_with_group_limits():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp2,
+        tempfile.TemporaryDirectory() as tmp_dir,
+    ):
+        vcf_paths = [
+            write_in_temp_file(tmp1, VCF_CHAIN1),
+            write_in_temp_file(tmp2, VCF_CHAIN2),
+        ]
+        out_path = Path(tmp_dir) / "joined.vcf"
+        stats = join_vcfs(vcf_paths, ["20"], out_path)
+        assert stats["groups"] is None
+
+        flagged_path = Path(tmp_dir) / "joined_flagged.vcf"
+        stats = join_vcfs(
+            vcf_paths, ["20"], flagged_path, max_group_vars=3, long_group_policy="flag"
+        )
+        assert flagged_path.read_bytes() == out_path.read_bytes()
+        assert stats["groups"]["num_groups"] == 2
+        assert stats["groups"]["num_long_groups"] == 1
+        assert stats["groups"]["max_vars"] == 6
+        assert stats["groups"]["long_groups"] == [["20", 1, 12, 6]]
+
+        # the split groups overlap
+        split_path = Path(tmp_dir) / "joined_split.vcf"
+        stats = join_vcfs(vcf_paths, ["20"], split_path, max_group_vars=3)
+        assert stats["groups"]["num_groups"] == 3
+        assert stats["groups"]["max_vars"] == 3
+        assert stats["groups"]["long_groups"] == [["20", 1, 7, 3], ["20", 7, 12, 3]]
+        lines = split_path.read_bytes().splitlines()
+        assert [line.split(b"\t")[1] for line in lines[4:]] == [b"1", b"7", b"30"]
+
+        for limit in ("max_group_span", "max_group_vars"):
+            stats = join_vcfs(vcf_paths, ["20"], split_path, **{limit: 1})
+            assert stats["groups"]["num_groups"] == 7
+            assert stats["groups"]["max_vars"] == 1
+            stats = join_vcfs(
+                vcf_paths, ["20"], flagged_path, long_group_policy="flag", **{limit: 1}
+            )
+            assert flagged_path.read_bytes() == out_path.read_bytes()
+            assert stats["groups"]["num_long_groups"] == 2
+
+        with pytest.raises(ValueError):
+            join_vcfs(vcf_paths, ["20"], split_path, max_group_vars=3, long_group_policy="drop")
+        with pytest.raises(ValueError):
+            join_vcfs(vcf_paths, ["20"], split_path, max_group_span=0)
+
+
+VCF_CONTIGS1 = b"""##contig=<ID=2,length=30>
+##contig=<ID=1,length=20>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001
+2\t5\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+1\t3\t.\tG\tA\t20\tPASS\t.\tGT\t0/1"""
+
+VCF_CONTIGS2 = b"""##contig=<ID=2,length=30>
+##contig=<ID=1,length=20>
+##contig=<ID=scaffold_1>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00002
+2\t25\t.\tC\tT\t20\tPASS\t.\tGT\t1/1
+scaffold_1\t2\t.\tC\tT\t20\tPASS\t.\tGT\t0/1"""
+
+
+def test_join_vcfs_with_contig_order():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp2,
+        tempfile.TemporaryDirectory() as tmp_dir,
+    ):
+        vcf_paths = [
+            write_in_temp_file(tmp1, VCF_CONTIGS1),
+            write_in_temp_file(tmp2, VCF_CONTIGS2),
+        ]
+        out_path = Path(tmp_dir) / "joined.vcf"
+        join_vcfs(vcf_paths, None, out_path)
+        lines = out_path.read_bytes().splitlines()
+        assert b"##contig=<ID=scaffold_1>" in lines
+        assert [line.split(b"\t")[:2] for line in lines if not line.startswith(b"#")] == [
+            [b"2", b"5"],
+            [b"2", b"25"],
+            [b"1", b"3"],
+            [b"scaffold_1", b"2"],
+        ]
+
+        # the contig lengths are used to plan the shards
+        parallel_out_path = Path(tmp_dir) / "joined_parallel.vcf"
+        join_vcfs(
+            vcf_paths, None, parallel_out_path, num_processes=2, shard_window_size=10
+        )
+        assert parallel_out_path.read_bytes() == out_path.read_bytes()
+
+
+GVCF1 = b"""##contig=<ID=20,length=60>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001
+20\t1\t.\tG\t<NON_REF>\t.\t.\tEND=9\tGT\t0/0
+20\t10\t.\tA\tC,<NON_REF>\t.\t.\t.\tGT\t0/2
+20\t11\t.\tT\t<NON_REF>\t.\t.\tEND=20\tGT\t0/0
+20\t21\t.\tT\t<NON_REF>\t.\t.\tEND=30\tGT\t0/0
+20\t31\t.\tG\t<NON_REF>\t.\t.\tEND=40\tGT\t./."""
+
+GVCF2 = b"""##contig=<ID=20,length=60>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00002
+20\t1\t.\tG\t<NON_REF>\t.\t.\tEND=14\tGT\t0/0
+20\t15\t.\tC\tG,<NON_REF>\t.\t.\t.\tGT\t1/1
+20\t16\t.\tA\t<NON_REF>\t.\t.\tEND=19\tGT\t0/0
+20\t20\t.\tTT\tT,<NON_REF>\t.\t.\t.\tGT\t0/1
+20\t22\t.\tA\t<NON_REF>\t.\t.\tEND=32\tGT\t0/0
+20\t33\t.\tT\tA,<NON_REF>\t.\t.\t.\tGT\t0/1
+20\t34\t.\tA\t<NON_REF>\t.\t.\tEND=50\tGT\t0/0"""
+
+
+def test_ref_blocks():
+    ref_blocks = _RefBlocks()
+    ref_blocks.add(0, 0, 1, 10, "A")
+    ref_blocks.add(1, 0, 5, 8, "B")
+    ref_blocks.add(1, 0, 9, 9, "C")
+    # the adjacent blocks with the same GTs are joined
+    ref_blocks.add(0, 0, 11, 20, "A")
+    assert ref_blocks.get_covering_gts(0, 3, 3, set()) == {0: "A"}
+    assert ref_blocks.get_covering_gts(0, 6, 7, {0}) == {1: "B"}
+    assert ref_blocks.get_covering_gts(0, 8, 9, set()) == {0: "A"}
+    assert ref_blocks.get_covering_gts(0, 9, 9, set()) == {0: "A", 1: "C"}
+    assert ref_blocks.get_covering_gts(0, 15, 16, set()) == {0: "A"}
+    assert ref_blocks.get_covering_gts(0, 21, 21, set()) == {}
+    ref_blocks.add(1, 1, 1, 5, "D")
+    assert ref_blocks.get_covering_gts(1, 2, 2, set()) == {1: "D"}
+
+
+def test_join_gvcfs():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp2,
+        tempfile.TemporaryDirectory() as tmp_dir,
+    ):
+        vcf_paths = [write_in_temp_file(tmp1, GVCF1), write_in_temp_file(tmp2, GVCF2)]
+        out_path = Path(tmp_dir) / "joined.vcf"
+        join_vcfs(vcf_paths, ["20"], out_path, gvcf=True)
+        lines = out_path.read_bytes().splitlines()
+        # the deletion at 20 spans the two adjacent blocks of the first gVCF
+        assert [line for line in lines if not line.startswith(b"#")] == [
+            b"20\t10\t.\tA\tC\t.\t.\t.\tGT\t0/.\t0/0",
+            b"20\t15\t.\tC\tG\t.\t.\t.\tGT\t0/0\t1/1",
+            b"20\t20\t.\tTT\tT\t.\t.\t.\tGT\t0/0\t0/1",
+            b"20\t33\t.\tT\tA\t.\t.\t.\tGT\t./.\t0/1",
+        ]
+
+        sparse_out_path = Path(tmp_dir) / "joined_sparse.vcf"
+        join_vcfs(vcf_paths, ["20"], sparse_out_path, gvcf=True, sparse_gts=True)
+        assert sparse_out_path.read_bytes() == out_path.read_bytes()
+
+        # the blocks that start before a shard cover its vars
+        parallel_out_path = Path(tmp_dir) / "joined_parallel.vcf"
+        join_vcfs(
+            vcf_paths,
+            ["20"],
+            parallel_out_path,
+            num_processes=2,
+            shard_window_size=12,
+            chrom_lengths={"20": 60},
+            gvcf=True,
+        )
+        assert parallel_out_path.read_bytes() == out_path.read_bytes()
+
+        with pytest.raises(NotImplementedError):
+            join_vcfs(vcf_paths, ["20"], out_path, gvcf=True, tree_fan_in=2)
+
+
+VCF_SHARD1 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001
+1\t3\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+1\t5\t.\tGATCG\tG\t20\tPASS\t.\tGT\t0/1
+1\t12\t.\tT\tC\t20\tPASS\t.\tGT\t1/1
+2\t4\t.\tA\tT\t20\tPASS\t.\tGT\t0/1"""
+
+VCF_SHARD2 = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00002
+1\t7\t.\tT\tA\t20\tPASS\t.\tGT\t0/1
+1\t10\t.\tC\tG\t20\tPASS\t.\tGT\t0/1
+1\t11\t.\tA\tC\t20\tPASS\t.\tGT\t0/1
+2\t4\t.\tA\tG\t20\tPASS\t.\tGT\t1/1
+2\t15\t.\tC\tT\t20\tPASS\t.\tGT\t0/1"""
+
+
+def test_parallel_join_vcfs():
+    with (
+        tempfile.NamedTemporaryFile() as tmp1,
+        tempfile.NamedTemporaryFile() as tmp2,
+        tempfile.TemporaryDirectory() as tmp_dir,
+    ):
+        tmp1_path = write_in_temp_file(tmp1, VCF_SHARD1)
+        tmp2_path = write_in_temp_file(tmp2, VCF_SHARD2)
+        vcf_paths = [tmp1_path, tmp2_path]
+        serial_path = Path(tmp_dir) / "serial.vcf"
+        join_vcfs(vcf_paths, ["1", "2"], serial_path)
+        expected = serial_path.read_bytes()
+        assert expected.count(b"\n1\t") == 5
+        assert b"\n1\t5\t.\tGATCG\tG,GAACG\t" in expected
+
+        parallel_path = Path(tmp_dir) / "by_chrom.vcf"
+        join_vcfs(vcf_paths, ["1", "2"], parallel_path, num_processes=2)
+        assert parallel_path.read_bytes() == expected
+
+        for window_size in (1, 5, 6):
+            parallel_path = Path(tmp_dir) / "by_window.vcf.gz"
+            join_vcfs(
+                vcf_paths,
+                ["1", "2"],
+                parallel_path,
+                num_processes=2,
+                shard_window_size=window_size,
+                chrom_lengths={"1": 20, "2": 20},
+            )
+            assert gzip.decompress(parallel_path.read_bytes()) == expected
+
+        cache_dir = Path(tmp_dir) / "cache"
+        for num_processes in (1, 2):
+            cached_path = Path(tmp_dir) / "cached.vcf"
+            join_vcfs(
+                vcf_paths,
+                ["1", "2"],
+                cached_path,
+                num_processes=num_processes,
+                binary_cache_dir=cache_dir,
+            )
+            assert cached_path.read_bytes() == expected
+
+        # the vars written into a GT store are those of the VCF
+        for num_processes in (1, 2):
+            store_dir = Path(tmp_dir) / f"store_{num_processes}"
+            join_vcfs(
+                vcf_paths,
+                ["1", "2"],
+                store_dir,
+                num_processes=num_processes,
+                shard_window_size=5,
+                chrom_lengths={"1": 20, "2": 20},
+                gt_store=True,
+                gt_store_chunk_size=2,
+                compress_gt_store_chunks=num_processes == 2,
+            )
+            store = read_gt_store(store_dir)
+            store_vcf_path = Path(tmp_dir) / "store.vcf"
+            write_vcf(store_vcf_path, store.iter_vars(), store.samples, 2, ["1", "2"])
+            assert store_vcf_path.read_bytes() == expected
+
+        with pytest.raises(NotImplementedError):
+            join_vcfs(vcf_paths, ["1", "2"], store_dir, gt_store=True, tree_fan_in=2)
+
+
+TREE_VCFS = [
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1
+1\t3\t.\tG\tA\t20\tPASS\t.\tGT\t0/1
+1\t5\t.\tG\tC\t20\tPASS\t.\tGT\t./1
+1\t12\t.\tT\tC\t20\tPASS\t.\tGT\t1/1
+2\t4\t.\tA\tT\t20\tPASS\t.\tGT\t0/1""",
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS2
+1\t5\t.\tGATCG\tG\t20\tPASS\t.\tGT\t0/1
+2\t4\t.\tA\tG\t20\tPASS\t.\tGT\t1/1""",
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS3
+1\t7\t.\tT\tA\t20\tPASS\t.\tGT\t0/.
+1\t12\t.\tT\tG\t20\tPASS\t.\tGT\t0/1""",
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS4
+1\t3\t.\tGTG\tG\t20\tPASS\t.\tGT\t1/1
+2\t15\t.\tC\tT\t20\tPASS\t.\tGT\t0/1""",
+    b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS5
+1\t8\t.\tC\tCA\t20\tPASS\t.\tGT\t0/1
+2\t4\t.\tA\tT\t20\tPASS\t.\tGT\t0/1""",
+]
+
+
+def _resolve_gt_alleles(vcf):
+    # the ALT order depends on the join order, so the GTs are compared as alleles
+    lines = []
+    for line in vcf.decode().splitlines():
+        if line.startswith("#"):
+            lines.append(line)
+            continue
+        fields = line.split("\t")
+        alleles = [fields[3]] + fields[4].split(",")
+        gts = [
+            "/".join(allele if allele == "." else alleles[int(allele)] for allele in gt.split("/"))
+            for gt in fields[9:]
+        ]
+        lines.append("\t".join(fields[:2] + [fields[3]] + gts))
+    return lines
+
+
+def test_tree_join_vcfs():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_paths = []
+        for idx, vcf in enumerate(TREE_VCFS):
+            vcf_path = Path(tmp_dir) / f"sample{idx}.vcf"
+            vcf_path.write_bytes(vcf)
+            vcf_paths.append(vcf_path)
+        flat_path = Path(tmp_dir) / "flat.vcf"
+        join_vcfs(vcf_paths, ["1", "2"], flat_path)
+        expected = _resolve_gt_alleles(flat_path.read_bytes())
+        assert expected[5] == "1\t3\tGTGATCG\t./ATCATCG\tGTGATCG/GTG\tGTGATCG/.\tGATCG/GATCG\tGTGATCG/GTGATCAG"
+
+        levels_dir = Path(tmp_dir) / "levels"
+        levels_dir.mkdir()
+        for fan_in, num_processes, sparse_gts in (
+            (2, 1, False),
+            ([2, 3], 2, False),
+            (4, 1, False),
+            (2, 1, True),
+        ):
+            tree_path = Path(tmp_dir) / "tree.vcf"
+            join_vcfs(
+                vcf_paths,
+                ["1", "2"],
+                tree_path,
+                num_processes=num_processes,
+                tree_fan_in=fan_in,
+                tree_tmp_dirs=levels_dir,
+                sparse_gts=sparse_gts,
+            )
+            assert _resolve_gt_alleles(tree_path.read_bytes()) == expected
+            assert not list(levels_dir.iterdir())
+
+        with pytest.raises(ValueError):
+            join_vcfs(vcf_paths, ["1", "2"], tree_path, tree_fan_in=1)
+
+
 # TODO
 #
 # ------
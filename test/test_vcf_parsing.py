@@ -4,13 +4,27 @@ from pathlib import Path
 import math
 
 import numpy
+import pytest
 
 from join_vcfs.vcf_parser import (
     parse_vcf,
     _guess_vcf_file_kind,
-    _VCFKind,
+    VCFKind,
     _parse_metadata,
+    _parse_contig_line,
+    read_vcf_contigs,
+    _parse_var_line,
+    _parse_var_batch,
+    iter_batch_vars,
+    ParseCaches,
+    MISSING_ALLELE,
+    ABSENT_ALLELE,
+    densify_gts,
+    sparsify_gts,
+    GTBuffers,
+    LazyVar,
 )
+from join_vcfs.bgzf import BGZFWriter
 
 VCF_45 = b"""##fileformat=VCFv4.5
 ##fileDate=20090805
@@ -44,13 +58,19 @@ def test_vcf_file_type():
         tmp.write(VCF_45)
         tmp.flush()
         tmp_path = Path(tmp.name)
-        assert _guess_vcf_file_kind(tmp_path) == _VCFKind.VCF
+        assert _guess_vcf_file_kind(tmp_path) == VCFKind.VCF
 
     with tempfile.NamedTemporaryFile(delete=False) as tmp:
         tmp.write(gzip.compress(VCF_45))
         tmp.flush()
         tmp_path = Path(tmp.name)
-        assert _guess_vcf_file_kind(tmp_path) == _VCFKind.GzippedVCF
+        assert _guess_vcf_file_kind(tmp_path) == VCFKind.GzippedVCF
+
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        with BGZFWriter(open(tmp.name, "wb")) as bgzf_fhand:
+            bgzf_fhand.write(VCF_45)
+        tmp_path = Path(tmp.name)
+        assert _guess_vcf_file_kind(tmp_path) == VCFKind.BGZippedVCF
 
 
 def test_metadata_parser():
@@ -62,6 +82,16 @@ def test_metadata_parser():
         assert len(metadata["samples"]) == 3
         assert numpy.array_equal(metadata["samples"], ["NA00001", "NA00002", "NA00003"])
         assert metadata["ploidy"] == 2
+        assert metadata["contigs"] == {"20": 62435964}
+        assert read_vcf_contigs(tmp_path) == {"20": 62435964}
+
+    assert _parse_contig_line(b'##contig=<ID=chr1,species="a, b",length=10>\n') == (
+        "chr1",
+        10,
+    )
+    assert _parse_contig_line(b"##contig=<ID=chrUn_1>\n") == ("chrUn_1", None)
+    with pytest.raises(ValueError):
+        _parse_contig_line(b"##contig=<length=10>\n")
 
 
 def test_vcf_parser():
@@ -86,3 +116,269 @@ def test_vcf_parser():
         )
         assert numpy.array_equal(snp["gts"], [[-1, 0], [0, 1], [0, 0]])
         assert math.isnan(snp["qual"])
+
+
+def test_bgzf_vcf_parser():
+    header, var_lines = VCF_45.split(b"#CHROM")
+    header += b"#CHROM" + var_lines.split(b"\n", 1)[0] + b"\n"
+    var_lines = var_lines.split(b"\n", 1)[1].splitlines()
+    vcf = header + b"\n".join(var_lines * 2000)
+
+    with tempfile.NamedTemporaryFile() as tmp:
+        with BGZFWriter(open(tmp.name, "wb")) as bgzf_fhand:
+            bgzf_fhand.write(vcf)
+        tmp_path = Path(tmp.name)
+
+        for num_threads in (1, 3):
+            res = parse_vcf(tmp_path, num_decompression_threads=num_threads)
+            vars = list(res["vars"])
+            res["fhand"].close()
+            assert len(vars) == len(var_lines) * 2000
+            assert [var["pos"] for var in vars[-6:]] == [
+                14370,
+                17330,
+                1110696,
+                1230237,
+                1234567,
+                1234567,
+            ]
+            assert numpy.array_equal(vars[-5]["gts"], [[-1, 0], [0, 1], [0, 0]])
+
+
+def test_lazy_vars():
+    with tempfile.NamedTemporaryFile() as tmp:
+        tmp.write(VCF_45)
+        tmp.flush()
+        res = parse_vcf(Path(tmp.name), lazy_vars=True)
+        lazy_vars = list(res["vars"])
+        res["fhand"].close()
+        res = parse_vcf(Path(tmp.name))
+        vars = list(res["vars"])
+        res["fhand"].close()
+
+        assert len(lazy_vars) == len(vars)
+        lazy_var = lazy_vars[4]
+        assert (lazy_var.chrom, lazy_var.pos, lazy_var.ref_len) == ("20", 1234567, 3)
+        assert lazy_var._alleles is None and lazy_var._gts is None
+        for lazy_var, var in zip(lazy_vars, vars):
+            for key in ("chrom", "pos", "alleles", "id"):
+                assert lazy_var[key] == var[key]
+            assert numpy.array_equal(lazy_var["gts"], var["gts"])
+            assert numpy.array_equal(lazy_var["missing_mask"], var["missing_mask"])
+        assert dict(lazy_vars[0])["line"].startswith(b"20\t14370\t")
+        with pytest.raises(KeyError):
+            lazy_vars[0]["unknown"]
+
+        with pytest.raises(ValueError):
+            parse_vcf(Path(tmp.name), lazy_vars=True, as_batches=True)
+
+
+def test_vcf_parser_opens_each_file_once():
+    compressors = {
+        "plain": lambda vcf: vcf,
+        "gzip": gzip.compress,
+        "bgzf": None,
+    }
+    expected_poss = [14370, 17330, 1110696, 1230237, 1234567, 1234567]
+    for kind, compress in compressors.items():
+        with tempfile.NamedTemporaryFile() as tmp:
+            if compress is None:
+                with BGZFWriter(open(tmp.name, "wb")) as bgzf_fhand:
+                    bgzf_fhand.write(VCF_45)
+            else:
+                with open(tmp.name, "wb") as fhand:
+                    fhand.write(compress(VCF_45))
+            tmp_path = Path(tmp.name)
+
+            opened_paths = []
+            path_open = Path.open
+
+            def counting_open(path, *args, **kwargs):
+                opened_paths.append(path)
+                return path_open(path, *args, **kwargs)
+
+            Path.open = counting_open
+            try:
+                res = parse_vcf(tmp_path, num_decompression_threads=1)
+                vars = list(res["vars"])
+                res["fhand"].close()
+            finally:
+                Path.open = path_open
+            assert opened_paths == [tmp_path], kind
+            assert [var["pos"] for var in vars] == expected_poss, kind
+            assert res["metadata"]["ploidy"] == 2
+
+
+def test_batch_var_line_parser():
+    rng = numpy.random.default_rng(42)
+    # the absent alleles are found in the tree join intermediates
+    gt_strs = [b"0/0", b"0/1", b"1|1", b"./.", b".|1", b"2/1", b"-/-"]
+    irregular_gt_strs = [b"10/1", b"1", b"./.:", b"0/12"]
+    num_samples = 20
+    lines = []
+    for pos in range(1, 101):
+        gts = [gt_strs[idx] for idx in rng.integers(len(gt_strs), size=num_samples)]
+        if pos % 7 == 0:
+            gts[rng.integers(num_samples)] = irregular_gt_strs[pos % 4]
+        if pos % 3:
+            fmt, gts = b"GT:DP", [gt + b":12" for gt in gts]
+        else:
+            fmt = b"GT"
+        if pos % 11 == 0:
+            fmt, gts = b"DP:GT", [b"3:" + gt for gt in gts]
+        line = b"\t".join(
+            [b"20", str(pos).encode(), b"rs1", b"A", b"C,T", b"30", b"PASS", b".", fmt]
+            + gts
+        )
+        lines.append(line + b"\n")
+    lines[-1] = lines[-1].rstrip(b"\n")
+
+    batch_vars = list(
+        iter_batch_vars(_parse_var_batch(tuple(lines), num_samples, ploidy=2))
+    )
+    assert len(batch_vars) == len(lines)
+    for line, batch_var in zip(lines, batch_vars):
+        var = _parse_var_line(line, num_samples, ploidy=2)
+        assert batch_var["pos"] == var["pos"]
+        assert batch_var["alleles"] == ["A", "C", "T"]
+        assert batch_var["id"] == "rs1"
+        assert numpy.array_equal(batch_var["gts"], var["gts"])
+        assert numpy.array_equal(batch_var["missing_mask"], var["missing_mask"])
+        assert numpy.array_equal(var["gts"] < 0, var["missing_mask"])
+        for fill in (0, MISSING_ALLELE, ABSENT_ALLELE):
+            sparse_var = _parse_var_line(line, num_samples, ploidy=2, sparse_fill=fill)
+            assert numpy.array_equal(densify_gts(sparse_var["gts"]), var["gts"])
+            assert numpy.array_equal(
+                sparsify_gts(var["gts"], fill).idxs, sparse_var["gts"].idxs
+            )
+
+    # the first lines are all decoded at once, the rest also one by one
+    for batch_lines in (lines[:6], lines):
+        for fill in (0, MISSING_ALLELE, ABSENT_ALLELE):
+            sparse_batch = _parse_var_batch(
+                tuple(batch_lines), num_samples, ploidy=2, sparse_fill=fill
+            )
+            assert sparse_batch.gts is None
+            sparse_vars = list(iter_batch_vars(sparse_batch, sparse_fill=fill))
+            assert len(sparse_vars) == len(batch_lines)
+            for sparse_var, batch_var in zip(sparse_vars, batch_vars):
+                expected_gts = sparsify_gts(batch_var["gts"], fill)
+                assert numpy.array_equal(sparse_var["gts"].idxs, expected_gts.idxs)
+                assert numpy.array_equal(sparse_var["gts"].values, expected_gts.values)
+            dense_vars = iter_batch_vars(sparse_batch)
+            for dense_var, batch_var in zip(dense_vars, batch_vars):
+                assert numpy.array_equal(dense_var["gts"], batch_var["gts"])
+                assert numpy.array_equal(
+                    dense_var["missing_mask"], batch_var["missing_mask"]
+                )
+
+
+def test_gt_buffers():
+    lines = [
+        b"20\t1\t.\tA\tC\t.\t.\t.\tGT\t0/1\t./1\n",
+        b"20\t2\t.\tA\tC\t.\t.\t.\tGT:DP\t1|1:3\t0/0:1\n",
+        b"20\t3\t.\tA\tC\t.\t.\t.\tGT\t12/0\t0/0\n",
+    ]
+    gt_buffers = GTBuffers(num_samples=2, ploidy=2, num_slots=2)
+    vars = [_parse_var_line(line, 2, 2, gt_buffers=gt_buffers) for line in lines]
+    expected_vars = [_parse_var_line(line, 2, 2) for line in lines]
+    for var, expected_var in zip(vars[1:], expected_vars[1:]):
+        assert numpy.array_equal(var["gts"], expected_var["gts"])
+        assert numpy.array_equal(var["missing_mask"], expected_var["missing_mask"])
+    # the first slot has been reused by the third line
+    assert numpy.shares_memory(vars[0]["gts"], vars[2]["gts"])
+    assert numpy.array_equal(vars[0]["gts"], expected_vars[2]["gts"])
+
+
+def test_var_batches():
+    with tempfile.NamedTemporaryFile() as tmp:
+        tmp.write(VCF_45)
+        tmp.flush()
+        res = parse_vcf(Path(tmp.name), as_batches=True)
+        batches = list(res["var_batches"])
+        assert len(batches) == 1
+        batch = batches[0]
+        assert batch.chroms == ["20"]
+        assert numpy.array_equal(batch.chrom_codes, [0] * 6)
+        assert numpy.array_equal(batch.poss[:2], [14370, 17330])
+        assert numpy.array_equal(batch.ends[4:], [1234569, 1234569])
+        assert batch.gts.shape == (6, 3, 2)
+        assert batch.alleles_buffer[: batch.allele_offsets[5]] == b"GATAA"
+        assert numpy.array_equal(batch.var_allele_offsets[:4], [0, 2, 4, 7])
+        assert batch.ids[:2] == ["rs6054257", None]
+
+        vars = list(iter_batch_vars(batch))
+        assert vars[2]["alleles"] == ["A", "G", "T"]
+        assert numpy.array_equal(vars[1]["gts"], [[-1, 0], [0, 1], [0, 0]])
+        sparse_gts = list(iter_batch_vars(batch, sparse_fill=0))[1]["gts"]
+        assert sparse_gts.idxs.tolist() == [0, 3]
+        assert sparse_gts.values.tolist() == [-1, 1]
+
+
+def test_parse_caches():
+    caches = ParseCaches({"gt": 2})
+    assert caches.parse_gt(b"0/1") == (False, ((False, 0), (False, 1)))
+    assert caches.parse_gt(b"0|1") == (True, ((False, 0), (False, 1)))
+    # the phasing is kept by every file caches
+    assert caches.expect_phased
+    assert not ParseCaches().expect_phased
+    assert caches.parse_gt(b"0/1") == (False, ((False, 0), (False, 1)))
+    assert caches.parse_gt(b"1/1") == (False, ((False, 1), (False, 1)))
+    assert not caches.expect_phased
+    caches.parse_gt(b"0|1")
+    stats = caches.get_stats()
+    assert stats["gt"] == {
+        "hits": 1,
+        "misses": 4,
+        "evictions": 2,
+        "size": 2,
+        "maxsize": 2,
+    }
+    assert stats["id"]["maxsize"] == 0
+
+    with pytest.raises(ValueError):
+        ParseCaches({"unknown": 10})
+
+    with tempfile.NamedTemporaryFile() as tmp:
+        tmp.write(VCF_45)
+        tmp.flush()
+        res = parse_vcf(Path(tmp.name), parse_cache_sizes={"chrom": None, "id": 8})
+        list(res["vars"])
+        res["fhand"].close()
+        stats = res["parse_caches"].get_stats()
+        assert stats["chrom"]["maxsize"] is None
+        assert stats["id"]["misses"] == 4
+        assert stats["id"]["hits"] >= 2
+
+        # every parsing gets its own caches
+        res2 = parse_vcf(Path(tmp.name))
+        res2["fhand"].close()
+        assert res2["parse_caches"] is not res["parse_caches"]
+        assert res2["parse_caches"].get_stats()["id"]["misses"] == 0
+
+    # the lines parsed without caches do not share them
+    line = b"20\t1\t.\tA\tC\t.\t.\t.\tGT\t0|1\n"
+    assert LazyVar(line, 1, 2).gts.tolist() == [[0, 1]]
+    assert LazyVar(line, 1, 2)._caches is not LazyVar(line, 1, 2)._caches
+
+
+VCF_REF_BLOCKS = b"""#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNA00001
+20\t1\t.\tG\t<NON_REF>\t.\t.\tEND=9\tGT\t0/0
+20\t10\t.\tAT\tA,<*>\t.\t.\tDP=3\tGT\t0/1
+20\t12\t.\tC\t<*>\t.\t.\tDP=2\tGT\t0/0"""
+
+
+def test_ref_block_ends():
+    # the <*> records without END, as the ones of bcftools mpileup, span
+    # their REF
+    with tempfile.NamedTemporaryFile() as tmp:
+        tmp.write(VCF_REF_BLOCKS)
+        tmp.flush()
+        res = parse_vcf(Path(tmp.name), as_batches=True)
+        batch = next(res["var_batches"])
+        res["fhand"].close()
+        assert batch.ends.tolist() == [9, 11, 12]
+
+        res = parse_vcf(Path(tmp.name), region="20:5-12")
+        assert [var["pos"] for var in res["vars"]] == [1, 10, 12]
+        res["fhand"].close()
@@ -0,0 +1,105 @@
+import gzip
+import tempfile
+from pathlib import Path
+
+import numpy
+
+from join_vcfs.bgzf import BGZF_EOF_BLOCK, BGZF_MAX_BLOCK_DATA_SIZE
+from join_vcfs.vcf_parser import sparsify_gts
+from join_vcfs.vcf_writer import write_vcf, write_sparse_gts_matrix, Compression
+
+EXPECTED_VCF = b"""##fileformat=VCFv4.5
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##contig=<ID=20>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2
+20\t5\t.\tG\tA,T\t.\t.\t.\tGT\t0/1\t./2
+20\t7\t.\tC\t.\t.\t.\t.\tGT\t0/0\t0/0
+20\t9\t.\tC\tA,T,G,GA,GC,GT,CA,CT,CG,TT\t.\t.\t.\tGT\t0/10\t./.
+"""
+
+
+def _create_vars():
+    return [
+        {
+            "chrom": "20",
+            "pos": 5,
+            "alleles": ["G", "A", "T"],
+            "gts": numpy.array([[0, 1], [-1, 2]]),
+            "missing_mask": numpy.array([[False, False], [True, False]]),
+        },
+        {
+            "chrom": "20",
+            "pos": 7,
+            "alleles": ["C"],
+            "gts": numpy.array([[0, 0], [0, 0]]),
+            "missing_mask": numpy.array([[False, False], [False, False]]),
+        },
+        {
+            "chrom": "20",
+            "pos": 9,
+            "alleles": ["C", "A", "T", "G", "GA", "GC", "GT", "CA", "CT", "CG", "TT"],
+            "gts": numpy.array([[0, 10], [-1, -1]]),
+            "missing_mask": numpy.array([[False, False], [True, True]]),
+        },
+    ]
+
+
+def test_write_vcf():
+    for compression, read in [
+        (Compression.PLAIN, Path.read_bytes),
+        (Compression.GZIP, lambda path: gzip.decompress(path.read_bytes())),
+        (Compression.BGZF, lambda path: gzip.decompress(path.read_bytes())),
+    ]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_path = Path(tmp_dir) / "out.vcf"
+            write_vcf(
+                out_path,
+                _create_vars(),
+                samples=["S1", "S2"],
+                ploidy=2,
+                chromosomes=["20"],
+                compression=compression,
+                buffer_size=64,
+            )
+            assert read(out_path) == EXPECTED_VCF
+
+
+def test_write_sparse_gts():
+    vars = _create_vars()
+    sparse_vars = []
+    for var in vars:
+        gts = numpy.where(var["missing_mask"], -1, var["gts"])
+        sparse_vars.append(dict(var, gts=sparsify_gts(gts, 0), missing_mask=None))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = Path(tmp_dir) / "out.vcf"
+        write_vcf(out_path, sparse_vars, samples=["S1", "S2"], ploidy=2, chromosomes=["20"])
+        assert out_path.read_bytes() == EXPECTED_VCF
+
+        matrix_path = Path(tmp_dir) / "gts.npz"
+        write_sparse_gts_matrix(matrix_path, sparse_vars[:2] + vars[2:], ["S1", "S2"], 2)
+        matrix = numpy.load(matrix_path)
+        assert matrix["samples"].tolist() == ["S1", "S2"]
+        assert matrix["poss"].tolist() == [5, 7, 9]
+        assert matrix["alleles"][matrix["allele_offsets"][1] :][:1].tolist() == ["C"]
+        assert matrix["gt_fills"].tolist() == [0, 0, -1]
+        assert matrix["gt_offsets"].tolist() == [0, 3, 3, 5]
+        assert matrix["gt_idxs"].tolist() == [1, 2, 3, 0, 1]
+        assert matrix["gt_values"].tolist() == [1, -1, 2, 0, 10]
+
+
+def test_bgzf_output_blocks():
+    many_vars = _create_vars()[:1] * 20000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = Path(tmp_dir) / "out.vcf.gz"
+        write_vcf(
+            out_path,
+            many_vars,
+            samples=["S1", "S2"],
+            ploidy=2,
+            chromosomes=["20"],
+        )
+        content = out_path.read_bytes()
+        assert content.endswith(BGZF_EOF_BLOCK)
+        uncompressed = gzip.decompress(content)
+        assert len(uncompressed) > BGZF_MAX_BLOCK_DATA_SIZE
+        assert uncompressed.count(b"\n20\t5\t") == 20000